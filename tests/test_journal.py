@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+""" Test the change journal of journal.py
+
+A session is journaled the way chroot-dir.sh runs it: the watcher starts,
+the session script is copied to the root, the session changes the root,
+the script is removed and the watcher stops.
+
+Run: python3 -m unittest discover tests
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import unittest
+import subprocess
+from os.path import join, dirname, abspath
+
+LIBDIR = join(dirname(dirname(abspath(__file__))), 'usr/lib/iso_constructor')
+sys.path.insert(0, LIBDIR)
+
+from journal import read_journal  # noqa: E402
+from layers import scan_tree, save_manifest  # noqa: E402
+
+JOURNAL = join(LIBDIR, 'journal.py')
+
+
+def write(path, text):
+    ''' Write a text file. '''
+    with open(file=path, mode='w', encoding='utf-8') as fle:
+        fle.write(text)
+
+
+class TestJournal(unittest.TestCase):
+    ''' Journal upgrade-style sessions of a root directory. '''
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.root = join(self.tmp, 'root')
+        self.manifest = join(self.tmp, 'layers/manifest')
+        os.makedirs(join(self.root, 'etc'))
+        os.makedirs(join(self.root, 'var/cache/apt/archives'))
+        write(join(self.root, 'etc/hostname'), 'base\n')
+        save_manifest(self.manifest, scan_tree(self.root))
+        subprocess.run([sys.executable, JOURNAL, 'reset', self.root, self.manifest], check=True)
+        # Keep the seal apart from the changes
+        time.sleep(0.01)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def start_watcher(self):
+        ''' Start the watcher and return its pid (None when nothing is watched). '''
+        # The watcher keeps stderr open: only capture stdout
+        pid = subprocess.run([sys.executable, JOURNAL, 'watch', self.root], check=True,
+                             stdout=subprocess.PIPE, text=True).stdout.strip()
+        return int(pid) if pid else None
+
+    def stop_watcher(self, pid):
+        ''' Stop the watcher and wait until it sealed the journal. '''
+        os.kill(pid, 15)
+        for _ in range(50):
+            try:
+                os.kill(pid, 0)
+            except ProcessLookupError:
+                return
+            # Reap the watcher when it is our child
+            try:
+                os.waitpid(pid, os.WNOHANG)
+            except ChildProcessError:
+                pass
+            time.sleep(0.1)
+        self.fail('The watcher did not stop')
+
+    def run_session(self):
+        ''' Run an upgrade-style session and return the changed paths. '''
+        pid = self.start_watcher()
+        self.assertIsNotNone(pid)
+        write(join(self.root, 'upgrade.sh'), 'apt-get dist-upgrade\n')
+        write(join(self.root, 'etc/hostname'), 'changed\n')
+        write(join(self.root, 'var/cache/apt/archives/bash.deb'), 'deb\n')
+        os.remove(join(self.root, 'upgrade.sh'))
+        # The watcher flushes every second
+        time.sleep(1.5)
+        self.stop_watcher(pid)
+        return read_journal(self.root, self.manifest)
+
+    def test_session(self):
+        ''' The script of a session does not invalidate the journal. '''
+        dirty = self.run_session()
+        self.assertIsNotNone(dirty)
+        self.assertIn('etc/hostname', dirty)
+        self.assertIn('var/cache/apt/archives/bash.deb', dirty)
+
+    def test_sessions(self):
+        ''' The journal stays complete across sessions (e.g. an hourly prefetch). '''
+        self.run_session()
+        time.sleep(0.01)
+        self.assertIsNotNone(self.run_session())
+        output = subprocess.run([sys.executable, JOURNAL, 'list', self.root], check=False,
+                                capture_output=True, text=True)
+        self.assertEqual(output.returncode, 0)
+        self.assertIn('etc/hostname', output.stdout.split())
+
+    def test_outside_change(self):
+        ''' A script written before the watcher starts invalidates the journal. '''
+        write(join(self.root, 'upgrade.sh'), 'apt-get dist-upgrade\n')
+        self.assertIsNone(self.start_watcher())
+        os.remove(join(self.root, 'upgrade.sh'))
+        self.assertIsNone(read_journal(self.root, self.manifest))
+
+
+if __name__ == '__main__':
+    unittest.main()
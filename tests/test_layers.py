@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+""" Test the incremental squashfs layers of layers.py
+
+The base and the delta layer are mounted with overlayfs (as live-boot stacks them)
+and the combined view is compared with the changed tree.
+Needs root (whiteouts, mounts). The layers are squashed with mksquashfs
+when it is installed, otherwise the directories are mounted as they are.
+
+Run: sudo python3 -m unittest discover tests
+"""
+
+import os
+import sys
+import stat
+import time
+import shutil
+import tempfile
+import unittest
+import subprocess
+from os.path import join, dirname, abspath, exists
+
+LIBDIR = join(dirname(dirname(abspath(__file__))), 'usr/lib/iso_constructor')
+sys.path.insert(0, LIBDIR)
+
+
+def has_overlayfs():
+    ''' Check if overlayfs can be mounted. '''
+    if os.geteuid() != 0:
+        return False
+    with open(file='/proc/filesystems', mode='r', encoding='utf-8') as fs_fle:
+        return 'overlay' in fs_fle.read().split()
+
+
+def run(*args):
+    ''' Run a command and fail on a non-zero exit status. '''
+    subprocess.run(args, check=True, stdout=subprocess.DEVNULL)
+
+
+def write(path, text):
+    ''' Write a text file. '''
+    with open(file=path, mode='w', encoding='utf-8') as fle:
+        fle.write(text)
+
+
+def get_view(root_dir):
+    '''
+    Return dict: relative path: (type, mode, uid, gid, mtime, content)
+    content is the file data or the symlink target.
+    '''
+    view = {}
+    for dir_path, dir_names, file_names in os.walk(root_dir):
+        for name in dir_names + file_names:
+            path = join(dir_path, name)
+            st = os.lstat(path)
+            content = None
+            if stat.S_ISREG(st.st_mode):
+                with open(file=path, mode='rb') as fle:
+                    content = fle.read()
+            elif stat.S_ISLNK(st.st_mode):
+                content = os.readlink(path)
+            mtime = None if stat.S_ISLNK(st.st_mode) else st.st_mtime_ns
+            view[os.path.relpath(path, root_dir)] = (stat.S_IFMT(st.st_mode), stat.S_IMODE(st.st_mode),
+                                                     st.st_uid, st.st_gid, mtime, content)
+    return view
+
+
+@unittest.skipUnless(has_overlayfs(), 'needs root and overlayfs')
+class TestLayers(unittest.TestCase):
+    ''' Build a base and a delta layer and compare the overlay with the tree. '''
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.root = join(self.tmp, 'root')
+        self.manifest = join(self.tmp, 'layers/manifest')
+        self.mounts = []
+        os.makedirs(join(self.root, 'etc/apt'))
+        os.makedirs(join(self.root, 'usr/share/doc/old'))
+        os.makedirs(join(self.root, 'var/lib/gone/deeper'))
+        os.makedirs(join(self.root, 'opt/becomes-file'))
+        write(join(self.root, 'etc/hostname'), 'base\n')
+        write(join(self.root, 'etc/apt/sources.list'), 'deb http://deb.debian.org/debian stable main\n')
+        write(join(self.root, 'usr/share/doc/old/README'), 'old\n')
+        write(join(self.root, 'var/lib/gone/deeper/data'), 'gone\n')
+        write(join(self.root, 'opt/becomes-dir'), 'file\n')
+        write(join(self.root, 'etc/mode'), 'mode\n')
+        os.symlink('hostname', join(self.root, 'etc/link'))
+
+    def tearDown(self):
+        for mount_point in reversed(self.mounts):
+            subprocess.run(['umount', mount_point], check=False)
+        shutil.rmtree(self.tmp)
+
+    def mount(self, *args):
+        ''' Mount and unmount it when the test ends. '''
+        run('mount', *args)
+        self.mounts.append(args[-1])
+
+    def make_layer(self, source, name):
+        ''' Return the lower directory of a layer: the mounted squashfs or the source. '''
+        if not shutil.which('mksquashfs'):
+            return source
+        squashfs = join(self.tmp, f"{name}.squashfs")
+        mount_point = join(self.tmp, f"{name}.mnt")
+        os.mkdir(mount_point)
+        run('mksquashfs', source, squashfs, '-noappend', '-no-progress', '-quiet')
+        self.mount('-t', 'squashfs', '-o', 'loop,ro', squashfs, mount_point)
+        return mount_point
+
+    def change_tree(self):
+        ''' Add, modify, delete and replace paths. '''
+        # Keep the base mtimes apart from the changes
+        time.sleep(0.01)
+        write(join(self.root, 'etc/hostname'), 'changed\n')
+        write(join(self.root, 'etc/new'), 'new\n')
+        os.makedirs(join(self.root, 'usr/share/doc/new/sub'))
+        write(join(self.root, 'usr/share/doc/new/sub/README'), 'new\n')
+        os.chmod(join(self.root, 'etc/mode'), 0o600)
+        os.remove(join(self.root, 'etc/apt/sources.list'))
+        shutil.rmtree(join(self.root, 'var/lib/gone'))
+        shutil.rmtree(join(self.root, 'opt/becomes-file'))
+        write(join(self.root, 'opt/becomes-file'), 'file\n')
+        os.remove(join(self.root, 'opt/becomes-dir'))
+        os.mkdir(join(self.root, 'opt/becomes-dir'))
+        write(join(self.root, 'opt/becomes-dir/file'), 'dir\n')
+        os.remove(join(self.root, 'etc/link'))
+        os.symlink('new', join(self.root, 'etc/link'))
+
+    def build_and_compare(self, journaled):
+        ''' Build the base and the delta layer and compare the overlay with the tree. '''
+        layers = join(LIBDIR, 'layers.py')
+        journal = join(LIBDIR, 'journal.py')
+        run(sys.executable, layers, 'manifest', self.root, self.manifest)
+        # The base squashfs is a snapshot of the tree at the time of the manifest
+        base_dir = join(self.tmp, 'base')
+        run('cp', '-a', self.root, base_dir)
+        base = self.make_layer(base_dir, 'base')
+
+        if journaled:
+            run(sys.executable, journal, 'reset', self.root, self.manifest)
+            # The watcher keeps stderr open: only capture stdout
+            watcher = subprocess.run([sys.executable, journal, 'watch', self.root], check=True,
+                                     stdout=subprocess.PIPE, text=True).stdout.strip()
+            self.change_tree()
+            # The watcher flushes every second
+            time.sleep(1.5)
+            os.kill(int(watcher), 15)
+            for _ in range(50):
+                with open(file=self.root + '.journal', mode='r', encoding='utf-8') as journal_fle:
+                    if journal_fle.read().splitlines()[-1].startswith('#sealed'):
+                        break
+                time.sleep(0.1)
+        else:
+            self.change_tree()
+
+        stage_dir = join(self.tmp, 'stage')
+        output = subprocess.run([sys.executable, layers, 'delta', self.root, self.manifest, stage_dir],
+                                check=True, capture_output=True, text=True).stdout
+        self.assertEqual('> Journal:' in output, journaled)
+        self.assertTrue(exists(self.manifest + '.new'))
+        # Whiteouts for the deleted paths
+        whiteout = os.lstat(join(stage_dir, 'etc/apt/sources.list'))
+        self.assertTrue(stat.S_ISCHR(whiteout.st_mode) and whiteout.st_rdev == os.makedev(0, 0))
+        layer = self.make_layer(stage_dir, 'layer-01')
+
+        merged = join(self.tmp, 'merged')
+        os.mkdir(merged)
+        self.mount('-t', 'overlay', 'overlay', '-o', f"ro,lowerdir={layer}:{base}", merged)
+        self.assertEqual(get_view(merged), get_view(self.root))
+
+    def test_scanned_delta(self):
+        ''' Delta of a full scan of the tree. '''
+        self.build_and_compare(journaled=False)
+
+    def test_journaled_delta(self):
+        ''' Delta of the paths journaled with inotify. '''
+        self.build_and_compare(journaled=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+""" Module to create download artifacts of a new ISO
+
+Usage:
+    artifacts.py [--zsync] [--url URL] [--delta] [--slot NAME] WORKDIR ISO
+        --zsync: create ISO.zsync with zsyncmake
+        --url: URL of the directory the ISO is published in (default: relative URL)
+        --delta: create ISO.xdelta with xdelta3 against the previous ISO
+                 in WORKDIR/previous and list the non-reproducible inputs
+                 that make the delta larger.
+                 Afterwards a snapshot of the ISO content is saved for the next build.
+        --slot: keep the previous ISO and the snapshot in WORKDIR/previous/NAME
+                and WORKDIR/.iso-snapshot/NAME (one per locale of the locale matrix)
+
+build.sh moves the previous ISO and its snapshot to WORKDIR/previous
+before it builds a new ISO (XDELTA=true in build.conf).
+"""
+
+import os
+import re
+import sys
+import shutil
+import subprocess
+from glob import glob
+from os.path import join, exists, getsize, basename
+from utils import human_size
+
+SNAPSHOT_DIR = '.iso-snapshot'
+PREVIOUS_DIR = 'previous'
+# xdelta3 source window: matches are found within this distance
+MAX_SOURCE_WINDOW = 2147483648
+# Warn when the delta is larger than this percentage of the ISO
+MAX_DELTA_PERCENT = 50
+# Files that change on every build, whatever changed in the root
+VOLATILE_RE = re.compile(r'^(var/log/|var/cache/|var/lib/apt/lists/|var/lib/dhcp/|tmp/|'
+                         r'etc/machine-id$|var/lib/dbus/machine-id$|etc/ssh/ssh_host_|'
+                         r'etc/ld\.so\.cache$|etc/\w+-$|.*__pycache__/|.*\.pyc$|'
+                         r'usr/share/mime/mime\.cache$|usr/share/icons/.*/icon-theme\.cache$|'
+                         r'.*/gschemas\.compiled$|.*/fonts\.(?:dir|scale)$)')
+# unsquashfs -lls: permissions owner/group size date time squashfs-root/path
+LISTING_RE = re.compile(r'^(\S+)\s+(\S+)\s+(.+?)\s+(\d{4}-\d\d-\d\d \d\d:\d\d)\s+squashfs-root(/.*)?$')
+# Number of examples listed per kind of non-reproducible input
+MAX_EXAMPLES = 10
+
+
+def save_snapshot(work_dir, iso, slot=''):
+    ''' Save the checksums and the squashfs listings of the ISO content. '''
+    snapshot_dir = join(work_dir, SNAPSHOT_DIR, slot)
+    if slot:
+        shutil.rmtree(snapshot_dir, ignore_errors=True)
+    else:
+        # Keep the snapshots of the locale matrix
+        for path in glob(join(snapshot_dir, '*')):
+            if not os.path.isdir(path):
+                os.remove(path)
+    os.makedirs(snapshot_dir, exist_ok=True)
+    # build.sh finds the previous ISO of a slot by its name
+    with open(file=join(snapshot_dir, 'iso'), mode='w', encoding='utf-8') as iso_fle:
+        iso_fle.write(basename(iso))
+    md5sum_file = join(work_dir, 'boot/md5sum.txt')
+    if exists(md5sum_file):
+        shutil.copy2(md5sum_file, snapshot_dir)
+    with open(file=join(snapshot_dir, 'filesystem.list'), mode='w', encoding='utf-8',
+              errors='surrogateescape') as list_fle:
+        for squashfs in sorted(glob(join(work_dir, 'boot/live/*.squashfs'))):
+            list_fle.write(f"# {basename(squashfs)}\n")
+            list_fle.flush()
+            subprocess.run(['unsquashfs', '-lls', squashfs], stdout=list_fle,
+                           stderr=subprocess.DEVNULL, check=False)
+
+
+def read_md5sums(md5sum_file):
+    ''' Return dict: path: md5 of an md5sum.txt file. '''
+    md5sums = {}
+    try:
+        with open(file=md5sum_file, mode='r', encoding='utf-8',
+                  errors='surrogateescape') as md5_fle:
+            for line in md5_fle:
+                if line.startswith('#') or '  ' not in line:
+                    continue
+                md5, path = line.rstrip('\n').split('  ', 1)
+                md5sums[path[2:] if path.startswith('./') else path] = md5
+    except OSError:
+        pass
+    return md5sums
+
+
+def read_listing(list_file):
+    ''' Return dict: path: (permissions, owner, size, mtime) of a squashfs listing. '''
+    listing = {}
+    try:
+        with open(file=list_file, mode='r', encoding='utf-8', errors='surrogateescape') as list_fle:
+            for line in list_fle:
+                match = LISTING_RE.match(line.rstrip('\n'))
+                if not match or not match.group(5):
+                    continue
+                path = match.group(5)[1:].split(' -> ')[0]
+                listing[path] = match.groups()[:4]
+    except OSError:
+        pass
+    return listing
+
+
+def find_unreproducible(work_dir, slot=''):
+    '''
+    Compare the snapshots of the previous and the new ISO.
+    Returns dict: kind: list of paths
+    '''
+    previous_dir = join(work_dir, PREVIOUS_DIR, slot)
+    snapshot_dir = join(work_dir, SNAPSHOT_DIR, slot)
+    found = {'iso': [], 'timestamp': [], 'volatile': []}
+
+    old_md5 = read_md5sums(join(previous_dir, 'md5sum.txt'))
+    new_md5 = read_md5sums(join(snapshot_dir, 'md5sum.txt'))
+    for path, md5 in sorted(new_md5.items()):
+        if path in old_md5 and old_md5[path] != md5 and not path.endswith('.squashfs'):
+            found['iso'].append(path)
+
+    old_list = read_listing(join(previous_dir, 'filesystem.list'))
+    new_list = read_listing(join(snapshot_dir, 'filesystem.list'))
+    for path, attrs in sorted(new_list.items()):
+        old_attrs = old_list.get(path)
+        if not old_attrs or old_attrs == attrs:
+            continue
+        if VOLATILE_RE.match(path):
+            found['volatile'].append(path)
+        elif old_attrs[:3] == attrs[:3] and not attrs[0].startswith('d'):
+            # Same permissions, owner and size: most likely only touched
+            found['timestamp'].append(path)
+    return found
+
+
+def print_unreproducible(found):
+    ''' Print the non-reproducible inputs. '''
+    labels = {'iso': 'ISO files that differ from the previous ISO',
+              'volatile': 'Changed files that change on every build (logs, caches, keys)',
+              'timestamp': 'Files with only a new modification time'}
+    for kind, label in labels.items():
+        paths = found[kind]
+        if not paths:
+            continue
+        print(f"> {label}: {len(paths)}")
+        for path in paths[:MAX_EXAMPLES]:
+            print(f"    {path}")
+        if len(paths) > MAX_EXAMPLES:
+            print('    ...')
+
+
+def make_zsync(iso, url=None):
+    ''' Create the zsync control file of the ISO. '''
+    url = f"{url.rstrip('/')}/{basename(iso)}" if url else basename(iso)
+    command = ['zsyncmake', '-u', url, '-o', f"{iso}.zsync", iso]
+    print(' '.join(command))
+    try:
+        subprocess.run(command, check=True, cwd=os.path.dirname(os.path.abspath(iso)))
+    except (OSError, subprocess.CalledProcessError) as detail:
+        print(f"Cannot create {iso}.zsync: {detail}")
+        return False
+    return True
+
+
+def make_delta(work_dir, iso, slot=''):
+    ''' Create the binary delta of the previous ISO to the new ISO. '''
+    previous_isos = glob(join(work_dir, PREVIOUS_DIR, slot, '*.iso'))
+    if not previous_isos:
+        print('> No previous ISO: no delta created')
+        return False
+    previous_iso = previous_isos[0]
+    delta = f"{iso}.xdelta"
+    window = min(getsize(previous_iso), MAX_SOURCE_WINDOW)
+    command = ['xdelta3', '-e', '-9', '-f', '-B', str(window), '-s', previous_iso, iso, delta]
+    print(' '.join(command))
+    try:
+        subprocess.run(command, check=True)
+    except (OSError, subprocess.CalledProcessError) as detail:
+        print(f"Cannot create {delta}: {detail}")
+        return False
+    percent = 100 * getsize(delta) / getsize(iso)
+    print(f"> Delta from {basename(previous_iso)}: {human_size(getsize(delta))} "
+          f"({percent:.1f}% of {human_size(getsize(iso))})")
+    if percent > MAX_DELTA_PERCENT:
+        print('> The delta is large: check the non-reproducible inputs below')
+    return True
+
+
+def main(args):
+    ''' Command line interface. '''
+    zsync = delta = False
+    url = None
+    slot = ''
+    while args and args[0].startswith('--'):
+        if args[0] == '--delta':
+            delta = True
+            args = args[1:]
+        elif args[0] == '--zsync':
+            zsync = True
+            args = args[1:]
+        elif args[0] == '--url' and len(args) > 1:
+            url = args[1]
+            args = args[2:]
+        elif args[0] == '--slot' and len(args) > 1:
+            slot = basename(args[1])
+            args = args[2:]
+        else:
+            break
+    if len(args) != 2 or not exists(args[1]):
+        print(__doc__)
+        return 1
+    work_dir, iso = args
+
+    if zsync:
+        make_zsync(iso, url)
+    if delta:
+        save_snapshot(work_dir, iso, slot)
+        make_delta(work_dir, iso, slot)
+        print_unreproducible(find_unreproducible(work_dir, slot))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+""" Module to render the grub and isolinux boot menus of a work directory
+
+Usage:
+    bootmenu.py DISTPATH
+
+Renders boot/grub/grub.cfg, boot/grub/advanced.cfg, boot/grub/locales.cfg
+and boot/isolinux/isolinux.cfg from the templates.
+"""
+
+import os
+import re
+import sys
+import json
+import locale
+from glob import glob
+from itertools import groupby
+from os.path import join, exists, isfile, isdir, getmtime
+from utils import get_user_home
+
+SHARE_DIR = '/usr/share/iso_constructor'
+SUPPORTED_FILE = '/usr/share/i18n/SUPPORTED'
+LOCALES_DIR = '/usr/share/i18n/locales'
+
+
+def _sed_replacement(value, match):
+    ''' Process value like the replacement part of sed's s command. '''
+    out = []
+    i = 0
+    while i < len(value):
+        char = value[i]
+        if char == '\\' and i + 1 < len(value):
+            out.append({'n': '\n', 't': '\t'}.get(value[i + 1], value[i + 1]))
+            i += 2
+            continue
+        out.append(match if char == '&' else char)
+        i += 1
+    return ''.join(out)
+
+
+def _sed(text, placeholder, value, replace_all=False):
+    ''' Replace placeholder per line (first or all) like sed "s|placeholder|value|[g]". '''
+    repl = _sed_replacement(value, placeholder)
+    count = -1 if replace_all else 1
+    return '\n'.join(line.replace(placeholder, repl, count) for line in text.split('\n'))
+
+
+def _printf(fmt):
+    ''' Process a printf format string without arguments. '''
+    return re.sub(r'\\n|\\\\|%%', lambda m: {'\\n': '\n', '\\\\': '\\', '%%': '%'}[m.group(0)], fmt)
+
+
+def _quoted(line):
+    ''' Return all "quoted" values in line (grep -oP '(?<=").*?(?=")'). '''
+    return re.findall(r'(?<=").*?(?=")', line)
+
+
+def _ascii2uni(text):
+    ''' Convert <UXXXX> code points to unicode characters. '''
+    return re.sub(r'<U([0-9A-Fa-f]{4,8})>', lambda m: chr(int(m.group(1), 16)), text)
+
+
+def _sort(items):
+    ''' Sort with the locale's collation (like sort and ls). '''
+    return sorted(items, key=locale.strxfrm)
+
+
+def get_title(root_dir):
+    ''' Get the distribution description from the release files. '''
+    for release_file in _sort(glob(join(root_dir, 'etc/*release'))):
+        try:
+            with open(file=release_file, mode='r', encoding='utf-8') as rel_fle:
+                for line in rel_fle:
+                    if 'DISTRIB_DESCRIPTION' in line or 'PRETTY_NAME' in line:
+                        fields = line.rstrip('\n').split('=')
+                        value = fields[1] if len(fields) > 1 else fields[0]
+                        return value.replace('"', '')
+        except OSError:
+            continue
+    return ''
+
+
+def get_locale_catalogue(cache_file=None):
+    '''
+    Return list with [locale, native language name, English language name]
+    of all supported UTF-8 locales.
+    The catalogue is cached and rebuilt when the locales directory changes.
+    '''
+    if not isfile(SUPPORTED_FILE):
+        return None
+    mtimes = [getmtime(SUPPORTED_FILE), getmtime(LOCALES_DIR) if isdir(LOCALES_DIR) else 0]
+    if cache_file and exists(cache_file):
+        try:
+            with open(file=cache_file, mode='r', encoding='utf-8') as cache_fle:
+                cache = json.load(cache_fle)
+            if cache.get('mtimes') == mtimes:
+                return cache['catalogue']
+        except (OSError, ValueError, KeyError):
+            pass
+
+    # Loop through all supported languages and get the local and English language name
+    found = []
+    with open(file=SUPPORTED_FILE, mode='r', encoding='utf-8') as sup_fle:
+        for line in sup_fle:
+            if 'UTF-8' in line:
+                found.extend(re.findall(r'[a-z]*_[A-Z]*', line))
+    catalogue = []
+    for loc, _group in groupby(found):
+        locale_path = join(LOCALES_DIR, loc)
+        if not exists(locale_path):
+            continue
+        native, english = [], []
+        with open(file=locale_path, mode='r', encoding='utf-8', errors='replace') as loc_fle:
+            for line in loc_fle:
+                if line.startswith('lang_name'):
+                    native.extend(_quoted(line))
+                if line.startswith('language'):
+                    english.extend(_quoted(line))
+        catalogue.append([loc, _ascii2uni('\n'.join(native)), '\n'.join(english)])
+
+    if cache_file:
+        try:
+            with open(file=cache_file, mode='w', encoding='utf-8') as cache_fle:
+                json.dump({'mtimes': mtimes, 'catalogue': catalogue}, cache_fle)
+        except OSError as detail:
+            print(f"Cannot save locale cache: {detail}")
+    return catalogue
+
+
+def _language_items(catalogue, name_index):
+    ''' Return sorted list with (language name, locale). '''
+    items = [f"{row[name_index].lower()}|{row[0]}" for row in catalogue if row[name_index]]
+    return [item.split('|')[:2] for item in _sort(items)]
+
+
+def render_grub(title, catalogue):
+    ''' Generate grub.cfg, advanced.cfg and locales.cfg. '''
+    print('> Start creating grub boot configuration')
+    os.makedirs('boot/grub', exist_ok=True)
+
+    # Get installed kernels and generate menus
+    vmlinuz_files = _sort(glob('live/vmlinuz*'))
+    vmlinuz = vmlinuz_files[0] if vmlinuz_files else ''
+    ver = vmlinuz.split('-', 1)[1] if '-' in vmlinuz else vmlinuz
+    initrd = f"live/initrd.img-{ver}" if ver else 'live/initrd.img'
+    if isfile(initrd):
+        print(f"KERNEL: {vmlinuz} - {initrd} - {ver}")
+        for template, cfg in (('grub-template-grub', 'boot/grub/grub.cfg'),
+                              ('grub-template-advanced', 'boot/grub/advanced.cfg')):
+            with open(file=join(SHARE_DIR, template), mode='r', encoding='utf-8') as tmpl_fle:
+                text = tmpl_fle.read()
+            text = _sed(text, '[TITLE]', title)
+            text = _sed(text, '[VMLINUZ]', f"\\/{vmlinuz}")
+            text = _sed(text, '[INITRD]', f"\\/{initrd}", replace_all=True)
+            with open(file=cfg, mode='w', encoding='utf-8') as cfg_fle:
+                cfg_fle.write(text)
+
+    if catalogue is None:
+        print(f"ERROR: Cannot find {SUPPORTED_FILE} - no localized menu items will be generated.")
+    else:
+        items = _language_items(catalogue, name_index=1)
+        if not items:
+            print('ERROR: language array not filled - exiting')
+            return 2
+
+        # Generate language menus
+        locales = ''
+        for name, loc in items:
+            cntr = loc.split('_', 1)[1].lower() if '_' in loc else loc.lower()
+            locales += (f"\\nmenuentry \"{name} ({loc})\" --class flags/{cntr} {{\\n"
+                        f"    linux  /{vmlinuz} boot=live components locales={loc}.UTF-8 "
+                        f"keyboard-layouts={cntr},us quiet splash \"${{loopback}}\"\\n"
+                        f"    initrd /{initrd}\\n}}")
+        if locales:
+            with open(file='boot/grub/locales.cfg', mode='w', encoding='utf-8') as loc_fle:
+                loc_fle.write(_printf(f"{locales}\\n"))
+
+    print('Grub gen successfuly generated: boot/grub/grub.cfg')
+    return 0
+
+
+def render_isolinux(title, catalogue):
+    ''' Generate isolinux.cfg. '''
+    template = join(SHARE_DIR, 'isolinux-template')
+    user_template = join(get_user_home(), '.iso-constructor', 'isolinux-template')
+    if isfile(user_template):
+        template = user_template
+        print(f"> Using custom Isolinux template: {template}")
+    isolinux = 'isolinux/isolinux.cfg'
+
+    print('> Start creating isolinux boot configuration')
+
+    # Get installed kernels and generate menus
+    menu = menu_plus = vmlinuz_default = initrd_default = ''
+    vmlinuz_ver = ''
+    for vmlinuz in _sort(glob('live/vmlinuz*')):
+        ver = vmlinuz.split('-', 1)[1] if '-' in vmlinuz else vmlinuz
+        if ver:
+            vmlinuz_ver = f"-{ver}"
+        initrd = f"live/initrd.img{vmlinuz_ver}"
+        if isfile(initrd):
+            print(f"KERNEL: {vmlinuz} - {initrd} - {ver}")
+            if not vmlinuz_default:
+                # Save paths to first vmlinuz/initrd.img for Advanced Options
+                vmlinuz_default = f"/{vmlinuz}"
+                initrd_default = f"/{initrd}"
+                menu = (f"LABEL live{vmlinuz_ver}\\n    MENU LABEL Start {title}\\n    MENU default\\n"
+                        f"    KERNEL /{vmlinuz}\\n"
+                        f"    APPEND initrd=/{initrd} boot=live components quiet splash\\n")
+            else:
+                # Extra kernels
+                ver_str = f" (kernel {ver.rsplit('-', 1)[0]})" if ver else ''
+                menu_plus += (f"\\n    LABEL live{vmlinuz_ver}\\n        MENU LABEL Start {title}{ver_str}\\n"
+                              f"        KERNEL /{vmlinuz}\\n"
+                              f"        APPEND initrd=/{initrd} boot=live components quiet splash\\n")
+
+    if not menu:
+        print('ERROR: failed to generate isolinux.cfg')
+        return 1
+
+    # Use the template to generate isolinux.cfg
+    with open(file=template, mode='r', encoding='utf-8') as tmpl_fle:
+        text = tmpl_fle.read()
+    text = _sed(text, '[MENU]', f"{menu}\\n")
+    text = _sed(text, '[TITLE]', title, replace_all=True)
+    text = _sed(text, '[MENUPLUS]', menu_plus)
+
+    locales = ''
+    if catalogue is None:
+        print(f"ERROR: Cannot find {SUPPORTED_FILE} - no localized menu items will be generated.")
+    else:
+        items = _language_items(catalogue, name_index=2)
+        if not items:
+            with open(file=isolinux, mode='w', encoding='utf-8') as cfg_fle:
+                cfg_fle.write(text)
+            print('ERROR: language array not filled - exiting')
+            return 2
+
+        # Generate language menus
+        for name, loc in items:
+            cntr = loc.split('_', 1)[1].lower() if '_' in loc else loc.lower()
+            locales += (f"\\n        LABEL {loc}\\n            MENU LABEL {name} ({loc})\\n"
+                        f"            KERNEL {vmlinuz_default}\\n"
+                        f"            APPEND initrd={initrd_default} boot=live components "
+                        f"locales={loc}.UTF-8 keyboard-layouts={cntr},us quiet splash")
+        if locales:
+            locales = (f"MENU BEGIN locales\\n    MENU TITLE {title} with Localisation Support\\n"
+                       f"        {locales}\\n        LABEL back\\n            MENU LABEL ^Back...\\n"
+                       "            MENU exit\\nMENU end")
+
+    # Debian Installer
+    debinstaller = ''
+    if isdir('d-i'):
+        if isfile('d-i/gtk/vmlinuz'):
+            debinstaller = ("LABEL digui\\n            MENU LABEL Graphical Debian Installer\\n"
+                            "            KERNEL /d-i/gtk/vmlinuz\\n"
+                            "            APPEND initrd=/d-i/gtk/initrd.gz append video=vesa:ywrap,mtrr vga=788")
+        if isfile('d-i/vmlinuz'):
+            debinstaller += ("\\n        LABEL dinorm\\n            MENU LABEL Debian Installer\\n"
+                             "            KERNEL /d-i/vmlinuz\\n            APPEND initrd=/d-i/initrd.gz")
+        if isfile('d-i/gtk/vmlinuz'):
+            debinstaller += ("\\n        LABEL disynth\\n            MENU LABEL Debian Installer with Speech Synthesis\\n"
+                             "            KERNEL /d-i/gtk/vmlinuz\\n"
+                             "            APPEND initrd=/d-i/gtk/initrd.gz speakup.synth=soft")
+        if debinstaller:
+            debinstaller = ("MENU BEGIN debinstaller\\n    MENU TITLE Debian Installer\\n"
+                            f"        {debinstaller}\\n        LABEL back\\n            MENU LABEL ^Back...\\n"
+                            "            MENU exit\\nMENU end")
+
+    # Update isolinux.cfg
+    text = _sed(text, '[LOCALES]', locales)
+    text = _sed(text, '[DEBINSTALLER]', debinstaller)
+    text = _sed(text, '[VMLINUZ]', vmlinuz_default)
+    text = _sed(text, '[INITRD]', initrd_default)
+    with open(file=isolinux, mode='w', encoding='utf-8') as cfg_fle:
+        cfg_fle.write(text)
+
+    print(f"Isolinux gen successfuly generated: {isolinux}")
+    return 0
+
+
+def main(args):
+    ''' Command line interface. '''
+    if not args:
+        print(__doc__)
+        return 1
+    dist_path = args[0]
+    locale.setlocale(locale.LC_ALL, '')
+    os.chdir(join(dist_path, 'boot'))
+
+    title = get_title(join(dist_path, 'root'))
+    catalogue = get_locale_catalogue(join(get_user_home(), '.iso-constructor', 'locales.json'))
+    ret_grub = render_grub(title, catalogue)
+    ret_isolinux = render_isolinux(title, catalogue)
+    return ret_grub or ret_isolinux
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+""" Module to optimize the file order of the squashfs for booting
+
+Usage:
+    bootprofile.py measure WORKDIR
+        Boot the latest ISO of WORKDIR in QEMU and save the boot time.
+    bootprofile.py profile WORKDIR
+        Boot the latest ISO with page cache tracing and save the order
+        in which files are read until the login prompt in WORKDIR/boot-order.
+    bootprofile.py sortfile WORKDIR SORTFILE
+        Write the mksquashfs sort file for WORKDIR/root (used by build.sh).
+    bootprofile.py report WORKDIR
+        Compare the boot times before and after sorting the squashfs.
+
+Run as root: profile mounts filesystem.squashfs to map the traced inodes to paths.
+QEMU uses KVM when available, otherwise TCG.
+"""
+
+import os
+import re
+import sys
+import json
+import tempfile
+import subprocess
+from datetime import datetime
+from os.path import join, exists, getmtime, basename
+from qemuboot import QemuBoot, get_boot_files, get_missing_tools, LIVE_APPEND
+from diskindex import get_latest_iso
+
+ORDER_FILE = 'boot-order'
+SORT_FILE = 'boot-order.sort'
+PROFILE_FILE = 'boot-profile.json'
+# Number of boot time measurements kept
+PROFILE_SIZE = 20
+LOGIN_RE = re.compile(r'login:\s*$', re.MULTILINE)
+# Seconds to wait for the login prompt (TCG is slow)
+BOOT_TIMEOUT = 1200
+DUMP_TIMEOUT = 1800
+# Trace the files that are added to the page cache in a large, non-overwriting buffer
+TRACE_APPEND = ('sysrq_always_enabled=1 trace_event=filemap:mm_filemap_add_to_page_cache '
+                'trace_buf_size=64M trace_options=nooverwrite')
+DUMP_START_RE = re.compile(r'Dumping ftrace buffer')
+DUMP_SEPARATOR_RE = re.compile(r'-{10,}\r?$', re.MULTILINE)
+TRACE_RE = re.compile(r'mm_filemap_add_to_page_cache: dev (\d+):(\d+) ino ([0-9a-f]+)')
+# Loop devices (live-boot mounts the squashfs on a loop device)
+LOOP_MAJOR = 7
+# mksquashfs priorities: files with a higher priority are stored first
+MAX_PRIORITY = 32767
+
+
+def get_boot(work_dir, append, serial_log=None):
+    ''' Return a QemuBoot object for the latest ISO of the work directory. '''
+    missing = get_missing_tools()
+    if missing:
+        print(f"Missing tools: {', '.join(missing)}")
+        return None
+    iso = get_latest_iso(work_dir)
+    if not iso:
+        print(f"Cannot find an ISO in {work_dir}")
+        return None
+    vmlinuz, initrd = get_boot_files(join(work_dir, 'boot/live'))
+    if not vmlinuz:
+        print(f"Cannot find the kernel and initrd in {join(work_dir, 'boot/live')}")
+        return None
+    return QemuBoot(iso, vmlinuz, initrd, append=append, serial_log=serial_log)
+
+
+def is_sorted(work_dir):
+    ''' Check if the squashfs was built with the sort file. '''
+    sort_file = join(work_dir, SORT_FILE)
+    squashfs = join(work_dir, 'boot/live/filesystem.squashfs')
+    return exists(sort_file) and exists(squashfs) and getmtime(sort_file) <= getmtime(squashfs)
+
+
+def load_profile(work_dir):
+    ''' Load the saved boot time measurements. '''
+    try:
+        with open(file=join(work_dir, PROFILE_FILE), mode='r', encoding='utf-8') as profile_fle:
+            profile = json.load(profile_fle)
+            return profile if isinstance(profile, dict) else {}
+    except (OSError, ValueError):
+        return {}
+
+
+def save_run(work_dir, run):
+    ''' Add a boot time measurement to the profile. '''
+    profile = load_profile(work_dir)
+    profile['runs'] = (profile.get('runs', []) + [run])[-PROFILE_SIZE:]
+    try:
+        with open(file=join(work_dir, PROFILE_FILE), mode='w', encoding='utf-8') as profile_fle:
+            json.dump(profile, profile_fle, indent=2)
+    except OSError as detail:
+        print(f"Cannot save {join(work_dir, PROFILE_FILE)}: {detail}")
+
+
+def boot_to_login(qemu):
+    ''' Start QEMU and return the seconds until the login prompt (None on timeout). '''
+    print(f"> Boot {basename(qemu.iso)} ({qemu.accel})")
+    qemu.start()
+    boot_time = qemu.expect(LOGIN_RE, BOOT_TIMEOUT)[0]
+    if boot_time is None:
+        print(f"No login prompt within {BOOT_TIMEOUT} seconds")
+    else:
+        print(f"> Login prompt after {boot_time:.1f} seconds")
+    return boot_time
+
+
+def measure(work_dir):
+    ''' Boot the ISO and save the boot time. '''
+    qemu = get_boot(work_dir, LIVE_APPEND)
+    if not qemu:
+        return 1
+    try:
+        boot_time = boot_to_login(qemu)
+    finally:
+        qemu.stop()
+    if boot_time is None:
+        return 2
+    save_run(work_dir, {'date': datetime.now().isoformat(timespec='seconds'),
+                        'iso': basename(qemu.iso),
+                        'accel': qemu.accel,
+                        'sorted': is_sorted(work_dir),
+                        'boot_time': round(boot_time, 1)})
+    report(work_dir)
+    return 0
+
+
+def get_traced_inodes(serial_output):
+    '''
+    Return the traced inodes of the loop device with the most reads
+    in the order they were first read.
+    '''
+    devices = {}
+    for match in TRACE_RE.finditer(serial_output):
+        if int(match.group(1)) != LOOP_MAJOR:
+            continue
+        inodes = devices.setdefault(int(match.group(2)), {})
+        inodes.setdefault(int(match.group(3), 16), len(inodes))
+    if not devices:
+        return []
+    inodes = max(devices.values(), key=len)
+    return sorted(inodes, key=inodes.get)
+
+
+def get_inode_paths(squashfs):
+    ''' Mount the squashfs and return dict: inode: relative path of the files. '''
+    paths = {}
+    mount_dir = tempfile.mkdtemp(prefix='iso-constructor-squashfs-')
+    try:
+        subprocess.run(['mount', '-t', 'squashfs', '-o', 'loop,ro', squashfs, mount_dir],
+                       check=True)
+    except (OSError, subprocess.CalledProcessError) as detail:
+        print(f"Cannot mount {squashfs}: {detail}")
+        os.rmdir(mount_dir)
+        return paths
+    try:
+        for dir_path, _dir_names, file_names in os.walk(mount_dir):
+            for name in file_names:
+                path = join(dir_path, name)
+                st = os.lstat(path)
+                paths.setdefault(st.st_ino, os.path.relpath(path, mount_dir))
+    finally:
+        subprocess.run(['umount', mount_dir], check=False)
+        os.rmdir(mount_dir)
+    return paths
+
+
+def profile(work_dir):
+    ''' Trace the files that are read during boot and save their order. '''
+    squashfs = join(work_dir, 'boot/live/filesystem.squashfs')
+    if exists(join(work_dir, 'boot/live/filesystem.module')):
+        print('Cannot profile a squashfs with layers: build without INCREMENTAL first')
+        return 1
+    if not exists(squashfs):
+        # TMPFSBUILD keeps the squashfs on disk only when a boot-order file exists
+        print(f"Cannot find {squashfs}: create an empty {join(work_dir, 'boot-order')} and build again")
+        return 1
+    serial_log = join(work_dir, 'boot-profile.log')
+    qemu = get_boot(work_dir, f"{LIVE_APPEND} {TRACE_APPEND}", serial_log=serial_log)
+    if not qemu:
+        return 1
+    try:
+        if boot_to_login(qemu) is None:
+            return 2
+        # SysRq-z dumps the trace buffer on the console
+        print('> Dump the trace buffer')
+        qemu.monitor('sendkey alt-sysrq-z')
+        dumped = None
+        if qemu.expect(DUMP_START_RE, 60)[1] and qemu.expect(DUMP_SEPARATOR_RE, 60)[1]:
+            dumped = qemu.read_until(DUMP_SEPARATOR_RE, DUMP_TIMEOUT)
+    finally:
+        qemu.stop()
+    if not dumped:
+        print('Cannot read the trace buffer from the serial console')
+        return 3
+
+    inodes = get_traced_inodes(dumped)
+    paths = get_inode_paths(squashfs)
+    order = [paths[ino] for ino in inodes if ino in paths]
+    if not order:
+        print('No files of the squashfs were traced')
+        return 3
+    with open(file=join(work_dir, ORDER_FILE), mode='w', encoding='utf-8',
+              errors='surrogateescape') as order_fle:
+        order_fle.write('\n'.join(order) + '\n')
+    print(f"> Saved the boot order of {len(order)} files: {join(work_dir, ORDER_FILE)}")
+    print('> Build the ISO again to sort the squashfs, then run measure')
+    return 0
+
+
+def write_sort_file(work_dir, sort_file):
+    '''
+    Write the mksquashfs sort file: the files in boot order get a
+    descending priority, all other files keep priority 0.
+    '''
+    root_dir = join(work_dir, 'root')
+    try:
+        with open(file=join(work_dir, ORDER_FILE), mode='r', encoding='utf-8',
+                  errors='surrogateescape') as order_fle:
+            order = order_fle.read().splitlines()
+    except OSError as detail:
+        print(f"Cannot read the boot order: {detail}")
+        return 1
+    lines = []
+    for rel_path in order:
+        path = join(root_dir, rel_path)
+        # mksquashfs stops on missing files and splits lines on white space
+        if not rel_path or re.search(r'\s', path) or not os.path.lexists(path):
+            continue
+        lines.append(f"{path} {max(MAX_PRIORITY - len(lines), 1)}")
+    with open(file=sort_file, mode='w', encoding='utf-8', errors='surrogateescape') as sort_fle:
+        sort_fle.write('\n'.join(lines) + '\n')
+    print(f"> Sort {len(lines)} files in boot order: {sort_file}")
+    return 0
+
+
+def report(work_dir):
+    ''' Print the last boot times before and after sorting the squashfs. '''
+    runs = load_profile(work_dir).get('runs', [])
+    if not runs:
+        print(f"No boot times saved for {work_dir}")
+        return 1
+    accel = runs[-1]['accel']
+    last = {}
+    for run in runs:
+        if run['accel'] == accel:
+            last[run['sorted']] = run
+    for is_sorted_run, label in ((False, 'Unsorted'), (True, 'Sorted')):
+        if is_sorted_run in last:
+            run = last[is_sorted_run]
+            print(f"{label:10} {run['boot_time']:7.1f} s  {run['iso']} ({run['date']}, {accel})")
+    if len(last) == 2 and last[False]['boot_time']:
+        gain = 100 * (last[False]['boot_time'] - last[True]['boot_time']) / last[False]['boot_time']
+        print(f"Boot time gain: {gain:.1f}%")
+    return 0
+
+
+def main(args):
+    ''' Command line interface. '''
+    commands = {'measure': measure, 'profile': profile, 'report': report}
+    if len(args) == 3 and args[0] == 'sortfile':
+        return write_sort_file(args[1], args[2])
+    if len(args) != 2 or args[0] not in commands or not exists(args[1]):
+        print(__doc__)
+        return 1
+    return commands[args[0]](args[1])
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+""" Module to test if an ISO boots to a login prompt (headless, for CI)
+
+Usage:
+    boottest.py [--json] [--timeout SECONDS] [--marker REGEX] WORKDIR|ISO
+        Boot the latest ISO of WORKDIR (kernel and initrd from WORKDIR/boot/live)
+        or the ISO file (kernel and initrd are extracted with xorriso) in QEMU
+        with a serial console and print the seconds to each boot milestone.
+        With --marker the test succeeds when REGEX is printed on the serial
+        console instead of at the login prompt.
+        With --json the result is printed as JSON (the progress goes to stderr).
+
+The result of a work directory test is saved in WORKDIR/boot-test.json
+and the serial output in WORKDIR/boot-test.log.
+QEMU uses KVM when available, otherwise TCG.
+Exit status: 0 boot succeeded, 1 usage, 2 no boot files, 3 boot failed, 4 missing tools.
+"""
+
+import re
+import sys
+import json
+import time
+import shutil
+import tempfile
+from datetime import datetime
+from os.path import join, isdir, isfile, basename
+from qemuboot import QemuBoot, get_boot_files, extract_boot_files, get_missing_tools, \
+    LIVE_APPEND
+from diskindex import get_latest_iso
+
+RESULT_FILE = 'boot-test.json'
+LOG_FILE = 'boot-test.log'
+# Number of results kept
+RESULT_SIZE = 50
+# Seconds to wait for the login prompt (TCG is slow)
+BOOT_TIMEOUT = 1200
+# Boot milestones: (name, pattern on the serial console)
+MILESTONES = (('kernel', r'Linux version \S+'),
+              ('initramfs', r'Run /init as init process'),
+              ('live-boot', r'live-boot|/scripts/live'),
+              ('systemd', r'Welcome to .*!'),
+              ('login', r'login:\s*$'))
+
+
+def get_milestones_re(marker=None):
+    ''' Return the pattern that matches any of the milestones. '''
+    milestones = list(MILESTONES)
+    if marker:
+        milestones.append(('marker', marker))
+    return re.compile('|'.join(f"(?P<{name.replace('-', '_')}>{pattern})"
+                               for name, pattern in milestones), re.MULTILINE)
+
+
+def run_test(qemu, timeout, marker=None):
+    '''
+    Boot and record the seconds to each milestone (first match).
+    The test succeeds when the marker, or without marker the login prompt, is reached.
+    '''
+    target = 'marker' if marker else 'login'
+    pattern = get_milestones_re(marker)
+    milestones = {}
+    qemu.start()
+    deadline = qemu.started + timeout
+    try:
+        while target not in milestones:
+            elapsed, match = qemu.expect(pattern, deadline - time.monotonic())
+            if not match:
+                break
+            name = match.lastgroup.replace('_', '-')
+            if name not in milestones:
+                milestones[name] = round(elapsed, 1)
+                print(f"> {elapsed:7.1f} s  {name}", flush=True)
+    finally:
+        qemu.stop()
+    return {'date': datetime.now().isoformat(timespec='seconds'),
+            'iso': basename(qemu.iso),
+            'accel': qemu.accel,
+            'success': target in milestones,
+            'boot_time': milestones.get(target),
+            'milestones': milestones}
+
+
+def save_result(work_dir, result):
+    ''' Add the result to the test results of the work directory. '''
+    results_file = join(work_dir, RESULT_FILE)
+    try:
+        with open(file=results_file, mode='r', encoding='utf-8') as results_fle:
+            results = json.load(results_fle)
+    except (OSError, ValueError):
+        results = {}
+    results['runs'] = (results.get('runs', []) + [result])[-RESULT_SIZE:]
+    try:
+        with open(file=results_file, mode='w', encoding='utf-8') as results_fle:
+            json.dump(results, results_fle, indent=2)
+    except OSError as detail:
+        print(f"Cannot save {results_file}: {detail}")
+
+
+def main(args):
+    ''' Command line interface. '''
+    print_json = False
+    timeout = BOOT_TIMEOUT
+    marker = None
+    while len(args) > 1 and args[0].startswith('--'):
+        if args[0] == '--json':
+            print_json = True
+            args = args[1:]
+        elif args[0] == '--timeout' and args[1].isdigit():
+            timeout = int(args[1])
+            args = args[2:]
+        elif args[0] == '--marker':
+            marker = args[1]
+            args = args[2:]
+        else:
+            break
+    if len(args) != 1 or not (isdir(args[0]) or isfile(args[0])):
+        print(__doc__)
+        return 1
+    # Only the JSON result on stdout: everything else goes to stderr
+    json_out = sys.stdout
+    if print_json:
+        sys.stdout = sys.stderr
+
+    work_dir = args[0] if isdir(args[0]) else None
+    missing = get_missing_tools(iso_file=not work_dir)
+    if missing:
+        print(f"Missing tools: {', '.join(missing)}")
+        return 4
+    tmp_dir = None
+    if work_dir:
+        iso = get_latest_iso(work_dir)
+        vmlinuz, initrd = get_boot_files(join(work_dir, 'boot/live'))
+    else:
+        iso = args[0]
+        tmp_dir = tempfile.mkdtemp(prefix='iso-constructor-boot-')
+        vmlinuz, initrd = extract_boot_files(iso, tmp_dir)
+    if not iso or not vmlinuz:
+        print(f"Cannot find the ISO, kernel and initrd of {args[0]}")
+        if tmp_dir:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        return 2
+
+    qemu = QemuBoot(iso, vmlinuz, initrd, append=LIVE_APPEND,
+                    serial_log=join(work_dir, LOG_FILE) if work_dir else None)
+    print(f"> Boot {basename(iso)} ({qemu.accel})", flush=True)
+    try:
+        result = run_test(qemu, timeout, marker)
+    finally:
+        if tmp_dir:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+    if work_dir:
+        save_result(work_dir, result)
+    if print_json:
+        print(json.dumps(result), file=json_out, flush=True)
+    elif result['success']:
+        print(f"Boot succeeded after {result['boot_time']} seconds")
+    else:
+        print(f"Boot failed within {timeout} seconds")
+    return 0 if result['success'] else 3
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,368 @@
+#!/usr/bin/env python3
+""" Module to journal the stages of a build, so an interrupted build can be resumed
+
+Usage:
+    buildstate.py start WORKDIR [VALUE ...]
+        Start a new journal. VALUEs are build settings besides build.conf.
+    buildstate.py resume WORKDIR [VALUE ...]
+        Continue the journal of an interrupted build with the same settings:
+        stages whose outputs changed or are incomplete are redone and
+        partial squashfs and ISO files are removed (exit status 1: start over).
+    buildstate.py skip WORKDIR STAGE [INPUT ...]
+        Exit status 0 when the stage was done with the same inputs (files or
+        directories), otherwise the stage and the stages after it are redone.
+    buildstate.py end WORKDIR STAGE [OUTPUT ...]
+        Journal the stage as done with its outputs.
+    buildstate.py done WORKDIR STAGE
+        Exit status 0 when the stage is journaled as done.
+    buildstate.py interrupted WORKDIR
+        Exit status 0 when the build did not finish and can be resumed.
+    buildstate.py clean WORKDIR
+        Remove the ISO files that are not an output of a journaled stage.
+    buildstate.py finish WORKDIR
+        The build finished: the next build starts a new journal.
+
+build.sh keeps the journal in WORKDIR/.build-journal.json.
+"""
+
+import os
+import sys
+import json
+import time
+import struct
+import hashlib
+from glob import glob
+from os.path import join, exists, isdir, getsize, getmtime, normpath, abspath
+from utils import get_config_dict
+
+JOURNAL_FILE = '.build-journal.json'
+# Bump when the journal layout changes
+JOURNAL_VERSION = 1
+# Directories and files of the root that do not end up in the squashfs
+# or that every chroot session replaces
+TREE_SKIP = ('dev/', 'proc/', 'run/', 'sys/', 'tmp/', 'var/tmp/', 'etc/resolv.conf')
+# Larger input files are compared by size and modification time
+MAX_HASH_SIZE = 16777216
+BLOCK_SIZE = 1048576
+# squashfs superblock: magic, bytes_used at offset 40
+SQUASHFS_MAGIC = b'hsqs'
+# ISO 9660 primary volume descriptor: volume space size at 80, logical block size at 128
+ISO_PVD_OFFSET = 32768
+ISO_SUFFIXES = ('', '.sha256', '.zsync', '.xdelta')
+
+
+def get_journal_file(work_dir):
+    ''' Return the path of the build journal. '''
+    return join(work_dir, JOURNAL_FILE)
+
+
+def load_journal(work_dir):
+    ''' Load the build journal (None when there is none). '''
+    try:
+        with open(file=get_journal_file(work_dir), mode='r', encoding='utf-8') as journal_fle:
+            journal = json.load(journal_fle)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(journal, dict) or journal.get('version') != JOURNAL_VERSION:
+        return None
+    return journal
+
+
+def save_journal(work_dir, journal):
+    ''' Save the build journal: replace it at once, a crash must not truncate it. '''
+    journal_file = get_journal_file(work_dir)
+    try:
+        with open(file=f"{journal_file}.tmp", mode='w', encoding='utf-8') as journal_fle:
+            json.dump(journal, journal_fle, indent=2)
+            journal_fle.flush()
+            os.fsync(journal_fle.fileno())
+        os.replace(f"{journal_file}.tmp", journal_file)
+    except OSError as detail:
+        print(f"Cannot save {journal_file}: {detail}")
+
+
+def is_interrupted(work_dir):
+    '''
+    Check if the last build of the work directory did not finish
+    and can be resumed (reproducible builds always start over).
+    '''
+    journal = load_journal(work_dir)
+    if not journal or journal.get('finished'):
+        return False
+    build_conf = join(work_dir, 'build.conf')
+    return not (exists(build_conf) and get_config_dict(build_conf).get('REPRODUCIBLE') == 'true')
+
+
+def get_digest(path):
+    ''' Return the sha256 digest of a file. '''
+    sha256 = hashlib.sha256()
+    with open(file=path, mode='rb') as fle:
+        for block in iter(lambda: fle.read(BLOCK_SIZE), b''):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+def get_tree_digest(top_dir):
+    ''' Return the digest of the paths, modes, sizes and modification times in a directory. '''
+    sha256 = hashlib.sha256()
+    for dir_path, dir_names, file_names in os.walk(top_dir):
+        rel_dir = os.path.relpath(dir_path, top_dir)
+        rel_dir = '' if rel_dir == '.' else f"{rel_dir}/"
+        # Do not descend into mounted file systems
+        dir_names[:] = sorted(name for name in dir_names
+                              if not f"{rel_dir}{name}/".startswith(TREE_SKIP)
+                              and not os.path.ismount(join(dir_path, name)))
+        for name in sorted(file_names) + dir_names:
+            rel_path = f"{rel_dir}{name}"
+            if rel_path.startswith(TREE_SKIP):
+                continue
+            try:
+                st = os.lstat(join(dir_path, name))
+            except OSError:
+                continue
+            # Directory times change when files are added and removed again
+            mtime_ns = 0 if name in dir_names else st.st_mtime_ns
+            sha256.update(f"{rel_path}\0{st.st_mode}\0{st.st_size}\0{mtime_ns}\n"
+                          .encode('utf-8', errors='surrogateescape'))
+    return sha256.hexdigest()
+
+
+def get_inputs(paths):
+    ''' Return the digest of the input files and directories. '''
+    sha256 = hashlib.sha256()
+    for path in paths:
+        if isdir(path):
+            value = get_tree_digest(path)
+        elif not exists(path):
+            value = 'missing'
+        elif getsize(path) > MAX_HASH_SIZE:
+            st = os.stat(path)
+            value = f"{st.st_size} {st.st_mtime_ns}"
+        else:
+            value = get_digest(path)
+        sha256.update(f"{normpath(abspath(path))}\0{value}\n"
+                      .encode('utf-8', errors='surrogateescape'))
+    return sha256.hexdigest()
+
+
+def read_image_size(path):
+    '''
+    Return the size of a squashfs or ISO file from its header,
+    or None when the header is missing (the file is incomplete).
+    '''
+    try:
+        with open(file=path, mode='rb') as image_fle:
+            if path.endswith('.squashfs'):
+                header = image_fle.read(48)
+                if len(header) < 48 or header[:4] != SQUASHFS_MAGIC:
+                    return None
+                return struct.unpack_from('<Q', header, 40)[0]
+            image_fle.seek(ISO_PVD_OFFSET)
+            pvd = image_fle.read(2048)
+            if len(pvd) < 2048 or pvd[:6] != b'\x01CD001':
+                return None
+            return struct.unpack_from('<I', pvd, 80)[0] * struct.unpack_from('<H', pvd, 128)[0]
+    except OSError:
+        return None
+
+
+def is_complete(path):
+    ''' Check if a squashfs or ISO file was written to the end. '''
+    if not path.endswith(('.squashfs', '.iso')):
+        return True
+    size = read_image_size(path)
+    return size is not None and getsize(path) >= size
+
+
+def get_output(path):
+    ''' Return the fingerprint of an output (None when it does not exist). '''
+    if isdir(path):
+        return ['dir', get_tree_digest(path)]
+    if not exists(path):
+        return None
+    # The build touches the squashfs files and ISOs afterwards (REPRODUCIBLE)
+    if path.endswith(('.squashfs', '.iso')):
+        return ['image', getsize(path), read_image_size(path)]
+    st = os.stat(path)
+    return ['file', st.st_size, st.st_mtime_ns]
+
+
+def get_settings(work_dir, values):
+    ''' Return the digest of build.conf and the other build settings. '''
+    return get_inputs([join(work_dir, 'build.conf')]) + hashlib.sha256(
+        '\0'.join(values).encode('utf-8', errors='surrogateescape')).hexdigest()
+
+
+def get_recorded(journal):
+    ''' Return the outputs of the journaled stages. '''
+    return {path for stage in journal['stages'] for path in stage['outputs']}
+
+
+def start(work_dir, values):
+    ''' Start a new journal. '''
+    save_journal(work_dir, {'version': JOURNAL_VERSION,
+                            'started': time.time(),
+                            'settings': get_settings(work_dir, values),
+                            'finished': False,
+                            'running': None,
+                            'stages': []})
+    return 0
+
+
+def validate(journal):
+    '''
+    Drop the stages whose outputs changed or are incomplete,
+    and the stages after them.
+    '''
+    # Output: index of the first stage and fingerprint of the last stage that wrote it
+    outputs = {}
+    for index, stage in enumerate(journal['stages']):
+        for path, fingerprint in stage['outputs'].items():
+            outputs[path] = (outputs.get(path, (index,))[0], fingerprint)
+    redo = len(journal['stages'])
+    for path, (index, fingerprint) in sorted(outputs.items()):
+        if get_output(path) != fingerprint or (fingerprint and not is_complete(path)):
+            print(f"> {path} changed since stage {journal['stages'][index]['name']}")
+            redo = min(redo, index)
+    journal['stages'] = journal['stages'][:redo]
+
+
+def discard_partial(work_dir, journal):
+    '''
+    Remove the squashfs and ISO files that are incomplete
+    or that the interrupted build wrote without journaling them.
+    '''
+    recorded = get_recorded(journal)
+    for path in glob(join(work_dir, 'boot/live/*.squashfs')) + glob(join(work_dir, '*.iso')):
+        path = normpath(abspath(path))
+        if path in recorded:
+            continue
+        if is_complete(path) and getmtime(path) < journal['started']:
+            continue
+        print(f"> Discard partial {path}")
+        for partial in [f"{path}{suffix}" for suffix in ISO_SUFFIXES] \
+                if path.endswith('.iso') else [path]:
+            try:
+                if exists(partial):
+                    os.remove(partial)
+            except OSError as detail:
+                print(f"Cannot remove {partial}: {detail}")
+
+
+def resume(work_dir, values):
+    ''' Continue the journal of an interrupted build. '''
+    journal = load_journal(work_dir)
+    if not journal or journal['finished']:
+        return 1
+    if journal['settings'] != get_settings(work_dir, values):
+        print('> The build settings changed since the interrupted build: start over')
+        return 1
+    validate(journal)
+    journal['running'] = None
+    discard_partial(work_dir, journal)
+    save_journal(work_dir, journal)
+    done = ', '.join(stage['name'] for stage in journal['stages']) or '-'
+    print(f"> Resume the interrupted build (done: {done})")
+    return 0
+
+
+def skip(work_dir, name, paths):
+    ''' Check if the stage can be skipped, otherwise journal that it runs. '''
+    journal = load_journal(work_dir)
+    if not journal:
+        return 1
+    inputs = get_inputs(paths)
+    names = [stage['name'] for stage in journal['stages']]
+    if name in names:
+        index = names.index(name)
+        if journal['stages'][index]['inputs'] == inputs:
+            print(f"> Skip {name}: done before the build was interrupted")
+            return 0
+        print(f"> The inputs of {name} changed: redo {name} and the stages after it")
+        journal['stages'] = journal['stages'][:index]
+    journal['running'] = {'name': name, 'inputs': inputs}
+    save_journal(work_dir, journal)
+    return 1
+
+
+def end(work_dir, name, paths):
+    ''' Journal the stage as done. '''
+    journal = load_journal(work_dir)
+    if not journal:
+        return 1
+    running = journal.get('running') or {}
+    outputs = {}
+    for path in paths:
+        path = normpath(abspath(path))
+        # A squashfs or ISO that was not created is not done either
+        if path.endswith(('.squashfs', '.iso')) and not (exists(path) and is_complete(path)):
+            print(f"> {path} is missing or incomplete: {name} is not journaled")
+            return 2
+        outputs[path] = get_output(path)
+    journal['stages'] = [stage for stage in journal['stages'] if stage['name'] != name]
+    journal['stages'].append({'name': name,
+                              'inputs': running.get('inputs') if running.get('name') == name else None,
+                              'outputs': outputs})
+    journal['running'] = None
+    save_journal(work_dir, journal)
+    return 0
+
+
+def done(work_dir, name):
+    ''' Check if the stage is journaled as done. '''
+    journal = load_journal(work_dir)
+    if journal and any(stage['name'] == name for stage in journal['stages']):
+        return 0
+    return 1
+
+
+def clean(work_dir):
+    ''' Remove the ISO files that are not an output of a journaled stage. '''
+    journal = load_journal(work_dir)
+    recorded = get_recorded(journal) if journal else set()
+    for path in glob(join(work_dir, '*.iso*')):
+        iso = normpath(abspath(path))
+        iso = iso[:iso.rindex('.iso') + 4]
+        if iso not in recorded:
+            os.remove(path)
+    return 0
+
+
+def finish(work_dir):
+    ''' Journal that the build finished. '''
+    journal = load_journal(work_dir)
+    if journal:
+        journal['finished'] = True
+        journal['running'] = None
+        save_journal(work_dir, journal)
+    return 0
+
+
+def main(args):
+    ''' Command line interface. '''
+    if len(args) < 2 or not exists(args[1]):
+        print(__doc__)
+        return 1
+    command, work_dir, args = args[0], args[1], args[2:]
+    if command == 'start':
+        return start(work_dir, args)
+    if command == 'resume':
+        return resume(work_dir, args)
+    if command == 'skip' and args:
+        return skip(work_dir, args[0], args[1:])
+    if command == 'end' and args:
+        return end(work_dir, args[0], args[1:])
+    if command == 'done' and len(args) == 1:
+        return done(work_dir, args[0])
+    if command == 'interrupted' and not args:
+        return 0 if is_interrupted(work_dir) else 1
+    if command == 'clean' and not args:
+        return clean(work_dir)
+    if command == 'finish' and not args:
+        return finish(work_dir)
+    print(__doc__)
+    return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+""" Module to run a job in its own cgroup (v2)
+
+Usage:
+    cgjob.py [--report WORKDIR] NAME COMMAND [ARGUMENTS]
+        Run COMMAND in its own cgroup in iso_constructor.slice and print its
+        resource usage. The slice gets the cpu_weight and io_weight, the job
+        the memory_high of the SETTINGS section in
+        ~/.iso-constructor/iso-constructor.conf.
+        With --report the cpu, memory and io usage is saved in
+        WORKDIR/.job-resources.json (added to build-report.json).
+
+The cgroup is created with systemd-run, or in /sys/fs/cgroup when systemd-run
+is missing or fails. Without cgroup v2 the command runs in the current cgroup.
+"""
+
+import os
+import sys
+import json
+import signal
+import shutil
+import subprocess
+from configparser import ConfigParser
+from os.path import join, exists, abspath
+from utils import get_user_home, human_size
+from progress import RESOURCES_FILE
+
+CGROUP_ROOT = '/sys/fs/cgroup'
+SLICE = 'iso_constructor.slice'
+# Parent cgroup without systemd
+CGROUP_DIR = 'iso_constructor'
+# Set in the job's environment once it runs in its own cgroup
+CGROUP_ENV = 'ISO_CONSTRUCTOR_CGROUP'
+# File descriptor the job reports its start on (see run_systemd_scope)
+STARTED_ENV = 'ISO_CONSTRUCTOR_STARTED_FD'
+# Weights of the slice (the parent cgroup of the jobs): the desktop (user.slice)
+# has weight 100, so it goes first. Jobs in the slice share it equally.
+CPU_WEIGHT = 50
+IO_WEIGHT = 50
+# Throttle (and reclaim) above this memory use, e.g. 4G or 50%: empty is no limit
+MEMORY_HIGH = ''
+CONTROLLERS = ('cpu', 'io', 'memory')
+
+
+def get_limits():
+    ''' Return the cpu weight, io weight and memory high settings. '''
+    config = ConfigParser()
+    config.read(join(get_user_home(), '.iso-constructor', 'iso-constructor.conf'))
+    return {'cpu_weight': config.getint('SETTINGS', 'cpu_weight', fallback=CPU_WEIGHT),
+            'io_weight': config.getint('SETTINGS', 'io_weight', fallback=IO_WEIGHT),
+            'memory_high': config.get('SETTINGS', 'memory_high', fallback=MEMORY_HIGH).strip()}
+
+
+def get_memory_bytes(value):
+    ''' Return memory_high (e.g. 512M, 4G, 50%) in bytes for memory.high. '''
+    value = value.upper()
+    if value.endswith('%'):
+        with open(file='/proc/meminfo', mode='r', encoding='utf-8') as meminfo_fle:
+            mem_total = int(meminfo_fle.readline().split()[1]) * 1024
+        return int(mem_total * float(value[:-1]) / 100)
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+    if value[-1:] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(value)
+
+
+def get_cgroup():
+    ''' Return the path of the cgroup of this process. '''
+    with open(file='/proc/self/cgroup', mode='r', encoding='utf-8') as cgroup_fle:
+        for line in cgroup_fle:
+            if line.startswith('0::'):
+                return join(CGROUP_ROOT, line[3:].strip().lstrip('/'))
+    return None
+
+
+def write_value(path, value):
+    ''' Write a value to a cgroup file (returns False when not supported). '''
+    try:
+        with open(file=path, mode='w', encoding='utf-8') as cgroup_fle:
+            cgroup_fle.write(str(value))
+    except OSError as detail:
+        print(f"Cannot write {value} to {path}: {detail}")
+        return False
+    return True
+
+
+def run_systemd_scope(name, args, limits):
+    '''
+    Run this module again in a transient scope of the slice.
+    Returns the exit status, or None when systemd-run could not start the scope.
+    '''
+    command = ['systemd-run', '--scope', '--quiet', '--collect',
+               f"--slice={SLICE}", f"--unit=iso_constructor-{name}-{os.getpid()}"]
+    if limits['memory_high']:
+        command += ['-p', f"MemoryHigh={limits['memory_high']}"]
+    # The job writes to the pipe when it runs in the scope
+    read_fd, write_fd = os.pipe()
+    env = dict(os.environ, **{CGROUP_ENV: 'systemd', STARTED_ENV: str(write_fd)})
+    try:
+        process = subprocess.Popen(command + [sys.executable, abspath(__file__)] + args,
+                                   env=env, pass_fds=(write_fd,))
+    except OSError as detail:
+        print(f"Cannot run systemd-run: {detail}")
+        os.close(read_fd)
+        os.close(write_fd)
+        return None
+    os.close(write_fd)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda signum, frame: process.terminate())
+    exit_status = process.wait()
+    started = os.read(read_fd, 1)
+    os.close(read_fd)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    if not started:
+        print(f"Cannot start a systemd scope for {name}: run it without systemd")
+        return None
+    return exit_status
+
+
+def set_slice_weights(limits):
+    ''' Set the weights of the slice (active while one of its scopes runs). '''
+    command = ['systemctl', 'set-property', '--runtime', SLICE,
+               f"CPUWeight={limits['cpu_weight']}", f"IOWeight={limits['io_weight']}"]
+    if subprocess.run(command, check=False).returncode:
+        print(f"Cannot set the weights of {SLICE}")
+
+
+def enter_cgroup(name, limits):
+    '''
+    Create the cgroup of the job in /sys/fs/cgroup and move this process into it.
+    The weights are set on the parent cgroup: it competes with the desktop.
+    '''
+    parent = join(CGROUP_ROOT, CGROUP_DIR)
+    cgroup = join(parent, f"{name}-{os.getpid()}")
+    try:
+        os.makedirs(parent, exist_ok=True)
+        # Cgroups only get the controllers their parent enables
+        for path in (CGROUP_ROOT, parent):
+            for controller in CONTROLLERS:
+                write_value(join(path, 'cgroup.subtree_control'), f"+{controller}")
+        os.mkdir(cgroup)
+    except OSError as detail:
+        print(f"Cannot create cgroup {cgroup}: {detail}")
+        return None
+    write_value(join(parent, 'cpu.weight'), limits['cpu_weight'])
+    write_value(join(parent, 'io.weight'), f"default {limits['io_weight']}")
+    if limits['memory_high']:
+        write_value(join(cgroup, 'memory.high'), get_memory_bytes(limits['memory_high']))
+    if not write_value(join(cgroup, 'cgroup.procs'), os.getpid()):
+        os.rmdir(cgroup)
+        return None
+    os.environ[CGROUP_ENV] = 'cgroupfs'
+    return cgroup
+
+
+def leave_cgroup(cgroup, previous_cgroup):
+    ''' Move this process back and remove the job's cgroup. '''
+    if write_value(join(previous_cgroup, 'cgroup.procs'), os.getpid()):
+        try:
+            os.rmdir(cgroup)
+        except OSError as detail:
+            print(f"Cannot remove cgroup {cgroup}: {detail}")
+
+
+def read_keys(path):
+    ''' Return dict: key: value of a flat keyed cgroup file (e.g. cpu.stat). '''
+    try:
+        with open(file=path, mode='r', encoding='utf-8') as cgroup_fle:
+            return {key: int(value) for key, value in
+                    (line.split() for line in cgroup_fle if len(line.split()) == 2)}
+    except (OSError, ValueError):
+        return {}
+
+
+def read_usage(cgroup):
+    ''' Return the cpu, memory and io usage of the cgroup. '''
+    cpu = read_keys(join(cgroup, 'cpu.stat'))
+    usage = {'cpu_seconds': round(cpu.get('usage_usec', 0) / 1000000, 1),
+             'user_seconds': round(cpu.get('user_usec', 0) / 1000000, 1),
+             'system_seconds': round(cpu.get('system_usec', 0) / 1000000, 1),
+             'memory_peak': None, 'io_read_bytes': 0, 'io_write_bytes': 0}
+    # memory.peak: kernel 5.19 and later
+    for name in ('memory.peak', 'memory.current'):
+        try:
+            with open(file=join(cgroup, name), mode='r', encoding='utf-8') as memory_fle:
+                usage['memory_peak'] = int(memory_fle.read())
+            break
+        except (OSError, ValueError):
+            continue
+    # io.stat: MAJ:MIN rbytes=... wbytes=... rios=... wios=... per device
+    try:
+        with open(file=join(cgroup, 'io.stat'), mode='r', encoding='utf-8') as io_fle:
+            for line in io_fle:
+                stats = dict(field.split('=', 1) for field in line.split()[1:] if '=' in field)
+                usage['io_read_bytes'] += int(stats.get('rbytes', 0))
+                usage['io_write_bytes'] += int(stats.get('wbytes', 0))
+    except (OSError, ValueError):
+        pass
+    return usage
+
+
+def run(name, command, work_dir=None):
+    ''' Run the command in the current cgroup and report its resource usage. '''
+    limits = get_limits()
+    previous_cgroup = get_cgroup()
+    cgroup = None
+    if os.environ.get(CGROUP_ENV) == 'systemd':
+        cgroup = previous_cgroup
+        started_fd = os.environ.pop(STARTED_ENV, None)
+        if started_fd:
+            os.write(int(started_fd), b'1')
+            os.close(int(started_fd))
+        set_slice_weights(limits)
+    elif os.environ.get(CGROUP_ENV) is None and exists(join(CGROUP_ROOT, 'cgroup.controllers')):
+        cgroup = enter_cgroup(name, limits)
+    try:
+        process = subprocess.Popen(command)
+    except OSError as detail:
+        print(f"Cannot run {command[0]}: {detail}")
+        if cgroup and cgroup != previous_cgroup:
+            leave_cgroup(cgroup, previous_cgroup)
+        return 127
+    # Ctrl-C is for the job, SIGTERM is passed on: the cgroup is removed when the job ends
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda signum, frame: process.terminate())
+    exit_status = process.wait()
+    if not cgroup:
+        return exit_status
+
+    usage = read_usage(cgroup)
+    if cgroup != previous_cgroup:
+        leave_cgroup(cgroup, previous_cgroup)
+    memory = human_size(usage['memory_peak']) if usage['memory_peak'] is not None else '-'
+    print(f"> {name}: cpu {usage['cpu_seconds']} s (user {usage['user_seconds']} s, "
+          f"system {usage['system_seconds']} s), memory peak {memory}, "
+          f"read {human_size(usage['io_read_bytes'])}, written {human_size(usage['io_write_bytes'])}")
+    if work_dir:
+        usage.update({'job': name, 'cgroup': cgroup, 'limits': limits, 'exit_status': exit_status})
+        try:
+            with open(file=join(work_dir, RESOURCES_FILE), mode='w', encoding='utf-8') as usage_fle:
+                json.dump(usage, usage_fle, indent=2)
+        except OSError as detail:
+            print(f"Cannot save {join(work_dir, RESOURCES_FILE)}: {detail}")
+    return exit_status
+
+
+def main(args):
+    ''' Command line interface. '''
+    work_dir = None
+    if len(args) > 1 and args[0] == '--report':
+        work_dir = args[1]
+        args = args[2:]
+    if len(args) < 2 or (work_dir and not exists(work_dir)):
+        print(__doc__)
+        return 1
+    # Start a transient systemd scope first: this module runs again inside it
+    if os.environ.get(CGROUP_ENV) is None and exists('/run/systemd/system') and \
+       exists(join(CGROUP_ROOT, 'cgroup.controllers')) and shutil.which('systemd-run'):
+        original_args = ['--report', work_dir] + args if work_dir else args
+        exit_status = run_systemd_scope(args[0], original_args, get_limits())
+        if exit_status is not None:
+            return exit_status
+    return run(args[0], args[1:], work_dir)
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
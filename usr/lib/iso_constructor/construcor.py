@@ -1,23 +1,33 @@
 #!/usr/bin/env python3
 """ Module providing initialization of the ISO Constructor application """
 
+import json
+import time
+import queue
+import signal
+import threading
 from os import makedirs, system, listdir, \
-    environ, remove
-from os.path import join, dirname, exists, isdir, abspath
+    environ, remove, setsid, killpg
+from os.path import join, dirname, exists, isdir, abspath, \
+    basename, getmtime
 from configparser import ConfigParser
 from multiprocessing import Process
 from utils import get_user_home, get_logged_user, \
-                    get_package_version, getoutput, shell_exec, \
-                    get_lsb_release_info, is_package_installed
+                    shell_exec, get_installed_versions, \
+                    get_lsb_release_info, \
+                    get_config_dict, human_size, get_release_files
 from dialogs import message_dialog, error_dialog, \
                     SelectFileDialog, SelectDirectoryDialog, \
                     question_dialog
-from terminal import Terminal
+from logwriter import LogWriter
+from progress import ProgressTracker, format_eta
+from diskindex import update_index, format_age
+from buildstate import is_interrupted
 from treeview import TreeViewHandler
 
 import gi
 gi.require_version('Gtk', '3.0')
-from gi.repository import Gtk
+from gi.repository import Gtk, GLib
 
 # i18n: http://docs.python.org/3/library/gettext.html
 import gettext
@@ -28,13 +38,18 @@ class Constructor():
     '''
     ISO Constructor main class.
     '''
-    def __init__(self):
+    def __init__(self, start_time=None, import_time=None, benchmark=False):
+        # Startup benchmark
+        self.start_time = start_time or time.monotonic()
+        self.startup_times = {'imports': import_time or 0.0}
+        self.benchmark = benchmark
         self.script_dir = abspath(dirname(__file__))
         self.share_dir = self.script_dir.replace('lib', 'share')
         self.chroot_script = join(self.share_dir, "chroot-dir.sh")
         self.user_app_dir = join(get_user_home(), ".iso-constructor")
         self.log_file = join(self.user_app_dir, 'iso-constructor.log')
         self.conf_file = join(self.user_app_dir, 'iso-constructor.conf')
+        self.metadata_file = join(self.user_app_dir, 'metadata.json')
 
         # Create the user's application directory if it doesn't exist
         self.user_name = get_logged_user()
@@ -42,10 +57,14 @@ class Constructor():
             makedirs(self.user_app_dir)
             system(f"chown -R {self.user_name}:{self.user_name} {self.user_app_dir}")
 
-        # Load window and widgets
+        # Load the main window and its widgets
+        # Secondary windows are built on first use
+        self.glade_file = join(self.share_dir, 'iso-constructor.glade')
         self.builder = Gtk.Builder()
-        self.builder.add_from_file(
-            join(self.share_dir, 'iso-constructor.glade'))
+        self.builder.add_objects_from_file(
+            self.glade_file, ['img_add', 'img_build', 'img_edit', 'img_log',
+                              'img_remove', 'img_upgrade', 'img_virt',
+                              'constructor_window'])
 
         # Main window object
         builder_obj = self.builder.get_object
@@ -75,14 +94,23 @@ class Constructor():
         self.config.read(self.conf_file)
         self.distros = self.get_distros()
 
+        # Cached distribution metadata (release info and disk usage per work directory)
+        self.metadata = self.load_metadata()
+        self.metadata_thread = None
+
+        # Disk usage indexer: (work directory, full scan) items
+        self.index_queue = queue.Queue()
+        # Work directories queued by fill_tv_dists that are not indexed yet
+        self.index_pending = set()
+        threading.Thread(target=self.index_disk_usage, daemon=True).start()
+
         # Set saved sizes
         window_width, window_height, distros_height = self.get_settings()
         self.window.set_default_size(window_width, window_height)
         self.dt_paned.set_position(distros_height)
 
-        # Remove old log file
-        if exists(self.log_file):
-            remove(self.log_file)
+        # Log writer (rotates the log file when it gets too large)
+        self.log_writer = LogWriter(self.log_file)
 
         # Main window objects
         self.tv_distros = builder_obj('tv_distros')
@@ -94,17 +122,15 @@ class Constructor():
         self.btn_upgrade = builder_obj('btn_upgrade')
         self.btn_buildiso = builder_obj('btn_build_iso')
         self.btn_virt = builder_obj('btn_virt')
+        # Shown when virtinst is installed (see check_packages)
+        self.btn_virt.set_no_show_all(True)
+        self.btn_virt.set_visible(False)
+        self.virt_installed = False
+        self.pb_progress = builder_obj('pb_progress')
 
-        # Add iso window objects
-        self.window_adddistro = builder_obj('add_distro_window')
-        self.txt_iso = builder_obj('txt_iso')
-        self.txt_dir = builder_obj('txt_dir')
-        self.btn_dir = builder_obj('btn_dir')
-        self.btn_save = builder_obj('btn_save')
-        self.lbl_iso = builder_obj('lbl_iso')
-        self.box_iso = builder_obj('box_iso')
-        self.lbl_dir = builder_obj('lbl_dir')
-        self.chk_fromiso = builder_obj('chk_from_iso')
+        # Add iso window objects (see build_add_distro_window)
+        self.window_adddistro = None
+        self.btn_dir = None
 
         # Main window translations
         self.remove_text = _("Remove")
@@ -119,51 +145,137 @@ class Constructor():
         self.btn_buildiso.set_tooltip_text(_("Build"))
         self.btn_virt.set_tooltip_text(self.test_iso_text)
 
-        # Add iso window translations
-        self.window_adddistro.set_title(_("Add Distribution"))
-        self.lbl_iso.set_text(_("ISO"))
-        builder_obj('lbl_from_iso').set_label("Create from ISO")
-        cancel = _("Cancel")
-        builder_obj('btn_cancel').set_label(f"_{cancel}")
+        # Terminal (created when the window is shown)
+        self.sw_tve = builder_obj('sw_tve')
+        self.terminal = None
 
-        # Terminal
-        self.terminal = Terminal()
-        builder_obj('sw_tve').add(self.terminal)
-        self.terminal.log_file = self.log_file
-        self.terminal.set_input_enabled(False)
+        # Progress
+        self.tracker = None
+        self.stage_texts = {'unpack': _("Unpacking"),
+                            'squashfs': _("Compressing"),
+                            'iso': _("Writing ISO")}
 
         # Init
         self.iso = None
         self.dir = None
         self.html_dir = join(self.share_dir, "html")
-        self.chk_fromiso.set_active(True)
         self.skip_select_all = False
 
         # Treeviews
         self.tv_handlerdistros = TreeViewHandler(self.tv_distros)
         self.tv_handlerdistros.connect('checkbox-toggled', self.tv_dists_toggled)
+        # Rows are keyed by the working directory (column 2)
+        self.tv_handlerdistros.setup_model(
+            column_names=[_("Select"), _("Distribution"), _("Working directory"), _("Pending updates"),
+                          _("Size (root / boot)"), _("ISO"), _("Last build")],
+            column_types_list=['bool', 'str', 'str', 'str', 'str', 'str', 'str'],
+            key_col_nr=2,
+            columns_resizable=True)
         self.fill_tv_dists()
 
         # Connect the signals and show the window
+        # The buttons are enabled when the terminal is ready
         self.builder.connect_signals(self)
+        self.enable_gui_elements(False)
+        self.first_draw_id = self.window.connect('draw', self.on_first_draw)
         self.window.show_all()
+        GLib.idle_add(self.create_terminal)
 
-        self.virt_installed = is_package_installed("virtinst")
-        if not self.virt_installed:
-            self.btn_virt.set_visible(False)
+        # Download pending upgrades in the background
+        # prefetch_interval (seconds) = 0 disables prefetching
+        self.prefetch_jobs = {}
+        prefetch_interval = self.config.getint('SETTINGS', 'prefetch_interval', fallback=3600)
+        if prefetch_interval > 0:
+            GLib.timeout_add_seconds(60, self.prefetch_upgrades, False)
+            GLib.timeout_add_seconds(prefetch_interval, self.prefetch_upgrades, True)
 
-        # Version information
-        ver = get_package_version('iso-constructor')
-        self.log(f'> ISO Constructor {ver}')
+        # Check the installed packages in the background
+        threading.Thread(target=self.check_packages, daemon=True).start()
 
     # ===============================================
     # Main Window Functions
     # ===============================================
 
+    def on_first_draw(self, widget, cairo_context):
+        ''' The main window is drawn for the first time. '''
+        self.window.disconnect(self.first_draw_id)
+        self.record_startup_time('window')
+        return False
+
+    def record_startup_time(self, milestone):
+        '''
+        Record the seconds since startup for milestone (window, list).
+        Log the startup benchmark when all milestones are reached.
+        '''
+        if milestone in self.startup_times:
+            return
+        self.startup_times[milestone] = time.monotonic() - self.start_time
+        if 'window' in self.startup_times and 'list' in self.startup_times:
+            times = ', '.join(f"{key} {self.startup_times[key]:.2f} s"
+                              for key in ('imports', 'window', 'list'))
+            print(f"Startup benchmark: {times}")
+            self.log(f"> Startup benchmark: {times}")
+            if self.benchmark:
+                GLib.idle_add(self.window.destroy)
+
+    def create_terminal(self):
+        ''' Create the terminal: Vte is imported on first use. '''
+        from terminal import Terminal
+        self.terminal = Terminal()
+        self.sw_tve.add(self.terminal)
+        self.terminal.log_writer = self.log_writer
+        self.terminal.show()
+        self.enable_gui_elements(True)
+        return False
+
+    def build_add_distro_window(self):
+        ''' Build the Add Distribution window on first use. '''
+        if self.window_adddistro:
+            return
+        self.builder.add_objects_from_file(self.glade_file, ['add_distro_window'])
+        builder_obj = self.builder.get_object
+
+        # Add iso window objects
+        self.window_adddistro = builder_obj('add_distro_window')
+        self.txt_iso = builder_obj('txt_iso')
+        self.txt_dir = builder_obj('txt_dir')
+        self.btn_dir = builder_obj('btn_dir')
+        self.btn_save = builder_obj('btn_save')
+        self.lbl_iso = builder_obj('lbl_iso')
+        self.box_iso = builder_obj('box_iso')
+        self.lbl_dir = builder_obj('lbl_dir')
+        self.chk_fromiso = builder_obj('chk_from_iso')
+
+        # Add iso window translations
+        self.window_adddistro.set_title(_("Add Distribution"))
+        self.lbl_iso.set_text(_("ISO"))
+        builder_obj('lbl_from_iso').set_label("Create from ISO")
+        cancel = _("Cancel")
+        builder_obj('btn_cancel').set_label(f"_{cancel}")
+
+        self.chk_fromiso.set_active(True)
+        # Connect the signals of the new objects
+        self.builder.connect_signals(self)
+
+    def check_packages(self):
+        ''' Get the installed package versions from the dpkg status file. '''
+        versions = get_installed_versions(['virtinst', 'iso-constructor'])
+        GLib.idle_add(self.on_packages_checked, versions)
+
+    def on_packages_checked(self, versions):
+        ''' Show the virt-manager button and log the version information. '''
+        self.virt_installed = 'virtinst' in versions
+        if self.virt_installed:
+            self.btn_virt.set_sensitive(self.tv_distros.get_sensitive())
+            self.btn_virt.show()
+        self.log(f"> ISO Constructor {versions.get('iso-constructor', '')}")
+        return False
+
     def on_btn_add_clicked(self, widget):
         '''
         Add distribution from ISO file.
         '''
+        self.build_add_distro_window()
         self.window_adddistro.show()
 
     def on_btn_remove_clicked(self, widget):
@@ -182,15 +294,6 @@ class Constructor():
                     self.save_distro(distro_path=path, add_distro=False)
             self.fill_tv_dists()
 
-    def _is_path_chrooted(self, path):
-        pid = getoutput(f'pgrep -o -f "chroot-dir.sh {path}"')
-        if pid:
-            proc = join('/proc', pid[0])
-            if exists(proc):
-                return True
-            return False
-        return False
-
     def on_btn_edit_clicked(self, widget):
         '''
         Edit selected distribution(s)
@@ -201,15 +304,13 @@ class Constructor():
             self.enable_gui_elements(False)
             for path in selected:
                 self.log(f'> Start editing {path}')
+                self.stop_prefetch(path)
 
                 # Edit the distribution in a chroot session
-                self.terminal.exec(command=f'{self.share_dir}/chroot-dir.sh "{path}/root"')
-
-                # Check if chrooted and wait until user is done
-                while self._is_path_chrooted(path):
-                    # Update the parent window
-                    while Gtk.events_pending():
-                        Gtk.main_iteration()
+                # The shell reports when the session ends: the user can scroll meanwhile
+                self.terminal.exec(command=f'{self.share_dir}/chroot-dir.sh "{path}/root"',
+                                   wait_until_done=True, disable_scrolling=False)
+                self.index_queue.put((path, True))
             self.enable_gui_elements(True)
 
     def on_btn_upgrade_clicked(self, widget):
@@ -222,10 +323,14 @@ class Constructor():
             self.enable_gui_elements(False)
             for path in selected:
                 self.log(f'> Start upgrading {path}')
+                self.stop_prefetch(path)
 
                 # Upgrade the distribtution
-                self.terminal.exec(command=f'{self.share_dir}/upgrade.sh "{path}"',
+                self.terminal.exec(command=f'{self.script_dir}/cgjob.py upgrade '
+                                           f'{self.share_dir}/upgrade.sh "{path}"',
                                    wait_until_done=True)
+                self.index_queue.put((path, True))
+            self.fill_tv_dists(select_distros=selected)
             self.enable_gui_elements(True)
 
     def on_btn_build_iso_clicked(self, widget):
@@ -238,11 +343,23 @@ class Constructor():
             self.enable_gui_elements(False)
             # Loop through selected distributions
             for path in selected:
+                # Resume an interrupted build or start over
+                resume = 'true'
+                if is_interrupted(path):
+                    answer = question_dialog(self.btn_buildiso.get_label(),
+                                             _(f"The last build in {path} was interrupted.\n"
+                                               "Do you want to resume the build?\n"
+                                               "(Stages that were done and did not change are skipped)"))
+                    resume = 'true' if answer else 'false'
                 self.log(f'> Start building ISO in: {path}')
+                self.stop_prefetch(path)
 
                 # Build the ISO
-                self.terminal.exec(command=f'{self.share_dir}/build.sh "{path}"',
-                                   wait_until_done=True)
+                self.exec_with_progress(command=f'RESUME={resume} '
+                                                f'{self.script_dir}/cgjob.py --report "{path}" build '
+                                                f'{self.share_dir}/build.sh "{path}"',
+                                        work_dir=path, report=True)
+                self.index_queue.put((path, True))
             self.enable_gui_elements(True)
 
     def on_btn_virt_clicked(self, widget):
@@ -296,6 +413,7 @@ class Constructor():
 
     def on_constructor_window_destroy(self, widget):
         ''' Close the app '''
+        self.log_writer.close()
         Gtk.main_quit()
 
     # ===============================================
@@ -373,8 +491,9 @@ class Constructor():
                 self.log(f'> Start unpacking {self.iso} to {self.dir}')
 
                 # Start unpacking the ISO
-                self.terminal.exec(command=f'{self.share_dir}/unpack.sh "{self.iso}" "{self.dir}"',
-                                   wait_until_done=True)
+                self.exec_with_progress(command=f'{self.script_dir}/cgjob.py unpack '
+                                                f'{self.share_dir}/unpack.sh "{self.iso}" "{self.dir}"',
+                                        work_dir=self.dir)
 
                 self.save_distro(self.dir)
                 self.fill_tv_dists()
@@ -455,25 +574,225 @@ class Constructor():
     # General functions
     # ===============================================
 
-    def fill_tv_dists(self, select_distros=[]):
+    def fill_tv_dists(self, select_distros=None):
         '''
-        Fill the TreeView with distributions.
+        Update the TreeView with distributions: rows are only
+        inserted, updated or removed.
+        select_distros=None keeps the current selection.
         '''
-        content_list = [
-            [_("Select"), _("Distribution"), _("Working directory")]]
+        if select_distros is None:
+            select_distros = self.tv_handlerdistros.get_toggled_values(
+                toggle_col_nr=0, value_col_nr=2)
 
+        rows = []
+        uncached = []
         for distro in self.distros:
             select = False
-            lsb_info = get_lsb_release_info(distro + '/root')
+            lsb_info = self.get_cached_release_info(distro)
+            if not lsb_info:
+                # Show the directory until the release info is loaded
+                uncached.append(distro)
+                lsb_info = {'name': basename(distro)}
             for select_distro in select_distros:
                 if distro == select_distro or distro == lsb_info['name']:
                     select = True
-            content_list.append([select, lsb_info['name'], distro])
-        self.tv_handlerdistros.fill_treeview(content_list=content_list,
-                                             column_types_list=[
-                                                 'bool', 'str', 'str'],
-                                             first_item_is_col_name=True,
-                                             columns_resizable=True)
+            if not self.metadata.get(distro, {}).get('figures') and distro not in self.index_pending:
+                self.index_pending.add(distro)
+                self.index_queue.put((distro, False))
+            rows.append([select, lsb_info['name'], distro, self.get_pending_updates(distro)] +
+                        self.get_disk_usage_texts(distro))
+        self.tv_handlerdistros.set_rows(rows)
+        if uncached:
+            self.load_release_info(uncached)
+        else:
+            self.record_startup_time('list')
+
+    def load_metadata(self):
+        ''' Load the cached distribution metadata. '''
+        try:
+            with open(file=self.metadata_file, mode='r', encoding='utf-8') as metadata_fle:
+                return json.load(metadata_fle)
+        except (OSError, ValueError):
+            return {}
+
+    def save_metadata(self):
+        ''' Save the distribution metadata cache. '''
+        try:
+            with open(file=self.metadata_file, mode='w', encoding='utf-8') as metadata_fle:
+                json.dump(self.metadata, metadata_fle, indent=2)
+        except OSError as detail:
+            print(f"Cannot save {self.metadata_file}: {detail}")
+
+    @staticmethod
+    def get_release_mtimes(distro):
+        ''' Return dict with the modification times of the release files. '''
+        mtimes = {}
+        for release_file in get_release_files(join(distro, 'root')):
+            try:
+                mtimes[release_file] = getmtime(release_file)
+            except OSError:
+                pass
+        return mtimes
+
+    def get_cached_release_info(self, distro):
+        ''' Return the cached release info when the release files did not change. '''
+        cached = self.metadata.get(distro)
+        if cached and cached.get('mtimes') == self.get_release_mtimes(distro):
+            return cached.get('info')
+        return None
+
+    def load_release_info(self, distros):
+        '''
+        Read the release info of the distributions in a thread.
+        Only the main loop changes the metadata (on_release_info_loaded):
+        save_metadata can dump it while the thread runs.
+        '''
+        if self.metadata_thread and self.metadata_thread.is_alive():
+            return
+
+        def load():
+            for distro in distros:
+                release = {'mtimes': self.get_release_mtimes(distro),
+                           'info': get_lsb_release_info(join(distro, 'root'))}
+                GLib.idle_add(self.on_release_info_loaded, distro, release)
+            GLib.idle_add(self.on_release_info_loaded, None, None)
+
+        self.metadata_thread = threading.Thread(target=load, daemon=True)
+        self.metadata_thread.start()
+
+    def on_release_info_loaded(self, distro, release):
+        '''
+        Cache the release info and show the distribution name in place.
+        distro=None: all are loaded, save the metadata cache.
+        '''
+        if distro:
+            self.metadata.setdefault(distro, {}).update(release)
+            info = release['info'] or {}
+            if info.get('name'):
+                self.tv_handlerdistros.update_row(distro, {1: info['name']})
+            return False
+
+        # Remove work directories that are no longer listed
+        for cached_distro in list(self.metadata):
+            if cached_distro not in self.distros:
+                self.metadata.pop(cached_distro)
+        self.save_metadata()
+        # Load directories that were added in the meantime
+        self.metadata_thread = None
+        self.fill_tv_dists()
+        return False
+
+    def index_disk_usage(self):
+        '''
+        Disk usage indexer thread: update the index of the queued work directories.
+        Only directories that changed since the last scan are listed again,
+        unless a full scan was queued (after a job).
+        '''
+        while True:
+            distro, full = self.index_queue.get()
+            figures = update_index(distro, full) if exists(distro) else None
+            GLib.idle_add(self.on_disk_usage_indexed, distro, figures)
+
+    def on_disk_usage_indexed(self, distro, figures):
+        ''' Show the disk usage figures in place and cache them. '''
+        self.index_pending.discard(distro)
+        if figures and distro in self.distros:
+            self.metadata.setdefault(distro, {})['figures'] = figures
+            texts = self.get_disk_usage_texts(distro)
+            self.tv_handlerdistros.update_row(distro, {4: texts[0], 5: texts[1], 6: texts[2]})
+            self.save_metadata()
+        return False
+
+    def get_disk_usage_texts(self, distro):
+        ''' Return the disk usage column texts: root / boot size, ISO size and age, last build. '''
+        figures = self.metadata.get(distro, {}).get('figures')
+        if not figures:
+            return ['', '', '']
+        iso = ''
+        if figures.get('iso'):
+            iso = f"{human_size(figures['iso_size'])}, {format_age(figures['iso_mtime'])}"
+        build = format_eta(figures['build_duration']) if figures.get('build_duration') else ''
+        return [f"{human_size(figures['root'])} / {human_size(figures['boot'])}", iso, build]
+
+    def exec_with_progress(self, command, work_dir, report=False):
+        '''
+        Execute command in the terminal and show its progress.
+        Stage durations are saved in the work directory to predict the ETA.
+        '''
+        self.tracker = ProgressTracker(work_dir,
+                                       callback=lambda event: GLib.idle_add(self.show_progress, event))
+        self.terminal.output_handler = self.tracker.feed_output
+        exit_status = self.terminal.exec(command=command, wait_until_done=True)
+        self.terminal.output_handler = None
+        self.tracker.finish(command, exit_status, report)
+        self.tracker = None
+        self.pb_progress.hide()
+        return exit_status
+
+    def show_progress(self, event):
+        ''' Show a progress event in the progress bar. '''
+        if self.tracker:
+            stage = self.stage_texts.get(event['stage'], event['stage'])
+            self.pb_progress.set_fraction(min(event['percent'], 100) / 100)
+            self.pb_progress.set_text(f"{stage}: {event['percent']:.0f}% - "
+                                      f"{_('ETA')} {format_eta(event['eta'])}")
+            self.pb_progress.show()
+        return False
+
+    def get_pending_updates(self, distro):
+        '''
+        Get the prefetched upgrades as text: packages / size.
+        '''
+        prefetch_file = join(distro, '.prefetch')
+        if not exists(prefetch_file):
+            return ''
+        prefetch = get_config_dict(prefetch_file)
+        packages = prefetch.get('PACKAGES', '0')
+        if packages == '0':
+            return _("Up to date")
+        return f"{packages} / {human_size(prefetch.get('BYTES', 0))}"
+
+    def prefetch_upgrades(self, repeat=True):
+        '''
+        Start prefetch.sh in the background for each distribution.
+        '''
+        # Do not interfere with running jobs
+        if self.tv_distros.get_sensitive():
+            for distro in self.distros:
+                if distro in self.prefetch_jobs:
+                    continue
+                pid, _stdin, _stdout, _stderr = GLib.spawn_async(
+                    argv=[join(self.script_dir, 'cgjob.py'), 'prefetch',
+                          join(self.share_dir, 'prefetch.sh'), distro],
+                    flags=GLib.SpawnFlags.DO_NOT_REAP_CHILD |
+                          GLib.SpawnFlags.STDOUT_TO_DEV_NULL |
+                          GLib.SpawnFlags.STDERR_TO_DEV_NULL,
+                    # Own process group: stop_prefetch stops all its processes
+                    child_setup=setsid)
+                self.prefetch_jobs[distro] = pid
+                GLib.child_watch_add(GLib.PRIORITY_DEFAULT, pid,
+                                     self.on_prefetch_done, distro)
+        return repeat
+
+    def stop_prefetch(self, distro):
+        '''
+        Stop a running prefetch: it yields to the jobs of the user.
+        The job waits for the work directory lock until the prefetch has stopped.
+        '''
+        pid = self.prefetch_jobs.get(distro)
+        if pid:
+            try:
+                killpg(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def on_prefetch_done(self, pid, status, distro):
+        '''
+        Prefetch finished: show the pending updates.
+        '''
+        GLib.spawn_close_pid(pid)
+        self.prefetch_jobs.pop(distro, None)
+        self.tv_handlerdistros.update_row(distro, {3: self.get_pending_updates(distro)})
 
     def tv_dists_toggled(self, obj, path, col_nr, toggle_value, data=None):
         ''' Callback function for toggled checkboxes in a treeview '''
@@ -495,7 +814,8 @@ class Constructor():
         Enable/Disable GUI elements.
         '''
         if not enable:
-            self.terminal.set_input_enabled(True)
+            if self.terminal:
+                self.terminal.set_input_enabled(True)
             self.chk_selectall.set_sensitive(False)
             self.tv_distros.set_sensitive(False)
             self.btn_add.set_sensitive(False)
@@ -503,11 +823,13 @@ class Constructor():
             self.btn_edit.set_sensitive(False)
             self.btn_remove.set_sensitive(False)
             self.btn_upgrade.set_sensitive(False)
-            self.btn_dir.set_sensitive(False)
+            if self.btn_dir:
+                self.btn_dir.set_sensitive(False)
             if self.virt_installed:
                 self.btn_virt.set_sensitive(False)
         else:
-            self.terminal.set_input_enabled(False)
+            if self.terminal:
+                self.terminal.set_input_enabled(False)
             self.chk_selectall.set_sensitive(True)
             self.tv_distros.set_sensitive(True)
             self.btn_add.set_sensitive(True)
@@ -515,7 +837,8 @@ class Constructor():
             self.btn_edit.set_sensitive(True)
             self.btn_remove.set_sensitive(True)
             self.btn_upgrade.set_sensitive(True)
-            self.btn_dir.set_sensitive(True)
+            if self.btn_dir:
+                self.btn_dir.set_sensitive(True)
             if self.virt_installed:
                 self.btn_virt.set_sensitive(True)
 
@@ -573,9 +896,8 @@ class Constructor():
         '''
         Save text to the log file.
         '''
-        if self.log_file and text:
-            with open(file=self.log_file, mode='a', encoding='utf-8') as log_fle:
-                log_fle.write(text + '\n')
+        if text:
+            self.log_writer.write(text)
 
     def get_language_dir(self):
         '''
@@ -0,0 +1,344 @@
+#!/usr/bin/env python3
+""" Module to deduplicate identical files across work directories
+
+Usage:
+    dedupe.py [--dry-run] [WORKDIR ...]
+        Replace identical regular files in the root directories with reflinks,
+        or with hard links when the file system does not support reflinks
+        (only between work directories: a root never links to itself).
+        Without WORKDIR the registered distributions are deduplicated.
+    dedupe.py protect ROOT
+        Give the hard linked files of ROOT their own copy again
+        (chroot-dir.sh runs this before a chroot session writes to ROOT
+        and before the session's journal watcher starts).
+
+The file digests are kept in ~/.iso-constructor/dedupe-index.json:
+only new and changed files are hashed again.
+Run with low priority in the background, e.g.: nice ionice -c 3 dedupe.py
+"""
+
+import os
+import sys
+import json
+import stat
+import fcntl
+import errno
+import shutil
+import filecmp
+import hashlib
+from configparser import ConfigParser
+from os.path import join, exists, dirname, basename
+from utils import get_user_home, human_size
+from journal import read_journal, seal_journal
+
+INDEX_FILE = 'dedupe-index.json'
+# Bump when the index layout changes
+INDEX_VERSION = 2
+LOCK_FILE = '.chroot.lock'
+# Smaller files are not worth it
+MIN_SIZE = 16384
+BLOCK_SIZE = 1048576
+# linux/fs.h: _IOW(0x94, 9, int)
+FICLONE = 0x40049409
+# Hard links only in directories whose files are replaced (not written in place) by dpkg
+HARDLINK_DIRS = ('bin/', 'lib/', 'lib32/', 'lib64/', 'libx32/', 'opt/', 'sbin/', 'usr/')
+
+
+def get_index_file():
+    ''' Return the path of the digest index. '''
+    return join(get_user_home(), '.iso-constructor', INDEX_FILE)
+
+
+def load_index():
+    ''' Load the digest index. '''
+    try:
+        with open(file=get_index_file(), mode='r', encoding='utf-8') as index_fle:
+            index = json.load(index_fle)
+    except (OSError, ValueError):
+        return {'version': INDEX_VERSION, 'files': {}, 'hardlinks': [], 'reflinks': {}}
+    if index.get('version') != INDEX_VERSION:
+        return {'version': INDEX_VERSION, 'files': {}, 'hardlinks': [], 'reflinks': {}}
+    return index
+
+
+def save_index(index):
+    ''' Save the digest index. '''
+    try:
+        with open(file=get_index_file(), mode='w', encoding='utf-8') as index_fle:
+            json.dump(index, index_fle, separators=(',', ':'))
+    except OSError as detail:
+        print(f"Cannot save {get_index_file()}: {detail}")
+
+
+def get_registered_work_dirs():
+    ''' Return the work directories of the distribution list. '''
+    config = ConfigParser()
+    config.read(join(get_user_home(), '.iso-constructor', 'iso-constructor.conf'))
+    distros = config.get('DISTROS', 'distro_paths', fallback='').split(';')
+    return [distro for distro in distros if distro and exists(join(distro, 'root'))]
+
+
+def get_digest(path):
+    ''' Return the sha256 digest of a file. '''
+    sha256 = hashlib.sha256()
+    with open(file=path, mode='rb') as fle:
+        for block in iter(lambda: fle.read(BLOCK_SIZE), b''):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+def scan_files(root_dirs):
+    ''' Return dict: path: stat result of the regular files of at least MIN_SIZE. '''
+    files = {}
+    for root_dir in root_dirs:
+        for dir_path, _dir_names, file_names in os.walk(root_dir):
+            for name in file_names:
+                path = join(dir_path, name)
+                try:
+                    st = os.lstat(path)
+                except OSError:
+                    continue
+                if stat.S_ISREG(st.st_mode) and st.st_size >= MIN_SIZE:
+                    files[path] = st
+    return files
+
+
+def get_key(st):
+    ''' Return the index key of a stat result: size, modification time and inode. '''
+    return [st.st_size, st.st_mtime_ns, st.st_ino]
+
+
+def update_digests(index, files):
+    '''
+    Hash the files that share their size with another file.
+    Files with the same size, modification time and inode as in the index keep their digest.
+    '''
+    sizes = {}
+    for st in files.values():
+        sizes[st.st_size] = sizes.get(st.st_size, 0) + 1
+    old = index['files']
+    index['files'] = {}
+    nr_hashed = 0
+    for path, st in files.items():
+        if sizes[st.st_size] < 2:
+            continue
+        key = get_key(st)
+        cached = old.get(path)
+        if cached and cached[:3] == key:
+            index['files'][path] = cached
+            continue
+        try:
+            index['files'][path] = key + [get_digest(path)]
+            nr_hashed += 1
+        except OSError:
+            continue
+    print(f"> Hashed {nr_hashed} new or changed files")
+
+
+def keep_dir_times(path):
+    ''' Return a function that restores the times of the parent directory of path. '''
+    parent = dirname(path)
+    st = os.stat(parent)
+    return lambda: os.utime(parent, ns=(st.st_atime_ns, st.st_mtime_ns))
+
+
+def reflink(src, dst):
+    ''' Share the data blocks of src with dst (dst keeps its inode and metadata). '''
+    st = os.lstat(dst)
+    src_fd = os.open(src, os.O_RDONLY)
+    try:
+        dst_fd = os.open(dst, os.O_WRONLY)
+        try:
+            fcntl.ioctl(dst_fd, FICLONE, src_fd)
+        finally:
+            os.close(dst_fd)
+    finally:
+        os.close(src_fd)
+    os.utime(dst, ns=(st.st_atime_ns, st.st_mtime_ns))
+
+
+def hardlink(src, dst):
+    ''' Replace dst with a hard link to src. '''
+    restore_dir_times = keep_dir_times(dst)
+    tmp = join(dirname(dst), f".{basename(dst)}.dedupe")
+    os.link(src, tmp)
+    os.replace(tmp, dst)
+    restore_dir_times()
+
+
+def can_hardlink(rel_path, src_st, dst_st):
+    ''' Hard linked files share their metadata: it must be the same. '''
+    return rel_path.startswith(HARDLINK_DIRS) and \
+        (src_st.st_mode, src_st.st_uid, src_st.st_gid, src_st.st_mtime_ns) == \
+        (dst_st.st_mode, dst_st.st_uid, dst_st.st_gid, dst_st.st_mtime_ns)
+
+
+def lock_work_dirs(work_dirs):
+    ''' Lock the work directories without a running chroot session (returns the locked ones). '''
+    locked = {}
+    for work_dir in work_dirs:
+        lock_fle = open(file=join(work_dir, LOCK_FILE), mode='w', encoding='utf-8')
+        try:
+            fcntl.flock(lock_fle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            locked[work_dir] = lock_fle
+        except BlockingIOError:
+            print(f"{work_dir} is busy - skip")
+            lock_fle.close()
+    return locked
+
+
+def get_root_dir(path, root_dirs):
+    ''' Return the root directory path is in. '''
+    return next(root_dir for root_dir in root_dirs if path.startswith(root_dir + '/'))
+
+
+def dedupe(work_dirs, dry_run=False):
+    ''' Deduplicate the root directories of the work directories. '''
+    roots = {join(work_dir, 'root'): work_dir for work_dir in work_dirs}
+    index = load_index()
+    files = scan_files(roots)
+    update_digests(index, files)
+    save_index(index)
+
+    # Identical files on the same file system
+    groups = {}
+    for path, (size, _mtime, _ino, digest) in index['files'].items():
+        groups.setdefault((files[path].st_dev, size, digest), []).append(path)
+
+    locked = {} if dry_run else lock_work_dirs(work_dirs)
+    # The file content does not change: complete journals (see journal.py) stay complete
+    sealed = [join(work_dir, 'root') for work_dir in locked
+              if read_journal(join(work_dir, 'root')) is not None]
+    hardlinks = set(index['hardlinks'])
+    # dst: [src, key of src, key of dst] of the reflinked files
+    reflinks = index['reflinks']
+    use_reflinks = {}
+    reclaimed = nr_files = 0
+    try:
+        for (dev, size, _digest), paths in groups.items():
+            if len(paths) < 2:
+                continue
+            paths.sort()
+            src = paths[0]
+            for dst in paths[1:]:
+                root_dir = get_root_dir(dst, roots)
+                src_root_dir = get_root_dir(src, roots)
+                if not dry_run and (roots[root_dir] not in locked or roots[src_root_dir] not in locked):
+                    continue
+                src_st, dst_st = files[src], files[dst]
+                if src_st.st_ino == dst_st.st_ino:
+                    continue
+                # Reflinked files keep their inode: skip unchanged pairs
+                if reflinks.get(dst) == [src, get_key(src_st), get_key(dst_st)]:
+                    continue
+                if dry_run:
+                    reclaimed += dst_st.st_blocks * 512
+                    nr_files += 1
+                    continue
+                try:
+                    # The index may be outdated
+                    if not filecmp.cmp(src, dst, shallow=False):
+                        continue
+                    if use_reflinks.get(dev, True):
+                        try:
+                            reflink(src, dst)
+                            use_reflinks[dev] = True
+                            reflinks[dst] = [src, get_key(os.lstat(src)), get_key(os.lstat(dst))]
+                        except OSError as detail:
+                            if detail.errno not in (errno.EOPNOTSUPP, errno.ENOTTY,
+                                                    errno.EINVAL, errno.EXDEV):
+                                raise
+                            use_reflinks[dev] = False
+                    if not use_reflinks[dev]:
+                        # Hard links in one root would end up in its squashfs when a build
+                        # does not enter the chroot (protect) first
+                        if root_dir == src_root_dir or \
+                           not can_hardlink(os.path.relpath(dst, root_dir), src_st, dst_st):
+                            continue
+                        hardlink(src, dst)
+                        hardlinks.update((src, dst))
+                except OSError as detail:
+                    print(f"Cannot deduplicate {dst}: {detail}")
+                    continue
+                reclaimed += dst_st.st_blocks * 512
+                nr_files += 1
+    finally:
+        for root_dir in sealed:
+            seal_journal(root_dir)
+        for lock_fle in locked.values():
+            lock_fle.close()
+
+    if not dry_run:
+        # Refresh the index entries of the replaced files
+        for path in list(index['files']):
+            try:
+                st = os.lstat(path)
+                index['files'][path][:3] = get_key(st)
+            except OSError:
+                del index['files'][path]
+        index['hardlinks'] = sorted(hardlinks)
+        index['reflinks'] = {dst: pair for dst, pair in reflinks.items()
+                             if dst in index['files'] and pair[0] in index['files']}
+        save_index(index)
+    mode = 'can be reclaimed' if dry_run else 'reclaimed'
+    print(f"> {human_size(reclaimed)} {mode} in {nr_files} files")
+    return 0
+
+
+def protect(root_dir):
+    ''' Copy the hard linked files of root_dir, so writes do not change other work directories. '''
+    root_dir = os.path.abspath(root_dir)
+    # The copies have the same content and times: a complete journal (see journal.py) stays complete
+    sealed = read_journal(root_dir) is not None
+    index = load_index()
+    hardlinks = set(index['hardlinks'])
+    protected = [path for path in hardlinks if path.startswith(root_dir + '/')]
+    nr_copied = 0
+    for path in protected:
+        hardlinks.discard(path)
+        try:
+            st = os.lstat(path)
+            if not stat.S_ISREG(st.st_mode) or st.st_nlink < 2:
+                continue
+            restore_dir_times = keep_dir_times(path)
+            tmp = join(dirname(path), f".{basename(path)}.dedupe")
+            shutil.copy2(path, tmp)
+            os.chown(tmp, st.st_uid, st.st_gid)
+            os.chmod(tmp, stat.S_IMODE(st.st_mode))
+            os.replace(tmp, path)
+            restore_dir_times()
+            nr_copied += 1
+        except OSError as detail:
+            print(f"Cannot copy {path}: {detail}")
+    if protected:
+        index['hardlinks'] = sorted(hardlinks)
+        save_index(index)
+    if sealed and nr_copied:
+        seal_journal(root_dir)
+    if nr_copied:
+        print(f"> Copied {nr_copied} hard linked files of {root_dir}")
+    return 0
+
+
+def main(args):
+    ''' Command line interface. '''
+    if args and args[0] == 'protect':
+        if len(args) != 2:
+            print(__doc__)
+            return 1
+        return protect(args[1])
+    dry_run = False
+    if args and args[0] == '--dry-run':
+        dry_run = True
+        args = args[1:]
+    work_dirs = args or get_registered_work_dirs()
+    work_dirs = [os.path.abspath(work_dir) for work_dir in work_dirs
+                 if exists(join(work_dir, 'root'))]
+    if not work_dirs:
+        print(__doc__)
+        return 1
+    return dedupe(work_dirs, dry_run)
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
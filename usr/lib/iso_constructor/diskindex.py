@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+""" Module to index the disk usage and build artifacts of work directories
+
+Usage:
+    diskindex.py WORKDIR [WORKDIR ...]
+        Update the index of each work directory and list the figures.
+"""
+
+import os
+import sys
+import json
+import stat
+import time
+from glob import glob
+from os.path import join, exists, getmtime, getsize, basename
+from utils import human_size
+from progress import format_eta
+
+INDEX_FILE = '.disk-index.json'
+REPORT_FILE = 'build-report.json'
+# Bump when the index layout changes
+INDEX_VERSION = 1
+# Files that grow in place (e.g. logs) do not change the mtime of their directory:
+# scan without the cached directories at least once a day
+FULL_SCAN_INTERVAL = 86400
+
+
+def scan_usage(top_dir, previous=None):
+    '''
+    Return the disk usage (bytes) of top_dir and the directory index.
+    Directory index: relative path: [mtime_ns, bytes of the files, sub directories]
+    Only directories with a changed mtime are listed again,
+    the others reuse the figures of the previous index.
+    Files that are hard linked are counted once per directory.
+    '''
+    previous = previous or {}
+    index = {}
+    total = 0
+    stack = ['']
+    while stack:
+        rel_dir = stack.pop()
+        path = join(top_dir, rel_dir) if rel_dir else top_dir
+        try:
+            dir_st = os.lstat(path)
+        except OSError:
+            continue
+        mtime_ns = dir_st.st_mtime_ns
+        total += dir_st.st_blocks * 512
+        cached = previous.get(rel_dir)
+        if cached and cached[0] == mtime_ns:
+            nr_bytes, sub_dirs = cached[1], cached[2]
+        else:
+            nr_bytes, sub_dirs, inodes = 0, [], set()
+            try:
+                entries = list(os.scandir(path))
+            except OSError as detail:
+                print(f"Cannot scan {path}: {detail}")
+                entries = []
+            for entry in entries:
+                try:
+                    st = entry.stat(follow_symlinks=False)
+                except OSError:
+                    continue
+                if stat.S_ISDIR(st.st_mode):
+                    sub_dirs.append(join(rel_dir, entry.name) if rel_dir else entry.name)
+                    continue
+                if st.st_nlink > 1:
+                    if st.st_ino in inodes:
+                        continue
+                    inodes.add(st.st_ino)
+                nr_bytes += st.st_blocks * 512
+        index[rel_dir] = [mtime_ns, nr_bytes, sub_dirs]
+        total += nr_bytes
+        stack.extend(sub_dirs)
+    return total, index
+
+
+def get_latest_iso(work_dir):
+    ''' Return the path of the most recent ISO in the work directory or None. '''
+    isos = glob(join(work_dir, '*.iso'))
+    if not isos:
+        return None
+    return max(isos, key=getmtime)
+
+
+def get_last_build_duration(work_dir):
+    ''' Return the duration (seconds) of the last successful build or None. '''
+    try:
+        with open(file=join(work_dir, REPORT_FILE), mode='r', encoding='utf-8') as report_fle:
+            report = json.load(report_fle)
+    except (OSError, ValueError):
+        return None
+    if report.get('exit_status') != 0:
+        return None
+    return report.get('duration')
+
+
+def load_index(work_dir):
+    ''' Load the stored index of the work directory. '''
+    try:
+        with open(file=join(work_dir, INDEX_FILE), mode='r', encoding='utf-8') as index_fle:
+            index = json.load(index_fle)
+    except (OSError, ValueError):
+        return {}
+    if index.get('version') != INDEX_VERSION:
+        return {}
+    return index
+
+
+def save_index(work_dir, index):
+    ''' Save the index in the work directory. '''
+    try:
+        with open(file=join(work_dir, INDEX_FILE), mode='w', encoding='utf-8') as index_fle:
+            json.dump(index, index_fle, separators=(',', ':'))
+    except OSError as detail:
+        print(f"Cannot save {join(work_dir, INDEX_FILE)}: {detail}")
+
+
+def update_index(work_dir, full=False):
+    '''
+    Update the index of the work directory.
+    With full=True (e.g. after a job changed files in place) all directories are listed again.
+    Returns dict: root, boot (bytes), iso (path), iso_size (bytes),
+    iso_mtime (seconds since epoch), build_duration (seconds)
+    '''
+    index = load_index(work_dir)
+    if full or time.time() - index.get('scanned', 0) > FULL_SCAN_INTERVAL:
+        index = {'scanned': time.time()}
+    figures = {}
+    figures['root'], index['root'] = scan_usage(join(work_dir, 'root'), index.get('root'))
+    # Few directories, but the squashfs files are rewritten in place: always listed again
+    figures['boot'], index['boot'] = scan_usage(join(work_dir, 'boot'))
+    iso = get_latest_iso(work_dir)
+    figures['iso'] = iso
+    figures['iso_size'] = getsize(iso) if iso else None
+    figures['iso_mtime'] = getmtime(iso) if iso else None
+    figures['build_duration'] = get_last_build_duration(work_dir)
+    index['version'] = INDEX_VERSION
+    index['figures'] = figures
+    save_index(work_dir, index)
+    return figures
+
+
+def get_indexed_figures(work_dir):
+    ''' Return the figures of the last index update (without scanning) or None. '''
+    return load_index(work_dir).get('figures')
+
+
+def format_age(seconds_since_epoch):
+    ''' Return the age as text: minutes, hours or days. '''
+    age = max(time.time() - seconds_since_epoch, 0)
+    if age < 3600:
+        return f"{int(age / 60)} min"
+    if age < 86400:
+        return f"{int(age / 3600)} h"
+    return f"{int(age / 86400)} d"
+
+
+def main(args):
+    ''' List the figures of the work directories. '''
+    if not args:
+        print(__doc__)
+        return 1
+    for work_dir in args:
+        if not exists(work_dir):
+            print(f"Cannot find {work_dir}")
+            continue
+        figures = update_index(work_dir)
+        iso = '-'
+        if figures['iso']:
+            iso = (f"{basename(figures['iso'])} {human_size(figures['iso_size'])}, "
+                   f"{format_age(figures['iso_mtime'])}")
+        build = format_eta(figures['build_duration']) if figures['build_duration'] else '-'
+        print(f"{work_dir}\n"
+              f"  root:       {human_size(figures['root'])}\n"
+              f"  boot:       {human_size(figures['boot'])}\n"
+              f"  iso:        {iso}\n"
+              f"  last build: {build}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
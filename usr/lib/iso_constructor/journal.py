@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+""" Module to journal the changed paths of a root directory with inotify
+
+Usage:
+    journal.py watch ROOT
+        Watch ROOT in the background (prints the pid of the watcher).
+        Changed paths are appended to ROOT.journal until the watcher
+        receives SIGTERM. Nothing is watched when ROOT.journal does not exist.
+    journal.py reset ROOT MANIFEST
+        Start a new journal for MANIFEST (see layers.py).
+    journal.py list ROOT
+        List the changed paths.
+
+Journal: the first line holds the modification time of the manifest
+the journal started with, followed by one changed path per line.
+A line with a single asterisk means the journal is incomplete.
+When the watcher stops it seals the journal with the time it stopped:
+the journal is only complete when the root directories did not change
+after that time (e.g. apt-get download by build.sh or a file manager).
+"""
+
+import os
+import sys
+import errno
+import ctypes
+import select
+import signal
+import struct
+import time
+from os.path import join, exists
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_EXCL_UNLINK = 0x04000000
+IN_ISDIR = 0x40000000
+WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | \
+             IN_DELETE | IN_ONLYDIR | IN_DONT_FOLLOW | IN_EXCL_UNLINK
+EVENT_HEADER = struct.Struct('iIII')
+INCOMPLETE = '*'
+SEALED = '#sealed'
+# Seconds between two journal writes
+FLUSH_INTERVAL = 1
+
+
+def get_journal_file(root_dir):
+    ''' Return the journal file of root_dir. '''
+    return root_dir.rstrip('/') + '.journal'
+
+
+def get_manifest_id(manifest_file):
+    ''' Return the id of the manifest the journal belongs to. '''
+    return f"#manifest {os.stat(manifest_file).st_mtime_ns}"
+
+
+def reset_journal(root_dir, manifest_file):
+    ''' Start a new, empty journal for the manifest. '''
+    with open(file=get_journal_file(root_dir), mode='w', encoding='utf-8') as journal_fle:
+        journal_fle.write(f"{get_manifest_id(manifest_file)}\n{SEALED} {time.time_ns()}\n")
+
+
+def seal_journal(root_dir):
+    ''' Mark the journal as complete until now. '''
+    with open(file=get_journal_file(root_dir), mode='a', encoding='utf-8') as journal_fle:
+        journal_fle.write(f"{SEALED} {time.time_ns()}\n")
+
+
+def mark_incomplete(root_dir):
+    ''' Mark the journal as incomplete. '''
+    with open(file=get_journal_file(root_dir), mode='a', encoding='utf-8') as journal_fle:
+        journal_fle.write(INCOMPLETE + '\n')
+
+
+def is_changed_since(root_dir, since_ns):
+    '''
+    Check if a directory of root_dir changed (added, removed or renamed
+    paths, changed attributes) after since_ns.
+    '''
+    stack = [root_dir]
+    while stack:
+        path = stack.pop()
+        try:
+            if os.lstat(path).st_ctime_ns > since_ns:
+                return True
+            entries = list(os.scandir(path))
+        except OSError:
+            continue
+        stack.extend(entry.path for entry in entries if entry.is_dir(follow_symlinks=False))
+    return False
+
+
+def read_journal(root_dir, manifest_file=None):
+    '''
+    Return the set of changed paths (relative to root_dir).
+    Returns None when the journal is missing, incomplete, not sealed,
+    did not start with manifest_file or root_dir changed after the seal.
+    '''
+    journal_file = get_journal_file(root_dir)
+    if not exists(journal_file):
+        return None
+    with open(file=journal_file, mode='r', encoding='utf-8', errors='surrogateescape') as journal_fle:
+        lines = journal_fle.read().splitlines()
+    if not lines or (manifest_file and lines[0] != get_manifest_id(manifest_file)):
+        return None
+    if not lines[-1].startswith(SEALED + ' '):
+        return None
+    dirty = set(line for line in lines[1:] if not line.startswith(SEALED + ' '))
+    if INCOMPLETE in dirty:
+        return None
+    if is_changed_since(root_dir.rstrip('/'), int(lines[-1].split()[1])):
+        print(f"{root_dir} changed outside a chroot session: journal incomplete", file=sys.stderr)
+        return None
+    dirty.discard('')
+    return dirty
+
+
+class Watcher():
+    ''' Watch all directories of root_dir and journal the changed paths. '''
+    def __init__(self, root_dir):
+        self.root_dir = root_dir.rstrip('/')
+        self.journal_file = get_journal_file(root_dir)
+        self.libc = ctypes.CDLL(None, use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1')
+        self.watches = {}
+        self.dirty = set()
+        self.incomplete = False
+        self.stop = False
+
+    def add_watches(self, rel_dir, mark_dirty=False):
+        ''' Watch rel_dir and its sub directories (mark their content dirty for new trees). '''
+        stack = [rel_dir]
+        while stack and not self.incomplete:
+            rel = stack.pop()
+            path = join(self.root_dir, rel) if rel else self.root_dir
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+            if wd < 0:
+                err = ctypes.get_errno()
+                if err in (errno.ENOENT, errno.ENOTDIR):
+                    continue
+                # ENOSPC: fs.inotify.max_user_watches reached
+                print(f"Cannot watch {path}: {os.strerror(err)}", file=sys.stderr)
+                self.incomplete = True
+                return
+            self.watches[wd] = rel
+            try:
+                entries = list(os.scandir(path))
+            except OSError:
+                continue
+            for entry in entries:
+                entry_rel = join(rel, entry.name) if rel else entry.name
+                if mark_dirty:
+                    self.dirty.add(entry_rel)
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry_rel)
+
+    def read_events(self):
+        ''' Read the queued inotify events. '''
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                return
+            offset = 0
+            while offset < len(data):
+                wd, mask, _cookie, length = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size
+                name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+                offset += length
+                self.handle_event(wd, mask, name)
+
+    def handle_event(self, wd, mask, name):
+        ''' Add the path of an event to the dirty set. '''
+        if mask & IN_Q_OVERFLOW:
+            self.incomplete = True
+            return
+        if mask & IN_IGNORED:
+            self.watches.pop(wd, None)
+            return
+        rel_dir = self.watches.get(wd)
+        if rel_dir is None:
+            return
+        if rel_dir:
+            # The directory itself changed (mtime)
+            self.dirty.add(rel_dir)
+        if not name:
+            return
+        if '\n' in name:
+            self.incomplete = True
+            return
+        rel = join(rel_dir, name) if rel_dir else name
+        self.dirty.add(rel)
+        if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+            # Content may be created before the new directory is watched
+            self.add_watches(rel, mark_dirty=True)
+
+    def flush(self, written):
+        ''' Append the new dirty paths to the journal. '''
+        new = self.dirty - written
+        if self.incomplete:
+            new = {INCOMPLETE}
+        if not new:
+            return
+        with open(file=self.journal_file, mode='a', encoding='utf-8',
+                  errors='surrogateescape') as journal_fle:
+            journal_fle.write('\n'.join(sorted(new)) + '\n')
+        written.update(new)
+
+    def run(self):
+        ''' Journal events until SIGTERM. '''
+        def on_term(signum, frame):
+            self.stop = True
+        signal.signal(signal.SIGTERM, on_term)
+        signal.signal(signal.SIGINT, on_term)
+        written = set()
+        while not self.stop and not self.incomplete:
+            try:
+                select.select([self.fd], [], [], FLUSH_INTERVAL)
+            except InterruptedError:
+                pass
+            self.read_events()
+            self.flush(written)
+        # Read what is left in the queue
+        self.read_events()
+        self.flush(written)
+        os.close(self.fd)
+        if not self.incomplete:
+            seal_journal(self.root_dir)
+
+
+def watch(root_dir):
+    ''' Set up the watches, then continue in a background process. '''
+    if not exists(get_journal_file(root_dir)):
+        return 0
+    if read_journal(root_dir) is None:
+        mark_incomplete(root_dir)
+        return 0
+    watcher = Watcher(root_dir)
+    watcher.add_watches('')
+    pid = os.fork()
+    if pid:
+        print(pid, flush=True)
+        return 0
+    # Release the caller's stdout
+    devnull = os.open(os.devnull, os.O_RDWR)
+    os.dup2(devnull, 1)
+    os.close(devnull)
+    watcher.run()
+    return 0
+
+
+def main(args):
+    ''' Command line interface. '''
+    if len(args) < 2 or args[0] not in ('watch', 'reset', 'list'):
+        print(__doc__)
+        return 1
+    if args[0] == 'watch':
+        return watch(args[1])
+    if args[0] == 'reset':
+        if len(args) < 3:
+            print(__doc__)
+            return 1
+        reset_journal(args[1], args[2])
+        return 0
+    dirty = read_journal(args[1])
+    if dirty is None:
+        print(f"No complete journal for {args[1]}")
+        return 2
+    for path in sorted(dirty):
+        print(path)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
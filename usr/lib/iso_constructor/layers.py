@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+""" Module to create incremental (delta) squashfs layers of a root directory
+
+Usage:
+    layers.py manifest ROOT MANIFEST [EXCLUDES]
+        Save the manifest of ROOT after a full squashfs build.
+    layers.py delta ROOT MANIFEST STAGEDIR [EXCLUDES]
+        Stage the changed and added paths of ROOT in STAGEDIR, with overlay
+        whiteouts for deleted paths. The new manifest is saved as MANIFEST.new.
+        When ROOT has a complete journal of changed paths since MANIFEST
+        (see journal.py), only the journaled paths are checked.
+"""
+
+import os
+import sys
+import json
+import stat
+from fnmatch import fnmatch
+from os.path import join, exists, dirname
+from journal import read_journal
+
+
+def get_excludes(excludes_file=None):
+    ''' Return the mksquashfs wildcard exclude patterns. '''
+    excludes = []
+    if excludes_file and exists(excludes_file):
+        with open(file=excludes_file, mode='r', encoding='utf-8') as excl_fle:
+            excludes = [line.strip() for line in excl_fle if line.strip()]
+    return excludes
+
+
+def get_attrs(st):
+    ''' Return the manifest attributes of a stat result. '''
+    return [st.st_mode, st.st_size, st.st_mtime_ns, st.st_uid, st.st_gid, st.st_rdev]
+
+
+def is_excluded(rel_path, excludes):
+    ''' Check if rel_path or one of its parents is excluded. '''
+    while rel_path:
+        if any(fnmatch(rel_path, pattern) for pattern in excludes):
+            return True
+        rel_path = dirname(rel_path)
+    return False
+
+
+def scan_tree(root_dir, excludes=None, start=''):
+    '''
+    Scan root_dir (without following symlinks) below the relative path start.
+    Returns dict: relative path: [mode, size, mtime_ns, uid, gid, rdev]
+    '''
+    excludes = excludes or []
+    manifest = {}
+
+    def scan(path, rel_path):
+        try:
+            entries = list(os.scandir(path))
+        except OSError as detail:
+            print(f"Cannot scan {path}: {detail}")
+            return
+        for entry in entries:
+            rel = join(rel_path, entry.name) if rel_path else entry.name
+            if any(fnmatch(rel, pattern) for pattern in excludes):
+                continue
+            st = entry.stat(follow_symlinks=False)
+            manifest[rel] = get_attrs(st)
+            if stat.S_ISDIR(st.st_mode):
+                scan(entry.path, rel)
+
+    scan(join(root_dir, start) if start else root_dir, start)
+    return manifest
+
+
+def scan_dirty(root_dir, old, dirty, excludes=None):
+    '''
+    Return the new manifest: the old manifest updated with the dirty paths only.
+    New directories are scanned completely.
+    '''
+    excludes = excludes or []
+    new = dict(old)
+
+    def remove_tree(rel_path):
+        new.pop(rel_path, None)
+        if stat.S_ISDIR(old.get(rel_path, [0])[0]):
+            prefix = rel_path + '/'
+            for path in [path for path in new if path.startswith(prefix)]:
+                new.pop(path)
+
+    for rel_path in sorted(dirty):
+        if is_excluded(rel_path, excludes):
+            continue
+        try:
+            st = os.lstat(join(root_dir, rel_path))
+        except FileNotFoundError:
+            remove_tree(rel_path)
+            continue
+        was_dir = stat.S_ISDIR(old.get(rel_path, [0])[0])
+        if not stat.S_ISDIR(st.st_mode):
+            if was_dir:
+                remove_tree(rel_path)
+        elif not was_dir:
+            new.update(scan_tree(root_dir, excludes, rel_path))
+        new[rel_path] = get_attrs(st)
+    # Deleted parents of dirty paths
+    for rel_path in [path for path in new if path not in old]:
+        if dirname(rel_path) and dirname(rel_path) not in new:
+            new.pop(rel_path)
+    return new
+
+
+def load_manifest(manifest_file):
+    ''' Load a saved manifest. '''
+    with open(file=manifest_file, mode='r', encoding='utf-8') as manifest_fle:
+        return json.load(manifest_fle)
+
+
+def save_manifest(manifest_file, manifest):
+    ''' Save the manifest. '''
+    os.makedirs(dirname(manifest_file), exist_ok=True)
+    with open(file=manifest_file, mode='w', encoding='utf-8') as manifest_fle:
+        json.dump(manifest, manifest_fle, separators=(',', ':'))
+
+
+def diff_manifests(old, new):
+    '''
+    Compare two manifests.
+    Returns tuple: (changed and added paths, deleted paths)
+    Only the top most path of a deleted tree is returned.
+    '''
+    changed = sorted(path for path, attrs in new.items() if old.get(path) != attrs)
+    deleted = []
+    for path in sorted(set(old) - set(new)):
+        parent = dirname(path)
+        # The whiteout (or new file) of a deleted parent directory covers its content
+        if parent and (parent not in new or not stat.S_ISDIR(new[parent][0])):
+            continue
+        deleted.append(path)
+    return changed, deleted
+
+
+def _copy_attrs(src, dst, st):
+    ''' Copy ownership, permissions and times from src to dst. '''
+    os.lchown(dst, st.st_uid, st.st_gid)
+    if not stat.S_ISLNK(st.st_mode):
+        os.chmod(dst, stat.S_IMODE(st.st_mode))
+    os.utime(dst, ns=(st.st_atime_ns, st.st_mtime_ns), follow_symlinks=False)
+
+
+def _make_parents(root_dir, stage_dir, rel_path, dirs):
+    '''
+    Create the parent directories of rel_path with the attributes from root_dir.
+    The created directories are added to dirs (their times are restored later).
+    '''
+    parent = dirname(rel_path)
+    if parent and not exists(join(stage_dir, parent)):
+        _make_parents(root_dir, stage_dir, parent, dirs)
+        os.mkdir(join(stage_dir, parent))
+        _copy_attrs(join(root_dir, parent), join(stage_dir, parent),
+                    os.lstat(join(root_dir, parent)))
+        dirs.append(parent)
+
+
+def stage_delta(root_dir, stage_dir, changed, deleted):
+    '''
+    Create the delta tree in stage_dir.
+    Regular files are hard linked (stage_dir must be on the same file system).
+    Returns the number of staged bytes.
+    '''
+    os.makedirs(stage_dir, exist_ok=True)
+    nr_bytes = 0
+    dirs = []
+    for rel_path in changed:
+        src = join(root_dir, rel_path)
+        dst = join(stage_dir, rel_path)
+        st = os.lstat(src)
+        _make_parents(root_dir, stage_dir, rel_path, dirs)
+        if stat.S_ISDIR(st.st_mode):
+            if not exists(dst):
+                os.mkdir(dst)
+            dirs.append(rel_path)
+        elif stat.S_ISREG(st.st_mode):
+            os.link(src, dst)
+            nr_bytes += st.st_size
+            continue
+        elif stat.S_ISLNK(st.st_mode):
+            os.symlink(os.readlink(src), dst)
+        else:
+            os.mknod(dst, st.st_mode, st.st_rdev)
+        _copy_attrs(src, dst, st)
+
+    # Overlay whiteouts: character device 0/0
+    for rel_path in deleted:
+        _make_parents(root_dir, stage_dir, rel_path, dirs)
+        os.mknod(join(stage_dir, rel_path), stat.S_IFCHR | 0o000, os.makedev(0, 0))
+
+    # Adding content changed the directory times: restore them
+    for rel_path in reversed(dirs):
+        st = os.lstat(join(root_dir, rel_path))
+        os.utime(join(stage_dir, rel_path), ns=(st.st_atime_ns, st.st_mtime_ns))
+    return nr_bytes
+
+
+def main(args):
+    ''' Command line interface. '''
+    if len(args) < 3 or args[0] not in ('manifest', 'delta'):
+        print(__doc__)
+        return 1
+
+    if args[0] == 'manifest':
+        root_dir, manifest_file = args[1:3]
+        excludes = get_excludes(args[3] if len(args) > 3 else None)
+        manifest = scan_tree(root_dir, excludes)
+        save_manifest(manifest_file, manifest)
+        print(f"> Manifest saved: {len(manifest)} paths")
+        return 0
+
+    if len(args) < 4:
+        print(__doc__)
+        return 1
+    root_dir, manifest_file, stage_dir = args[1:4]
+    excludes = get_excludes(args[4] if len(args) > 4 else None)
+    if not exists(manifest_file):
+        print(f"Cannot find manifest {manifest_file}")
+        return 2
+    old = load_manifest(manifest_file)
+    dirty = read_journal(root_dir, manifest_file)
+    if dirty is None:
+        new = scan_tree(root_dir, excludes)
+    else:
+        print(f"> Journal: {len(dirty)} changed paths")
+        new = scan_dirty(root_dir, old, dirty, excludes)
+    changed, deleted = diff_manifests(old, new)
+    nr_bytes = stage_delta(root_dir, stage_dir, changed, deleted)
+    save_manifest(manifest_file + '.new', new)
+    print(f"> Delta: {len(changed)} changed, {len(deleted)} deleted, {nr_bytes} bytes")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
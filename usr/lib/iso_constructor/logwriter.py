@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+""" Module providing a buffered log writer running in a background thread """
+
+import os
+import queue
+import threading
+from os.path import exists, getsize
+
+
+class LogWriter():
+    '''
+    Write log lines in a background thread.
+    Lines are queued (bounded queue) and written in batches.
+    The log file is rotated when it grows larger than max_bytes:
+    log_file > log_file.1 > ... > log_file.[backup_count]
+    '''
+    def __init__(self, log_file, max_bytes=5242880, backup_count=3,
+                 queue_size=10000, batch_size=1000):
+        self.log_file = log_file
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.batch_size = batch_size
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._log_fle = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def write(self, text):
+        ''' Queue text to be written to the log file. '''
+        if text is None:
+            return
+        try:
+            self._queue.put(text, timeout=1)
+        except queue.Full:
+            print(f"Log queue full - dropped: {text}")
+
+    def close(self):
+        ''' Write the queued lines and stop the writer thread. '''
+        self._queue.put(None)
+        self._thread.join(timeout=5)
+
+    def _run(self):
+        ''' Write queued lines in batches. '''
+        while True:
+            lines = [self._queue.get()]
+            while len(lines) < self.batch_size:
+                try:
+                    lines.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = None in lines
+            lines = [line for line in lines if line is not None]
+            if lines:
+                self._write(lines)
+            if stop:
+                if self._log_fle:
+                    self._log_fle.close()
+                return
+
+    def _write(self, lines):
+        ''' Append lines to the log file and rotate when needed. '''
+        try:
+            if not self._log_fle:
+                self._log_fle = open(file=self.log_file, mode='a', encoding='utf-8')
+            self._log_fle.write('\n'.join(lines) + '\n')
+            self._log_fle.flush()
+            if self._log_fle.tell() > self.max_bytes:
+                self._rotate()
+        except OSError as detail:
+            print(f"Cannot write to log file {self.log_file}: {detail}")
+
+    def _rotate(self):
+        ''' Rotate the log files. '''
+        self._log_fle.close()
+        self._log_fle = None
+        for i in range(self.backup_count - 1, 0, -1):
+            if exists(f"{self.log_file}.{i}"):
+                os.replace(f"{self.log_file}.{i}", f"{self.log_file}.{i + 1}")
+        if self.backup_count > 0:
+            os.replace(self.log_file, f"{self.log_file}.1")
+        elif exists(self.log_file) and getsize(self.log_file) > 0:
+            os.remove(self.log_file)
@@ -1,6 +1,10 @@
 #!/usr/bin/env python3 -OO
 # -OO: Turn on basic optimizations.  Given twice, causes docstrings to be discarded.
 
+import time
+# Startup benchmark: measured from here (start with --benchmark to quit when done)
+START_TIME = time.monotonic()
+
 import sys
 import traceback
 from dialogs import error_dialog
@@ -16,6 +20,8 @@ from gi.repository import Gtk
 import gettext
 _ = gettext.translation('iso-constructor', fallback=True).gettext
 
+IMPORT_TIME = time.monotonic() - START_TIME
+
 
 def uncaught_excepthook(*args):
     sys.__excepthook__(*args)
@@ -32,7 +38,8 @@ sys.excepthook = uncaught_excepthook
 if __name__ == '__main__':
     # Create an instance of our GTK application
     try:
-        Constructor()
+        Constructor(start_time=START_TIME, import_time=IMPORT_TIME,
+                    benchmark='--benchmark' in sys.argv)
         Gtk.main()
     except KeyboardInterrupt:
         pass
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+""" Module to plan the memory use of a build
+
+Usage:
+    memplan.py [--tmpfs] [--jobs N] WORKDIR
+        Print the mksquashfs -mem size and the tmpfs size (0: build on disk)
+        for the build of WORKDIR, e.g.: 1024M 3221225472
+        The memory that is available is shared by the concurrent builds
+        (N, default: the number of running build.sh processes).
+        With --tmpfs the squashfs, efi.img and md5sum.txt are staged on tmpfs
+        when the estimated squashfs fits in memory besides mksquashfs.
+
+The explanation is printed on stderr (build.sh reads the sizes from stdout).
+"""
+
+import os
+import sys
+from os.path import join, exists, getsize, basename
+from utils import human_size
+from diskindex import scan_usage, load_index
+
+MEMINFO_FILE = '/proc/meminfo'
+BUILD_SCRIPT = 'build.sh'
+# Memory left for the desktop and the other processes of each build
+RESERVE = 1073741824
+# mksquashfs needs at least 64 MiB (-mem), more than 4 GiB does not compress faster
+MIN_SQUASHFS_MEM = 67108864
+MAX_SQUASHFS_MEM = 4294967296
+# Share of the build's memory used by mksquashfs
+SQUASHFS_MEM_SHARE = 0.25
+# Compression ratio (squashfs size / root size) when no squashfs was built before
+DEFAULT_RATIO = 0.4
+# Size of the last filesystem.squashfs that was not kept on disk (see build.sh: release_tmpfs)
+SIZE_FILE = '.squashfs-size'
+# Room for efi.img, md5sum.txt, locale deltas and estimation errors
+STAGE_MARGIN = 1.1
+STAGE_EXTRA = 67108864
+
+
+def get_meminfo():
+    ''' Return dict: name: bytes of /proc/meminfo. '''
+    meminfo = {}
+    with open(file=MEMINFO_FILE, mode='r', encoding='utf-8') as meminfo_fle:
+        for line in meminfo_fle:
+            name, value = line.split(':', 1)
+            value = value.split()
+            meminfo[name] = int(value[0]) * (1024 if len(value) > 1 else 1)
+    return meminfo
+
+
+def count_builds():
+    ''' Return the number of running build.sh processes. '''
+    nr_builds = 0
+    for pid in os.listdir('/proc'):
+        if not pid.isdigit():
+            continue
+        try:
+            with open(file=f"/proc/{pid}/cmdline", mode='rb') as cmdline_fle:
+                argv = cmdline_fle.read().split(b'\0')
+        except OSError:
+            continue
+        # bash build.sh WORKDIR or build.sh WORKDIR (shebang)
+        if any(basename(arg.decode('utf-8', errors='replace')) == BUILD_SCRIPT
+               for arg in argv[:2]):
+            nr_builds += 1
+    return max(nr_builds, 1)
+
+
+def get_saved_size(work_dir):
+    ''' Return the saved size of the last filesystem.squashfs (0: unknown). '''
+    try:
+        with open(file=join(work_dir, SIZE_FILE), mode='r', encoding='utf-8') as size_fle:
+            return int(size_fle.read())
+    except (OSError, ValueError):
+        return 0
+
+
+def estimate_squashfs_size(work_dir):
+    '''
+    Return the estimated size (bytes) of filesystem.squashfs:
+    the root size times the compression ratio of the last full squashfs.
+    '''
+    squashfs = join(work_dir, 'boot/live/filesystem.squashfs')
+    index = load_index(work_dir)
+    root_size = scan_usage(join(work_dir, 'root'), index.get('root'))[0]
+    squashfs_size = getsize(squashfs) if exists(squashfs) else get_saved_size(work_dir)
+    ratio = DEFAULT_RATIO
+    figures = index.get('figures') or {}
+    # The root size of the last index is closer to the root the squashfs was built from
+    if squashfs_size and (figures.get('root') or root_size):
+        ratio = squashfs_size / (figures.get('root') or root_size)
+    return int(root_size * ratio)
+
+
+def plan(work_dir, tmpfs=False, nr_jobs=None):
+    ''' Return the mksquashfs -mem size and the tmpfs size (0: on disk) in bytes. '''
+    meminfo = get_meminfo()
+    nr_jobs = nr_jobs or count_builds()
+    # The memory of this build
+    budget = max(meminfo['MemAvailable'] // nr_jobs - RESERVE, 0)
+    squashfs_mem = min(max(int(budget * SQUASHFS_MEM_SHARE), MIN_SQUASHFS_MEM), MAX_SQUASHFS_MEM)
+    print(f"> {human_size(meminfo['MemAvailable'])} available for {nr_jobs} builds: "
+          f"mksquashfs -mem {human_size(squashfs_mem)}", file=sys.stderr)
+    if not tmpfs:
+        return squashfs_mem, 0
+    stage_size = int(estimate_squashfs_size(work_dir) * STAGE_MARGIN) + STAGE_EXTRA
+    if stage_size + squashfs_mem > budget:
+        print(f"> Not enough memory to stage {human_size(stage_size)} on tmpfs: build on disk",
+              file=sys.stderr)
+        return squashfs_mem, 0
+    print(f"> Stage {human_size(stage_size)} on tmpfs", file=sys.stderr)
+    return squashfs_mem, stage_size
+
+
+def main(args):
+    ''' Command line interface. '''
+    tmpfs = False
+    nr_jobs = None
+    while len(args) > 1 and args[0].startswith('--'):
+        if args[0] == '--tmpfs':
+            tmpfs = True
+            args = args[1:]
+        elif args[0] == '--jobs' and args[1].isdigit():
+            nr_jobs = int(args[1])
+            args = args[2:]
+        else:
+            break
+    if len(args) != 1 or not exists(join(args[0], 'root')):
+        print(__doc__)
+        return 1
+    squashfs_mem, tmpfs_size = plan(args[0], tmpfs, nr_jobs)
+    print(f"{squashfs_mem // 1048576}M {tmpfs_size}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+""" Module to check a work directory before the build starts
+
+Usage:
+    preflight.py WORKDIR [LOCALES]
+        Check the host tools, the boot files of the host and of the root
+        and the free disk space for the squashfs and the ISOs
+        (one ISO per locale of the locale matrix).
+
+build.sh runs this check before the configure, cleanup and mksquashfs stages.
+Exit status: 0 ready to build, 1 usage, 2 check failed.
+"""
+
+import sys
+import shutil
+from glob import glob
+from os.path import join, exists, getsize
+from utils import get_config_dict, human_size
+from diskindex import scan_usage
+from memplan import estimate_squashfs_size
+
+# (command, package)
+REQUIRED_TOOLS = (('mksquashfs', 'squashfs-tools'),
+                  ('xorriso', 'xorriso'),
+                  ('mkfs.vfat', 'dosfstools'),
+                  ('mmd', 'mtools'),
+                  ('mcopy', 'mtools'),
+                  ('md5sum', 'coreutils'),
+                  ('sha256sum', 'coreutils'),
+                  ('file', 'file'),
+                  ('flock', 'util-linux'),
+                  ('mountpoint', 'util-linux'))
+# (path, package)
+HOST_FILES = (('/usr/lib/ISOLINUX/isolinux.bin', 'isolinux'),
+              ('/usr/lib/syslinux/memdisk', 'syslinux-common'))
+SYSLINUX_MODULES_DIR = '/usr/lib/syslinux/modules/bios'
+SYSLINUX_MODULES = ('chain.c32', 'hdt.c32', 'libmenu.c32', 'libgpl.c32', 'reboot.c32',
+                    'vesamenu.c32', 'poweroff.c32', 'ldlinux.c32', 'libcom32.c32', 'libutil.c32')
+# (pattern in the root, package to install in the root)
+ROOT_FILES = (('usr/lib/shim/shim*.efi.signed', 'shim-signed'),
+              ('usr/lib/grub/x86_64-efi-signed/gcdx64.efi.signed', 'grub-efi-amd64-signed'),
+              ('boot/vmlinuz*', 'linux-image'),
+              ('boot/initrd.img*', 'initramfs-tools'),
+              ('bin/ls', 'coreutils'))
+# Free space besides the estimate (artifacts, md5sum.txt, efi.img)
+SPACE_MARGIN = 1.05
+SPACE_EXTRA = 268435456
+
+
+def check_tools(config, work_dir):
+    ''' Return the missing host tools. '''
+    tools = list(REQUIRED_TOOLS)
+    if config.get('MKSQUASHFS') and config['MKSQUASHFS'] != 'mksquashfs':
+        tools[0] = (config['MKSQUASHFS'].split()[0], 'MKSQUASHFS in build.conf')
+    if exists(join(work_dir, 'boot/pool')):
+        tools += [('apt-ftparchive', 'apt-utils'), ('dpkg-deb', 'dpkg')]
+    if config.get('ZSYNC') == 'true':
+        tools.append(('zsyncmake', 'zsync'))
+    if config.get('XDELTA') == 'true':
+        tools += [('xdelta3', 'xdelta3'), ('unsquashfs', 'squashfs-tools')]
+    return [f"{tool} ({package})" for tool, package in tools if not shutil.which(tool)]
+
+
+def check_files(work_dir):
+    ''' Return the missing boot files of the host and of the root. '''
+    missing = [f"{path} ({package})" for path, package in HOST_FILES if not exists(path)]
+    missing += [f"{join(SYSLINUX_MODULES_DIR, module)} (syslinux-common)"
+                for module in SYSLINUX_MODULES if not exists(join(SYSLINUX_MODULES_DIR, module))]
+    root_dir = join(work_dir, 'root')
+    missing += [f"{join(root_dir, pattern)} (install {package} in the root)"
+                for pattern, package in ROOT_FILES if not glob(join(root_dir, pattern))]
+    return missing
+
+
+def get_sizes(paths):
+    ''' Return the total size of the files. '''
+    return sum(getsize(path) for path in paths if exists(path))
+
+
+def check_space(config, work_dir, nr_isos):
+    '''
+    Return the bytes needed and the bytes free for the squashfs and the ISOs.
+    The squashfs is estimated from the root size and the compression ratio
+    of the previous build, an ISO is the squashfs plus the other boot files.
+    The previous squashfs and ISOs are removed by the build.
+    '''
+    live_dir = join(work_dir, 'boot/live')
+    old_squashfs = get_sizes(glob(join(live_dir, '*.squashfs')))
+    boot_size = scan_usage(join(work_dir, 'boot'))[0]
+    squashfs = estimate_squashfs_size(work_dir)
+    iso = squashfs + max(boot_size - old_squashfs, 0)
+    needed = int((squashfs + nr_isos * iso) * SPACE_MARGIN) + SPACE_EXTRA
+    # XDELTA keeps the current ISOs and removes the ones kept before (one per locale)
+    old_isos = glob(join(work_dir, 'previous/*.iso')) + glob(join(work_dir, 'previous/*/*.iso')) \
+        if config.get('XDELTA') == 'true' else glob(join(work_dir, '*.iso'))
+    needed -= old_squashfs + get_sizes(old_isos)
+    return max(needed, 0), shutil.disk_usage(work_dir).free
+
+
+def main(args):
+    ''' Command line interface. '''
+    if len(args) not in (1, 2) or not exists(join(args[0], 'root')):
+        print(__doc__)
+        return 1
+    work_dir = args[0]
+    build_conf = join(work_dir, 'build.conf')
+    config = get_config_dict(build_conf) if exists(build_conf) else {}
+    locales = args[1].replace(',', ' ').split() if len(args) > 1 else []
+    nr_isos = max(len(locales), 1)
+
+    errors = []
+    missing = check_tools(config, work_dir)
+    if missing:
+        errors.append(f"Missing tools: {', '.join(missing)}")
+    missing = check_files(work_dir)
+    if missing:
+        errors.append('Missing boot files:\n    ' + '\n    '.join(missing))
+    needed, free = check_space(config, work_dir, nr_isos)
+    if needed > free:
+        errors.append(f"Not enough free space in {work_dir} for the squashfs and {nr_isos} ISO(s): "
+                      f"{human_size(needed)} needed, {human_size(free)} free")
+    if errors:
+        print('> Pre-flight check failed:')
+        for error in errors:
+            print(error)
+        return 2
+    print(f"> Pre-flight check passed: {human_size(needed)} of {human_size(free)} free space needed")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
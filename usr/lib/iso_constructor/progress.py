@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+""" Module to parse the progress of rsync, mksquashfs and xorriso
+
+Usage:
+    progress.py [--json] WORKDIR COMMAND [ARGUMENTS]
+        Run COMMAND in a pseudo terminal and show its progress.
+        With --json the progress events are printed as JSON lines
+        instead of the command's output (messages go to stderr).
+"""
+
+import os
+import re
+import sys
+import json
+import time
+from datetime import datetime
+from os.path import join, exists
+
+HISTORY_FILE = '.progress-history.json'
+REPORT_FILE = 'build-report.json'
+# Resource usage of the last job (see cgjob.py)
+RESOURCES_FILE = '.job-resources.json'
+# Number of durations kept per stage
+HISTORY_SIZE = 5
+# Minimum number of seconds between two events of the same stage
+EVENT_INTERVAL = 0.25
+
+# rsync --info=progress2:      1,234,567  45%   12.34MB/s    0:01:23 (xfr#...)
+RSYNC_RE = re.compile(r'([\d,]+)\s+(\d{1,3})%\s+([\d.]+)([kMGT]?)B/s')
+# mksquashfs: [=========/       ] 12345/67890  18%
+SQUASHFS_RE = re.compile(r'\]\s+(\d+)/(\d+)\s+(\d{1,3})%')
+# xorriso : UPDATE :  45.67% done, estimate finish ...
+XORRISO_PERCENT_RE = re.compile(r'UPDATE\s*:\s*([\d.]+)% done')
+# xorriso : UPDATE :  1234 of 5678 MB written
+XORRISO_WRITTEN_RE = re.compile(r'UPDATE\s*:\s*(\d+) of (\d+) MB written')
+UNITS = {'': 1, 'k': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+
+
+def parse_progress(line):
+    '''
+    Parse a line of output.
+    Returns dict with stage, percent, bytes and rate (bytes/s) or None.
+    '''
+    match = RSYNC_RE.search(line)
+    if match:
+        return {'stage': 'unpack',
+                'percent': float(match.group(2)),
+                'bytes': int(match.group(1).replace(',', '')),
+                'rate': float(match.group(3)) * UNITS[match.group(4)]}
+    match = SQUASHFS_RE.search(line)
+    if match:
+        return {'stage': 'squashfs',
+                'percent': float(match.group(3)),
+                'bytes': None,
+                'rate': None}
+    match = XORRISO_WRITTEN_RE.search(line)
+    if match:
+        written, total = int(match.group(1)), int(match.group(2))
+        return {'stage': 'iso',
+                'percent': 100 * written / total if total else 0.0,
+                'bytes': written * UNITS['M'],
+                'rate': None}
+    match = XORRISO_PERCENT_RE.search(line)
+    if match:
+        return {'stage': 'iso',
+                'percent': float(match.group(1)),
+                'bytes': None,
+                'rate': None}
+    return None
+
+
+class ProgressTracker():
+    '''
+    Turn command output into progress events.
+    The ETA is predicted from the stored durations of the stage
+    in the work directory, and from the progress rate of the current run.
+    callback(event) is called with dict: stage, percent, bytes, rate, elapsed, eta
+    '''
+    def __init__(self, work_dir, callback=None):
+        self.work_dir = work_dir
+        self.callback = callback
+        self.history_file = join(work_dir, HISTORY_FILE)
+        self.history = self._load_json(self.history_file)
+        self.stages = {}
+        self.started = time.time()
+        self._stage = None
+        self._last_event = None
+        self._pending = ''
+
+    @staticmethod
+    def _load_json(json_file):
+        ''' Load a JSON dictionary. '''
+        try:
+            with open(file=json_file, mode='r', encoding='utf-8') as json_fle:
+                data = json.load(json_fle)
+                return data if isinstance(data, dict) else {}
+        except (OSError, ValueError):
+            return {}
+
+    @staticmethod
+    def _save_json(json_file, data):
+        ''' Save a JSON dictionary. '''
+        try:
+            with open(file=json_file, mode='w', encoding='utf-8') as json_fle:
+                json.dump(data, json_fle, indent=2)
+        except OSError as detail:
+            print(f"Cannot save {json_file}: {detail}")
+
+    def feed_output(self, text):
+        ''' Feed command output: progress lines end with a carriage return. '''
+        self._pending += text
+        parts = re.split(r'[\r\n]', self._pending)
+        self._pending = parts.pop()
+        for part in parts:
+            if part:
+                self.feed(part)
+
+    def feed(self, line):
+        ''' Parse a line and send the progress event when needed. '''
+        event = parse_progress(line)
+        if not event:
+            return None
+        now = time.time()
+        stage = self.stages.get(event['stage'])
+        if not stage:
+            stage = {'start': now, 'segment_start': now, 'end': now,
+                     'percent': 0.0, 'bytes': 0}
+            self.stages[event['stage']] = stage
+        elif event['percent'] < stage['percent'] - 50:
+            # The stage runs the command again (e.g. a second rsync)
+            stage['segment_start'] = now
+        stage['end'] = now
+        stage['percent'] = event['percent']
+        if event['bytes']:
+            stage['bytes'] = max(stage['bytes'], event['bytes'])
+
+        event['elapsed'] = now - stage['start']
+        event['eta'] = self._get_eta(event['stage'], stage, now)
+
+        # Limit the number of events
+        if self._stage == event['stage'] and event['percent'] < 100 and \
+           self._last_event and now - self._last_event < EVENT_INTERVAL:
+            return None
+        self._stage = event['stage']
+        self._last_event = now
+        if self.callback:
+            self.callback(event)
+        return event
+
+    def _get_eta(self, stage_name, stage, now):
+        '''
+        Estimated seconds until the stage is done.
+        The historical estimate weighs most at the start,
+        the rate of the current run at the end.
+        '''
+        percent = stage['percent']
+        segment_elapsed = now - stage['segment_start']
+        eta_rate = None
+        if percent > 0:
+            eta_rate = segment_elapsed * (100 - percent) / percent
+        durations = self.history.get(stage_name)
+        if not durations:
+            return eta_rate
+        eta_history = max(sum(durations) / len(durations) - (now - stage['start']), 0)
+        if eta_rate is None:
+            return eta_history
+        weight = percent / 100
+        return weight * eta_rate + (1 - weight) * eta_history
+
+    def finish(self, command=None, exit_status=None, report=False):
+        '''
+        Save the stage durations in the work directory's history
+        and optionally write the build report.
+        '''
+        if exit_status == 0:
+            for name, stage in self.stages.items():
+                durations = self.history.get(name, []) + [round(stage['end'] - stage['start'], 1)]
+                self.history[name] = durations[-HISTORY_SIZE:]
+            if self.stages:
+                self._save_json(self.history_file, self.history)
+        if report:
+            self.write_report(command, exit_status)
+
+    def write_report(self, command=None, exit_status=None):
+        '''
+        Write the build report to the work directory
+        with the resource usage of the job when it ran in its own cgroup.
+        '''
+        finished = time.time()
+        resources_file = join(self.work_dir, RESOURCES_FILE)
+        resources = None
+        if exists(resources_file) and os.path.getmtime(resources_file) >= self.started:
+            resources = self._load_json(resources_file)
+        report = {
+            'command': command,
+            'started': datetime.fromtimestamp(self.started).isoformat(timespec='seconds'),
+            'finished': datetime.fromtimestamp(finished).isoformat(timespec='seconds'),
+            'duration': round(finished - self.started, 1),
+            'exit_status': exit_status,
+            'stages': {name: {'duration': round(stage['end'] - stage['start'], 1),
+                              'bytes': stage['bytes'] or None}
+                       for name, stage in self.stages.items()},
+            'resources': resources
+        }
+        self._save_json(join(self.work_dir, REPORT_FILE), report)
+
+
+def format_eta(seconds):
+    ''' Return seconds as [h:]mm:ss. '''
+    if seconds is None:
+        return '--:--'
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return f"{hours}:{minutes:02d}:{seconds:02d}"
+    return f"{minutes:02d}:{seconds:02d}"
+
+
+def main(args):
+    ''' Run a command in a pseudo terminal and track its progress. '''
+    import pty
+
+    print_json = False
+    if args and args[0] == '--json':
+        print_json = True
+        args = args[1:]
+    if len(args) < 2 or not exists(args[0]):
+        print(__doc__)
+        return 1
+    # Only the JSON lines on stdout: everything else goes to stderr
+    json_out = sys.stdout
+    if print_json:
+        sys.stdout = sys.stderr
+
+    def print_event(event):
+        if print_json:
+            print(json.dumps(event), file=json_out, flush=True)
+
+    tracker = ProgressTracker(args[0], callback=print_event)
+    pid, master_fd = pty.fork()
+    if pid == 0:
+        os.execvp(args[1], args[1:])
+
+    while True:
+        try:
+            data = os.read(master_fd, 65536)
+        except OSError:
+            # EIO: the command closed the terminal
+            break
+        if not data:
+            break
+        tracker.feed_output(data.decode('utf-8', errors='replace'))
+        if not print_json:
+            os.write(sys.stdout.fileno(), data)
+    os.close(master_fd)
+    exit_status = os.waitstatus_to_exitcode(os.waitpid(pid, 0)[1])
+    tracker.finish(' '.join(args[1:]), exit_status,
+                   report=os.path.basename(args[1]) == 'build.sh')
+    return exit_status
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+""" Module to boot a live ISO headless in QEMU with a serial console """
+
+import os
+import re
+import time
+import queue
+import socket
+import shutil
+import tempfile
+import threading
+import subprocess
+from glob import glob
+from os.path import join, exists
+
+QEMU = 'qemu-system-x86_64'
+# (command, package)
+QEMU_TOOL = (QEMU, 'qemu-system-x86')
+XORRISO_TOOL = ('xorriso', 'xorriso')
+# Kernel arguments for a live system on the serial console
+LIVE_APPEND = 'boot=live components console=ttyS0,115200'
+# Characters of searched output that are searched again with new output
+MATCH_OVERLAP = 1024
+
+
+def get_missing_tools(iso_file=False):
+    '''
+    Return the missing commands (and their package) to boot headless.
+    iso_file=True: the kernel and initrd are extracted from the ISO with xorriso.
+    '''
+    tools = [QEMU_TOOL, XORRISO_TOOL] if iso_file else [QEMU_TOOL]
+    return [f"{tool} ({package})" for tool, package in tools if not shutil.which(tool)]
+
+
+def get_accel():
+    ''' Use KVM when /dev/kvm is accessible, otherwise emulate (TCG). '''
+    if os.access('/dev/kvm', os.R_OK | os.W_OK):
+        return 'kvm'
+    return 'tcg'
+
+
+def get_boot_files(live_dir):
+    ''' Return (vmlinuz, initrd) of the live directory, or (None, None). '''
+    vmlinuz_files = sorted(glob(join(live_dir, 'vmlinuz*')))
+    if not vmlinuz_files:
+        return None, None
+    vmlinuz = vmlinuz_files[0]
+    name = os.path.basename(vmlinuz)
+    ver = name.split('-', 1)[1] if '-' in name else ''
+    initrd = join(live_dir, f"initrd.img-{ver}" if ver else 'initrd.img')
+    if not exists(initrd):
+        return None, None
+    return vmlinuz, initrd
+
+
+def extract_boot_files(iso, dest_dir):
+    ''' Extract the kernel and initrd from the live directory of the ISO with xorriso. '''
+    try:
+        found = subprocess.run(['xorriso', '-indev', iso, '-find', '/live', '-maxdepth', '1',
+                                '-name', 'vmlinuz*'], capture_output=True, text=True,
+                               check=True).stdout
+    except (OSError, subprocess.CalledProcessError) as detail:
+        print(f"Cannot read {iso}: {detail}")
+        return None, None
+    # xorriso quotes the paths
+    vmlinuz_paths = sorted(re.findall(r"^'(/live/vmlinuz[^']*)'$", found, re.MULTILINE))
+    if not vmlinuz_paths:
+        return None, None
+    name = os.path.basename(vmlinuz_paths[0])
+    ver = name.split('-', 1)[1] if '-' in name else ''
+    initrd_path = f"/live/initrd.img-{ver}" if ver else '/live/initrd.img'
+    command = ['xorriso', '-osirrox', 'on', '-indev', iso]
+    for path in (vmlinuz_paths[0], initrd_path):
+        command += ['-extract', path, join(dest_dir, os.path.basename(path))]
+    try:
+        subprocess.run(command, capture_output=True, check=True)
+    except (OSError, subprocess.CalledProcessError) as detail:
+        print(f"Cannot extract the kernel and initrd from {iso}: {detail}")
+        return None, None
+    return get_boot_files(dest_dir)
+
+
+class QemuBoot():
+    '''
+    Boot an ISO in QEMU without display.
+    The kernel and initrd are booted directly (the ISO is attached as cdrom)
+    so the kernel arguments can put the console on the serial port.
+    The serial output is read in a background thread and can be
+    searched with expect().
+    '''
+    def __init__(self, iso, vmlinuz, initrd, append=LIVE_APPEND,
+                 memory=2048, cpus=2, accel=None, serial_log=None):
+        self.iso = iso
+        self.vmlinuz = vmlinuz
+        self.initrd = initrd
+        self.append = append
+        self.memory = memory
+        self.cpus = cpus
+        self.accel = accel or get_accel()
+        self.serial_log = serial_log
+        self.started = None
+        self._process = None
+        self._queue = queue.Queue()
+        self._buffer = ''
+        self._tmp_dir = tempfile.mkdtemp(prefix='iso-constructor-qemu-')
+        self._monitor = join(self._tmp_dir, 'monitor')
+
+    def get_command(self):
+        ''' Return the QEMU command as a list. '''
+        cpu = 'host' if self.accel == 'kvm' else 'max'
+        return [QEMU,
+                '-machine', f"q35,accel={self.accel}",
+                '-cpu', cpu,
+                '-m', str(self.memory),
+                '-smp', str(self.cpus),
+                '-display', 'none',
+                '-no-reboot',
+                '-serial', 'stdio',
+                '-monitor', f"unix:{self._monitor},server=on,wait=off",
+                '-drive', f"file={self.iso},media=cdrom,readonly=on",
+                '-nic', 'user,model=virtio-net-pci',
+                '-kernel', self.vmlinuz,
+                '-initrd', self.initrd,
+                '-append', self.append]
+
+    def start(self):
+        ''' Start QEMU and the serial reader. '''
+        self.started = time.monotonic()
+        self._process = subprocess.Popen(self.get_command(), stdin=subprocess.DEVNULL,
+                                         stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        threading.Thread(target=self._read_serial, daemon=True).start()
+
+    def _read_serial(self):
+        ''' Queue the serial output (and copy it to the serial log). '''
+        log_fle = None
+        if self.serial_log:
+            log_fle = open(file=self.serial_log, mode='wb')
+        while True:
+            data = self._process.stdout.read1(65536)
+            if not data:
+                break
+            if log_fle:
+                log_fle.write(data)
+                log_fle.flush()
+            self._queue.put(data.decode('utf-8', errors='replace'))
+        if log_fle:
+            log_fle.close()
+        self._queue.put(None)
+
+    def expect(self, pattern, timeout):
+        '''
+        Wait until the serial output matches pattern.
+        Returns (seconds since start, match) or (None, None) on timeout or exit.
+        The output up to the match is consumed.
+        '''
+        if isinstance(pattern, str):
+            pattern = re.compile(pattern)
+        deadline = time.monotonic() + timeout
+        pos = 0
+        while True:
+            match = pattern.search(self._buffer, pos)
+            if match:
+                self._buffer = self._buffer[match.end():]
+                return time.monotonic() - self.started, match
+            # Search the new output only (a match may span the last chunk)
+            pos = max(len(self._buffer) - MATCH_OVERLAP, 0)
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None, None
+            try:
+                text = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                return None, None
+            if text is None:
+                # QEMU exited
+                self._queue.put(None)
+                return None, None
+            self._buffer += text
+
+    def read_until(self, pattern, timeout):
+        ''' Return the serial output up to pattern (None on timeout). '''
+        match = self.expect(pattern, timeout)[1]
+        if not match:
+            return None
+        # The match was made on the unconsumed output
+        return match.string[:match.start()]
+
+    def monitor(self, command):
+        ''' Send a command to the QEMU monitor. '''
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(5)
+            sock.connect(self._monitor)
+            sock.recv(4096)
+            sock.sendall(command.encode('utf-8') + b'\n')
+            time.sleep(0.5)
+
+    def stop(self):
+        ''' Stop QEMU and remove the temporary files. '''
+        if self._process and self._process.poll() is None:
+            try:
+                self.monitor('quit')
+            except OSError:
+                pass
+            try:
+                self._process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self._process.kill()
+                self._process.wait()
+        if exists(self._monitor):
+            os.remove(self._monitor)
+        os.rmdir(self._tmp_dir)
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+""" Module to verify that a work directory builds reproducibly
+
+Usage:
+    reproducible.py WORKDIR
+        Build the ISO twice in reproducible mode
+        and compare the digests of the ISOs and of the files in WORKDIR/boot.
+    reproducible.py epoch WORKDIR
+        Print the default SOURCE_DATE_EPOCH: the modification time of the
+        newest package list of the root (used by build.sh).
+
+Run as root. The digests of both builds are saved in WORKDIR/reproducible.json.
+Exit status: 0 identical, 1 usage, 2 build failed, 3 the builds differ.
+"""
+
+import os
+import sys
+import json
+import hashlib
+import subprocess
+from glob import glob
+from os.path import join, exists, relpath, basename
+from utils import get_config_dict
+
+BUILD_SCRIPT = '/usr/share/iso_constructor/build.sh'
+RESULT_FILE = 'reproducible.json'
+# Block size to read files with
+BLOCK_SIZE = 1048576
+
+
+def get_digest(path):
+    ''' Return the sha256 digest of a file. '''
+    sha256 = hashlib.sha256()
+    with open(file=path, mode='rb') as fle:
+        for block in iter(lambda: fle.read(BLOCK_SIZE), b''):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+def get_digests(work_dir):
+    ''' Return dict: path: sha256 of the ISOs and the files in the boot directory. '''
+    digests = {}
+    for iso in sorted(glob(join(work_dir, '*.iso'))):
+        digests[basename(iso)] = get_digest(iso)
+    boot_dir = join(work_dir, 'boot')
+    for dir_path, _dir_names, file_names in os.walk(boot_dir):
+        for name in file_names:
+            path = join(dir_path, name)
+            if not os.path.islink(path):
+                digests[join('boot', relpath(path, boot_dir))] = get_digest(path)
+    return digests
+
+
+def get_source_date_epoch(work_dir):
+    '''
+    Return SOURCE_DATE_EPOCH: the modification time of the newest package list.
+    Unlike the dpkg status file the lists only change when packages are (un)installed.
+    '''
+    if os.environ.get('SOURCE_DATE_EPOCH'):
+        return os.environ['SOURCE_DATE_EPOCH']
+    lists = glob(join(work_dir, 'root/var/lib/dpkg/info/*.list'))
+    if not lists:
+        return str(int(os.stat(join(work_dir, 'root/var/lib/dpkg/status')).st_mtime))
+    return str(int(max(os.stat(path).st_mtime for path in lists)))
+
+
+def verify(work_dir):
+    ''' Build twice and compare the digests. '''
+    build_conf = join(work_dir, 'build.conf')
+    config = get_config_dict(build_conf) if exists(build_conf) else {}
+    if config.get('INCREMENTAL') == 'true':
+        print('Cannot verify an incremental build: the second build adds a layer')
+        return 1
+    if config.get('REPRODUCIBLE') == 'false':
+        print(f"Remove REPRODUCIBLE=false from {build_conf}")
+        return 1
+
+    # Both builds derive the epoch themselves (after the cleanup stage): it must be the same
+    env = dict(os.environ, REPRODUCIBLE='true', RESUME='false')
+    builds = []
+    for nr in (1, 2):
+        print(f"> Reproducible build {nr} of 2", flush=True)
+        if subprocess.run(['bash', BUILD_SCRIPT, work_dir], env=env, check=False).returncode:
+            print(f"Build {nr} failed")
+            return 2
+        builds.append(get_digests(work_dir))
+
+    epoch = config.get('SOURCE_DATE_EPOCH') or get_source_date_epoch(work_dir)
+    try:
+        with open(file=join(work_dir, RESULT_FILE), mode='w', encoding='utf-8') as result_fle:
+            json.dump({'source_date_epoch': epoch, 'builds': builds}, result_fle, indent=2)
+    except OSError as detail:
+        print(f"Cannot save {join(work_dir, RESULT_FILE)}: {detail}")
+
+    first, second = builds
+    differ = sorted(path for path in first.keys() | second.keys()
+                    if first.get(path) != second.get(path))
+    if not differ:
+        print(f"> Reproducible: both builds are identical ({len(first)} files)")
+        return 0
+    print(f"> Not reproducible: {len(differ)} files differ")
+    for path in differ:
+        print(f"    {path}")
+    return 3
+
+
+def main(args):
+    ''' Command line interface. '''
+    if len(args) == 2 and args[0] == 'epoch' and exists(join(args[1], 'root')):
+        print(get_source_date_epoch(args[1]))
+        return 0
+    if len(args) != 1 or not exists(join(args[0], 'root')):
+        print(__doc__)
+        return 1
+    return verify(args[0])
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -1,13 +1,23 @@
 #!/usr/bin/env python3
 """ Module to provide a Vte.Terminal object """
 
-import time
+import os
+import re
+import codecs
+import shutil
+import tempfile
+import threading
+from os.path import join
 import gi
 gi.require_version('Gtk', '3.0')
 gi.require_version('Vte', '2.91')
 gi.require_version('Gdk', '3.0')
 from gi.repository import Gtk, GLib, Vte, Gdk, Gio
 
+# Escape sequences (CSI, OSC, charset selection, keypad mode)
+# and control characters except tab, new line, carriage return and backspace
+ESCAPES_RE = re.compile(r'\x1b\[[0-?]*[ -/]*[@-~]|\x1b\][^\x07\x1b]*(?:\x07|\x1b\\)|'
+                        r'\x1b[()][0-9A-Za-z]|\x1b[=>78]|[\x00-\x07\x0b\x0c\x0e-\x1f\x7f]')
 
 # Reference: https://lazka.github.io/pgi-docs/#Vte-2.91/classes/Terminal.html
 class Terminal(Vte.Terminal):
@@ -19,11 +29,11 @@ class Terminal(Vte.Terminal):
         # Signals
         self.connect_after('child-exited', self.on_child_exited)
         self.connect("key_press_event", self.on_key_press)
-        self.connect('contents-changed', self.on_contents_changed)
 
         # Properties
         self.pause_logging = False
-        self.log_file = None
+        self.log_writer = None
+        self.output_handler = None
         self.enable_copy_paste = True
         self.version = (Vte.get_major_version(),
                         Vte.get_minor_version(),
@@ -31,8 +41,35 @@ class Terminal(Vte.Terminal):
         self.set_scroll_on_output(True)
         self.set_input_enabled(True)
         self._cancellable = Gio.Cancellable()
-        self._last_pos = (0, 0) #Last saved terminal column/row
         self._cmd_is_running = False
+        self._wait_loop = None
+        self._exit_status = None
+
+        # The shell reports the exit status of each command through a fifo
+        self._tmp_dir = tempfile.mkdtemp(prefix='iso-constructor-')
+        self._fifo = join(self._tmp_dir, 'status')
+        os.mkfifo(self._fifo, 0o600)
+        # Keep a writer open: the reader does not get EOF when the shell closes the fifo
+        self._fifo_fd = os.open(self._fifo, os.O_RDONLY | os.O_NONBLOCK)
+        self._fifo_wfd = os.open(self._fifo, os.O_WRONLY)
+        GLib.io_add_watch(self._fifo_fd, GLib.PRIORITY_DEFAULT, GLib.IO_IN, self._on_status)
+        self._rc_file = join(self._tmp_dir, 'bashrc')
+        with open(file=self._rc_file, mode='w', encoding='utf-8') as rc_fle:
+            rc_fle.write('[ -f /etc/bash.bashrc ] && . /etc/bash.bashrc\n'
+                         '[ -f ~/.bashrc ] && . ~/.bashrc\n'
+                         f'__ic_status() {{ echo $? > "{self._fifo}"; }}\n'
+                         'PROMPT_COMMAND="__ic_status${PROMPT_COMMAND:+;$PROMPT_COMMAND}"\n')
+
+        # The shell runs in script, which copies its output to a fifo:
+        # log the output from there instead of reading back the terminal
+        self._output_fifo = join(self._tmp_dir, 'output')
+        os.mkfifo(self._output_fifo, 0o600)
+        self._output_fd = os.open(self._output_fifo, os.O_RDONLY | os.O_NONBLOCK)
+        self._output_wfd = os.open(self._output_fifo, os.O_WRONLY)
+        os.set_blocking(self._output_fd, True)
+        self._output_thread = threading.Thread(target=self._log_output, daemon=True)
+        self._output_thread.start()
+        self.connect('destroy', self._on_destroy)
 
         # Colors
         use_default_colors = False
@@ -83,7 +120,9 @@ class Terminal(Vte.Terminal):
         self.spawn_async(
             Vte.PtyFlags.DEFAULT,  # pty flags
             '/',  # working directory
-            ["/bin/bash"],  # argmument vector
+            ["/usr/bin/script", "--quiet", "--flush",
+             "--log-out", self._output_fifo,
+             "--command", f"/bin/bash --rcfile {self._rc_file}"],  # argmument vector
             [],  # list with environment variables
             GLib.SpawnFlags.DEFAULT,  # spawn flags
             None,  # child_setup function
@@ -106,28 +145,24 @@ class Terminal(Vte.Terminal):
                                                 Defaults to True.
             pause_logging (bool, optional): pause logging while command is running.
                                             Defaults to False.
+
+        Returns:
+            int: exit status of the command when wait_until_done, otherwise None
         """
         if self._cmd_is_running:
-            return
-
-        def sleep(seconds=0.1):
-            time.sleep(seconds)
-            # Update the parent window
-            while Gtk.events_pending():
-                Gtk.main_iteration()
+            return None
 
         self._cancellable.reset()
         self.grab_focus()
         self.pause_logging = pause_logging
+        # Discard status reports of earlier commands
+        self._read_status()
+        self._exit_status = None
         command = command + '\n' if command else '\n'
         self.feed_child(command.encode('utf-8'))
 
-        # We need to wait until the command is completely fed
-        sleep()
-
-        # Unfortunately, there is no built-in way to notify the parent
-        # that a command has finished or to wait for the command
-        # until it is finished.
+        # The shell reports the exit status when the prompt returns:
+        # run a nested main loop until then
         if wait_until_done:
             self._cmd_is_running = True
             # This won't work if the user scrolls up.
@@ -140,13 +175,9 @@ class Terminal(Vte.Terminal):
                 except Exception:
                     pass
 
-            # First, wait until the last character is not a prompt sign
-            while self.get_text()[0].strip()[-1:] in '$#':
-                sleep()
-            # Finally, the command is executing - wait until the last
-            # character is a prompt sign
-            while self.get_text()[0].strip()[-1:] not in '$#':
-                sleep()
+            self._wait_loop = GLib.MainLoop()
+            self._wait_loop.run()
+            self._wait_loop = None
 
             # Make the terminal scrollable again if it was at the start
             if parent_is_sensitive:
@@ -156,6 +187,72 @@ class Terminal(Vte.Terminal):
 
         # Reset pause on logging
         self.pause_logging = False
+        return self._exit_status
+
+    def _read_status(self):
+        ''' Read the reported exit statuses from the fifo (returns the last one). '''
+        status = None
+        try:
+            data = os.read(self._fifo_fd, 4096).decode('utf-8', errors='ignore')
+        except BlockingIOError:
+            return status
+        for line in data.split():
+            if line.isdigit():
+                status = int(line)
+        return status
+
+    def _on_status(self, fd, condition):
+        ''' The shell reported the exit status of a command. '''
+        status = self._read_status()
+        if status is not None and self._wait_loop and self._wait_loop.is_running():
+            self._exit_status = status
+            self._wait_loop.quit()
+        return True
+
+    def _log_output(self):
+        ''' Pass the output of the shell to the output handler and line by line to the log writer. '''
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        buffer = ''
+        while True:
+            try:
+                data = os.read(self._output_fd, 65536)
+            except OSError:
+                return
+            if not data:
+                return
+            text = decoder.decode(data)
+            if self.output_handler:
+                self.output_handler(text)
+            buffer += text
+            lines = buffer.split('\n')
+            buffer = lines.pop()
+            # Progress output overwrites the line: only keep the last update
+            cr_pos = buffer.rfind('\r', 0, len(buffer) - 1)
+            if cr_pos >= 0:
+                buffer = buffer[cr_pos + 1:]
+            if self.log_writer and not self.pause_logging:
+                for line in lines:
+                    line = self._clean_line(line)
+                    if line:
+                        self.log_writer.write(line)
+
+    @staticmethod
+    def _clean_line(line):
+        ''' Return the line as it was shown in the terminal. '''
+        line = ESCAPES_RE.sub('', line)
+        # Text after the last carriage return overwrote the line
+        line = line.rstrip('\r').split('\r')[-1]
+        while '\b' in line:
+            pos = line.index('\b')
+            line = line[:max(pos - 1, 0)] + line[pos + 1:]
+        return line.rstrip()
+
+    def _on_destroy(self, widget):
+        ''' Cleanup the fifos. '''
+        os.close(self._fifo_fd)
+        os.close(self._fifo_wfd)
+        os.close(self._output_wfd)
+        shutil.rmtree(self._tmp_dir, ignore_errors=True)
 
     def cancel(self):
         ''' Set terminal cancellable. '''
@@ -166,20 +263,6 @@ class Terminal(Vte.Terminal):
         text_array = self.get_text()[0].strip().split('\n')
         return text_array[len(text_array) - 1]
 
-    def on_contents_changed(self, terminal):
-        ''' Log the content of the terminal. '''
-        if self.log_file and not self.pause_logging:
-            last_col, last_row = self._last_pos
-            col, row = self.get_cursor_position()
-            # Only log when row has changed (new line)
-            if last_row != row:
-                # From v 0.76:
-                # get_range_format(Vte.Format.TEXT, last_row, last_col, row, col)
-                text = self.get_text_range(last_row, last_col, row, col)[0].strip()
-                self._last_pos = (col, row)
-                with open(file=self.log_file, mode='a', encoding='utf-8') as log_file:
-                    log_file.write(text + '\n')
-
     def on_key_press(self, widget, event):
         ''' Handle Ctrl-Shift-C and Ctrl-Shift-V. '''
         if self.enable_copy_paste:
@@ -200,4 +283,7 @@ class Terminal(Vte.Terminal):
         Create a new child if the user ended the current one
         with Ctrl-D or typing exit.
         '''
+        if self._wait_loop and self._wait_loop.is_running():
+            self._exit_status = status
+            self._wait_loop.quit()
         self._create_child()
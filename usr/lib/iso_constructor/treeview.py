@@ -27,6 +27,10 @@ class TreeViewHandler(GObject.GObject):
         GObject.GObject.__init__(self)
         self.log = logger_object
         self.treeview = tree_view
+        # Keyed rows (see setup_model)
+        self.key_col_nr = 0
+        self.font_size = 10000
+        self.row_refs = {}
 
     def clear_tree_view(self):
         ''' Clear treeview. '''
@@ -266,6 +270,85 @@ class TreeViewHandler(GObject.GObject):
                 if self.log:
                     self.log.write(msg, 'self.treeview.fill_treeview', 'debug')
 
+    def setup_model(self, column_names, column_types_list, key_col_nr=0,
+                    columns_resizable=False, headers_visible=True, font_size=10000):
+        '''
+        Create the list store and the columns once.
+        Rows are then inserted, updated and removed by the value
+        in column key_col_nr (see set_rows, set_row, update_row and remove_row).
+        '''
+        types = {'bool': bool, 'str': str, 'int': int,
+                 'GdkPixbuf.Pixbuf': GdkPixbuf.Pixbuf}
+        self.key_col_nr = key_col_nr
+        self.font_size = font_size
+        self.row_refs = {}
+        for col in self.treeview.get_columns():
+            self.treeview.remove_column(col)
+        # Extra columns: weight and size of the text
+        liststore = Gtk.ListStore(*[types[col_type] for col_type in column_types_list], int, int)
+        nr_cols = len(column_names)
+        for i, col_name in enumerate(column_names):
+            if column_types_list[i] == 'bool':
+                renderer = Gtk.CellRendererToggle()
+                renderer.connect('toggled', self.tvchk_on_toggle, liststore, i)
+                col = Gtk.TreeViewColumn(col_name, renderer, active=i)
+            elif column_types_list[i] == 'GdkPixbuf.Pixbuf':
+                col = Gtk.TreeViewColumn(col_name, Gtk.CellRendererPixbuf(), pixbuf=i)
+            else:
+                col = Gtk.TreeViewColumn(col_name, Gtk.CellRendererText(), text=i,
+                                         weight=nr_cols, size=nr_cols + 1)
+            if columns_resizable:
+                col.set_resizable(True)
+            self.treeview.append_column(col)
+        self.treeview.set_model(liststore)
+        self.treeview.set_headers_visible(headers_visible)
+
+    def _get_row_iter(self, key):
+        ''' Return the iter of the row with key or None. '''
+        row_ref = self.row_refs.get(key)
+        if row_ref and row_ref.valid():
+            return self.treeview.get_model().get_iter(row_ref.get_path())
+        return None
+
+    def set_row(self, row, position=-1):
+        ''' Update the row with the same key or insert it at position (-1: append). '''
+        model = self.treeview.get_model()
+        key = row[self.key_col_nr]
+        values = list(row) + [400, self.font_size]
+        itr = self._get_row_iter(key)
+        if itr:
+            model.set(itr, list(range(len(values))), values)
+        else:
+            itr = model.insert(position, values)
+            self.row_refs[key] = Gtk.TreeRowReference.new(model, model.get_path(itr))
+
+    def update_row(self, key, values):
+        '''
+        Update columns of the row with key in place.
+        values: dict with column number: value
+        '''
+        itr = self._get_row_iter(key)
+        if itr:
+            self.treeview.get_model().set(itr, list(values.keys()), list(values.values()))
+            return True
+        return False
+
+    def remove_row(self, key):
+        ''' Remove the row with key. '''
+        itr = self._get_row_iter(key)
+        if itr:
+            self.treeview.get_model().remove(itr)
+        self.row_refs.pop(key, None)
+
+    def set_rows(self, rows):
+        ''' Update, insert and remove rows so that the model holds rows. '''
+        keys = [row[self.key_col_nr] for row in rows]
+        for key in list(self.row_refs):
+            if key not in keys:
+                self.remove_row(key)
+        for position, row in enumerate(rows):
+            self.set_row(row, position)
+
     def tvchk_on_toggle(self, cell, path, liststore, col_nr, *ignore):
         '''
         Raise trigger checkbox-toggled when checkbox is clicked.
@@ -6,8 +6,12 @@ import subprocess
 import re
 import numbers
 import pwd
-from os.path import expanduser, exists
-import apt
+from glob import glob
+from os.path import expanduser, exists, join
+
+DPKG_STATUS_FILE = '/var/lib/dpkg/status'
+# Shared apt cache: built on first use (see get_apt_cache)
+_APT_CACHE = None
 
 
 def shell_exec_popen(command, kwargs=None):
@@ -66,29 +70,61 @@ def get_config_dict(file, key_value=re.compile(r'^\s*(\w+)\s*=\s*["\']?(.*?)["\'
     return config_dict
 
 
+def get_apt_cache():
+    """ Return the shared apt cache (built on first use) """
+    global _APT_CACHE
+    if _APT_CACHE is None:
+        import apt
+        _APT_CACHE = apt.Cache()
+    return _APT_CACHE
+
+
+def get_installed_versions(package_names, status_file=DPKG_STATUS_FILE):
+    """ Return dict with the installed versions of the packages from the dpkg status file """
+    package_names = set(package_names)
+    versions = {}
+    package = status = version = None
+    try:
+        with open(file=status_file, mode='r', encoding='utf-8', errors='replace') as status_fle:
+            for line in status_fle:
+                if line.startswith('Package: '):
+                    package = line[9:].strip()
+                elif package in package_names:
+                    if line.startswith('Status: '):
+                        status = line[8:].split()
+                    elif line.startswith('Version: '):
+                        version = line[9:].strip()
+                    elif not line.strip():
+                        if status and status[-1] == 'installed' and version:
+                            versions[package] = version
+                        package = status = version = None
+        if package in package_names and status and status[-1] == 'installed' and version:
+            versions[package] = version
+    except OSError as detail:
+        print(f"Cannot read {status_file}: {detail}")
+    return versions
+
+
 def is_package_installed(package_name):
     """ Check if package is installed """
-    cache = apt.Cache()
-    if cache[package_name].is_installed:
-        return True
-    return False
+    return package_name in get_installed_versions([package_name])
 
 
 def does_package_exist(package_name):
     """ Check if a package exists """
     try:
-        return bool(apt.Cache()[package_name])
+        return bool(get_apt_cache()[package_name])
     except KeyError:
         return False
 
 
 def get_package_version(package_name, candidate=False):
     """ Get package version (default=installed) """
-    if not does_package_exist(package_name=package_name):
-        return ''
     if candidate:
-        return apt.Cache()[package_name].candidate.version
-    return apt.Cache()[package_name].installed.version
+        if not does_package_exist(package_name=package_name):
+            return ''
+        return get_apt_cache()[package_name].candidate.version
+    return get_installed_versions([package_name]).get(package_name, '')
 
 
 def str_to_nr(value):
@@ -108,6 +144,16 @@ def str_to_nr(value):
     return number
 
 
+def human_size(nr_bytes):
+    """ Return a human readable size string (e.g. 1.5 GB) """
+    size = float(str_to_nr(nr_bytes) or 0)
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if size < 1024:
+            return f"{size:.1f} {unit}" if unit != 'B' else f"{int(size)} {unit}"
+        size /= 1024
+    return f"{size:.1f} TB"
+
+
 def is_numeric(value):
     """ Check if value is a number """
     return bool(str_to_nr(value))
@@ -144,25 +190,38 @@ def get_guest_efi_arch(root_path):
     return ret
 
 
+def get_release_files(root_dir=None):
+    ''' Return the sorted release files ([root_dir]/etc/*release). '''
+    if not root_dir or not exists(root_dir):
+        root_dir = '/'
+    return sorted(glob(join(root_dir, 'etc/*release')))
+
+
 def get_lsb_release_info(root_dir=None):
     '''
-    Get lsb-release information
-    lsb_parameter: DISTRIB_ID (default), DISTRIB_RELEASE, DISTRIB_CODENAME, DISTRIB_DESCRIPTION
+    Get lsb-release information from the lsb-release and os-release files
+    Returns dict: name, id, codename, version
+    The first line (in sorted file order) starting with one of the keys is used.
     '''
-    lsb_dict = {}
-    lsb_release_path = '/etc/*release'
-    if exists(root_dir):
-        lsb_release_path = f'{root_dir}/etc/*release'
-    try:
-        lsb_dict['name'] = getoutput(f"egrep '^DISTRIB_DESCRIPTION|^PRETTY_NAME' {lsb_release_path}"
-                                     " | head -n 1 | cut -d'=' -f 2  | tr -d '\"'")[0]
-        lsb_dict['id'] = getoutput(f"egrep '^DISTRIB_ID|^ID' {lsb_release_path}"
-                                   " | head -n 1 | cut -d'=' -f 2  | tr -d '\"'")[0]
-        lsb_dict['codename'] = getoutput(f"egrep '^DISTRIB_CODENAME|^VERSION_CODENAME' {lsb_release_path}"
-                                         " | head -n 1 | cut -d'=' -f 2  | tr -d '\"'")[0]
-        lsb_dict['version'] = getoutput(f"egrep '^DISTRIB_RELEASE|^VERSION_ID|^VERSION' {lsb_release_path}"
-                                        " | head -n 1 | cut -d'=' -f 2  | tr -d '\"'")[0]
-
-    except Exception as detail:
-        print(f"ERROR (functions.get_lsb_release_info: {detail}")
+    keys = {'name': ('DISTRIB_DESCRIPTION', 'PRETTY_NAME'),
+            'id': ('DISTRIB_ID', 'ID'),
+            'codename': ('DISTRIB_CODENAME', 'VERSION_CODENAME'),
+            'version': ('DISTRIB_RELEASE', 'VERSION_ID', 'VERSION')}
+    lsb_dict = dict.fromkeys(keys, '')
+    found = set()
+    for release_file in get_release_files(root_dir):
+        try:
+            with open(file=release_file, mode='r', encoding='utf-8', errors='replace') as release_fle:
+                lines = release_fle.read().splitlines()
+        except OSError:
+            continue
+        for line in lines:
+            for key, prefixes in keys.items():
+                if key not in found and line.startswith(prefixes):
+                    found.add(key)
+                    value = line.split('=')
+                    lsb_dict[key] = value[1] if len(value) > 1 else value[0]
+                    lsb_dict[key] = lsb_dict[key].replace('"', '').strip()
+        if len(found) == len(keys):
+            break
     return lsb_dict
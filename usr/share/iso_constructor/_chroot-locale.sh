@@ -1,7 +1,7 @@
 #!/bin/bash
 
 # Extra locale specific packages
-# When adding locales: change code at the bottom of this script
+# When adding locales: add the locale to the case statement below
 zh_TW='libthai0 fonts-thai-tlwg im-config fcitx fcitx-table-thai fcitx-sunpinyin fcitx-libpinyin fcitx-googlepinyin fcitx-frontend-gtk3 fcitx-ui-classic fcitx-config-gtk'
 zh_SG='fonts-arphic-ukai fonts-arphic-uming im-config fcitx fcitx-sunpinyin fcitx-libpinyin fcitx-googlepinyin fcitx-frontend-gtk3 fcitx-ui-classic fcitx-config-gtk'
 zh_HK='fonts-arphic-ukai fonts-arphic-uming im-config fcitx fcitx-table-cantonhk fcitx-sunpinyin fcitx-libpinyin fcitx-googlepinyin fcitx-frontend-gtk3 fcitx-ui-classic fcitx-config-gtk'
@@ -30,14 +30,27 @@ function localizeLive() {
     fi
 }
 
+# Optional (non-interactive): locale (e.g. nl_NL) and timezone (e.g. Europe/Amsterdam)
+LOC=$1
+TZONE=$2
+
 # Set locale
-#echo "$LOC.UTF-8 UTF-8" >> /etc/locale.gen
-#locale-gen
-#update-locale LANG="$LOC.UTF-8"
-dpkg-reconfigure locales
+if [ -z "$LOC" ]; then
+    dpkg-reconfigure locales
+else
+    if ! grep -q "^$LOC.UTF-8 UTF-8" /etc/locale.gen; then
+        echo "$LOC.UTF-8 UTF-8" >> /etc/locale.gen
+    fi
+    locale-gen
+    update-locale LANG="$LOC.UTF-8"
+fi
 
 # Set timezone
-dpkg-reconfigure  tzdata
+if [ ! -z "$TZONE" ]; then
+    echo "$TZONE" > /etc/timezone
+elif [ -z "$LOC" ]; then
+    dpkg-reconfigure  tzdata
+fi
 TIMEZONE=$(cat /etc/timezone)
 rm /etc/localtime
 ln -sf /usr/share/zoneinfo/$TIMEZONE /etc/localtime
@@ -82,75 +95,78 @@ fi
 # Update cache before installing packages
 apt-get update
 
-# Install language packages for several applications
+# Load the package index and the installed packages once
+declare -A AVAILABLE INSTALLED
+while read -r PCK; do
+    AVAILABLE[$PCK]=1
+done < <(apt-cache pkgnames)
+while read -r PCK; do
+    INSTALLED[$PCK]=1
+done < <(dpkg-query -W -f='${db:Status-Abbrev} ${Package}\n' | awk '/^ii/ {print $2}')
+
+# Resolve localisation packages: prefer the extended language code
+L10NPACKAGES=()
+MISSING=()
+function add_l10n() {
+    PREFIX=$1
+    CHKLAN=$2
+    if [ ! -z "${AVAILABLE[$PREFIX-$CHKLAN]}" ]; then
+        L10NPACKAGES+=("$PREFIX-$CHKLAN")
+    elif [ ! -z "${AVAILABLE[$PREFIX-$BASELAN]}" ]; then
+        L10NPACKAGES+=("$PREFIX-$BASELAN")
+    else
+        MISSING+=("$PREFIX-$BASELAN")
+    fi
+}
+
+# Language packages for several applications
 CHKLAN="$BASELAN$EXTLANL"
-if dpkg -l | grep -q ' kde-runtime '; then
-    LAN=$BASELAN
-    apt-cache -q show kde-l10n-$CHKLAN >/dev/null 2>&1 && LAN=$CHKLAN
-    eval $APT install kde-l10n-$LAN
-fi
-if dpkg -l | grep -q ' calligra '; then
-    LAN=$BASELAN
-    apt-cache -q show calligra-l10n-$CHKLAN >/dev/null 2>&1 && LAN=$CHKLAN
-    eval $APT install calligra-l10n-$LAN
-fi
+[ ! -z "${INSTALLED[kde-runtime]}" ] && add_l10n kde-l10n $CHKLAN
+[ ! -z "${INSTALLED[calligra]}" ] && add_l10n calligra-l10n $CHKLAN
 
 CHKLAN="$BASELAN-$EXTLANL"
-LAN=$BASELAN
-apt-cache -q show hunspell-$CHKLAN >/dev/null 2>&1 && LAN=$CHKLAN
-eval $APT install hunspell-$LAN
-
-FF=false
-if dpkg -l | grep -q ' firefox '; then
-    FF=true
-    LAN=$BASELAN
-    apt-cache -q show firefox-l10n-$CHKLAN >/dev/null 2>&1 && LAN=$CHKLAN
-    eval $APT install firefox-l10n-$LAN
-fi
-if dpkg -l | grep -q ' firefox-esr '; then
-    FF=true
-    LAN=$BASELAN
-    apt-cache -q show firefox-esr-l10n-$CHKLAN >/dev/null 2>&1 && LAN=$CHKLAN
-    eval $APT install firefox-esr-l10n-$LAN
-fi
-
-if dpkg -l | grep -q ' thunderbird '; then
-    LAN=$BASELAN
-    apt-cache -q show thunderbird-l10n-$CHKLAN >/dev/null 2>&1 && LAN=$CHKLAN
-    eval $APT install thunderbird-l10n-$LAN
-    # lightning-l10n is now integrated in thunderbird-l10n
-    #if dpkg -l | grep -q ' lightning '; then
-    #  apt-cache -q show lightning-l10n-$CHKLAN >/dev/null 2>&1 && LAN=$CHKLAN
-    #  eval $APT install lightning-l10n-$LAN
-    #fi
-fi
-
-if dpkg -l | grep -q ' libreoffice '; then
-    LAN=$BASELAN
-    apt-cache -q show libreoffice-l10n-$CHKLAN >/dev/null 2>&1 && LAN=$CHKLAN
-    eval $APT install libreoffice-l10n-$LAN
-    LAN=$BASELAN
-    apt-cache -q show libreoffice-help-$CHKLAN >/dev/null 2>&1 && LAN=$CHKLAN
-    eval $APT install libreoffice-help-$LAN
-fi
-
-if dpkg -l | grep -q ' icedove '; then
-    LAN=$BASELAN
-    apt-cache -q show icedove-l10n-$CHKLAN >/dev/null 2>&1 && LAN=$CHKLAN
-    eval $APT install icedove-l10n-$LAN
-fi
-
-if dpkg -l | grep -q ' iceowl '; then
-    LAN=$BASELAN
-    apt-cache -q show iceowl-l10n-$CHKLAN >/dev/null 2>&1 && LAN=$CHKLAN
-    eval $APT install iceowl-l10n-$LAN
+add_l10n hunspell $CHKLAN
+[ ! -z "${INSTALLED[firefox]}" ] && add_l10n firefox-l10n $CHKLAN
+[ ! -z "${INSTALLED[firefox-esr]}" ] && add_l10n firefox-esr-l10n $CHKLAN
+# lightning-l10n is now integrated in thunderbird-l10n
+[ ! -z "${INSTALLED[thunderbird]}" ] && add_l10n thunderbird-l10n $CHKLAN
+if [ ! -z "${INSTALLED[libreoffice]}" ]; then
+    add_l10n libreoffice-l10n $CHKLAN
+    add_l10n libreoffice-help $CHKLAN
 fi
+[ ! -z "${INSTALLED[icedove]}" ] && add_l10n icedove-l10n $CHKLAN
+[ ! -z "${INSTALLED[iceowl]}" ] && add_l10n iceowl-l10n $CHKLAN
+[ ! -z "${INSTALLED[iceweasel]}" ] && add_l10n iceweasel-l10n $CHKLAN
+
+# Add the available packages of a list (wildcards are matched against the package index)
+function add_packages() {
+    local PCK PCKS MATCH FOUND
+    # read does not expand the wildcards against the current directory
+    read -ra PCKS <<< "$1"
+    for PCK in "${PCKS[@]}"; do
+        if [[ "$PCK" != *[*?[]* ]]; then
+            if [ ! -z "${AVAILABLE[$PCK]}" ]; then
+                L10NPACKAGES+=("$PCK")
+            else
+                MISSING+=("$PCK")
+            fi
+            continue
+        fi
+        FOUND=false
+        for MATCH in "${!AVAILABLE[@]}"; do
+            if [[ "$MATCH" == $PCK ]]; then
+                L10NPACKAGES+=("$MATCH")
+                FOUND=true
+            fi
+        done
+        $FOUND || MISSING+=("$PCK")
+    done
+}
 
-if dpkg -l | grep -q ' iceweasel '; then
-    LAN=$BASELAN
-    apt-cache -q show iceweasel-l10n-$CHKLAN >/dev/null 2>&1 && LAN=$CHKLAN
-    eval $APT install iceweasel-l10n-$LAN
-fi
+# Locale specific packages
+case "$LOCALE" in
+    zh_TW|zh_SG|zh_HK|zh_CN|ko_KR|ja_JP) add_packages "${!LOCALE}" ;;
+esac
 
 # Mozilla locale configuration
 . /etc/default/locale
@@ -167,11 +183,11 @@ for INI in $(dpkg -S distribution.ini 2>/dev/null | egrep 'firefox|thunderbird'
     fi
 done
 
-# Install locale specific packages
-if [ "$LOCALE" == "zh_TW" ]; then eval $APT install $zh_TW; fi
-if [ "$LOCALE" == "zh_SG" ]; then eval $APT install $zh_SG; fi
-if [ "$LOCALE" == "zh_HK" ]; then eval $APT install $zh_HK; fi
-if [ "$LOCALE" == "zh_CN" ]; then eval $APT install $zh_CN; fi
-if [ "$LOCALE" == "ko_KR" ]; then eval $APT install $ko_KR; fi
-if [ "$LOCALE" == "ja_JP" ]; then eval $APT install $ja_JP; fi
-
+# Install all localisation packages in a single transaction
+echo "> Localisation packages for $LOCALE: ${L10NPACKAGES[*]}"
+if [ ${#MISSING[@]} -gt 0 ]; then
+    echo "> Not available for $LOCALE: ${MISSING[*]}"
+fi
+if [ ${#L10NPACKAGES[@]} -gt 0 ]; then
+    eval $APT install ${L10NPACKAGES[@]}
+fi
@@ -2,6 +2,47 @@
 
 DISTPATH=$1
 SHAREDIR='/usr/share/iso_constructor'
+LIBDIR='/usr/lib/iso_constructor'
+
+# Build settings (can be overridden in $DISTPATH/build.conf)
+# INCREMENTAL: stack delta squashfs layers on the last full squashfs
+# MAXLAYERS/MAXDELTAPERCENT: recompact into a full squashfs when the number of layers
+# or the total layer size (percentage of the full squashfs) is exceeded
+# ZSYNC: create a zsync control file of the ISO (ZSYNCURL: URL of the download directory)
+# XDELTA: keep the previous ISO and create a binary delta (xdelta3) from it to the new ISO
+# REPRODUCIBLE: derive all timestamps from SOURCE_DATE_EPOCH (default: modification time
+# of the newest dpkg package list), so the same root builds the same ISO (see reproducible.py)
+# TMPFSBUILD: stage the squashfs, efi.img and md5sum.txt on tmpfs when there is enough memory
+# RESUME: continue an interrupted build from its first incomplete stage (see buildstate.py)
+INCREMENTAL=false
+MAXLAYERS=3
+MAXDELTAPERCENT=20
+ZSYNC=false
+ZSYNCURL=''
+XDELTA=false
+REPRODUCIBLE=${REPRODUCIBLE:-false}
+TMPFSBUILD=false
+RESUME=${RESUME:-true}
+if [ -f "$DISTPATH/build.conf" ]; then
+    . "$DISTPATH/build.conf"
+fi
+SQUASHFSOPTS=''
+if $REPRODUCIBLE; then
+    # A reproducible build always starts over
+    RESUME=false
+fi
+
+# Locale matrix (optional): build one ISO per locale, e.g. "en_US,nl_NL,fr_FR"
+# Without argument the locales are read from $DISTPATH/locale-matrix (one locale per line)
+MATRIXLOCALES=$2
+if [ -z "$MATRIXLOCALES" ] && [ -f "$DISTPATH/locale-matrix" ]; then
+    MATRIXLOCALES=$(cat "$DISTPATH/locale-matrix")
+fi
+MATRIXLOCALES=$(echo $MATRIXLOCALES | tr ',' ' ')
+if [ ! -z "$MATRIXLOCALES" ]; then
+    # Locale deltas are stacked on a single base squashfs
+    INCREMENTAL=false
+fi
 
 DESKTOPENV='kde'
 if [ -e /usr/bin/startxfce4 ]; then
@@ -23,6 +64,26 @@ if [ -z "$ISOHDPFX" ]; then
     echo 'Cannot find path to isohdpfx.bin - install isolinux - exiting'
     exit 3
 fi
+# Check the tools, boot files and free space before the expensive stages (see preflight.py)
+if ! python3 "$LIBDIR/preflight.py" "$DISTPATH" "$MATRIXLOCALES"; then
+    exit 4
+fi
+
+# Wait for background jobs (prefetch) in this work directory
+exec 9>"$DISTPATH/.iso-constructor.lock"
+flock 9
+
+# Journal the stages with their inputs and outputs: an interrupted build is resumed
+STATE="$LIBDIR/buildstate.py"
+function skip_stage() {
+    python3 "$STATE" skip "$DISTPATH" "$@"
+}
+function end_stage() {
+    python3 "$STATE" end "$DISTPATH" "$@"
+}
+if ! $RESUME || ! python3 "$STATE" resume "$DISTPATH" "$MATRIXLOCALES" "$REPRODUCIBLE"; then
+    python3 "$STATE" start "$DISTPATH" "$MATRIXLOCALES" "$REPRODUCIBLE"
+fi
 
 # Chroot into distribution root directory and cleanup first
 USERDIR="/home/$(logname)/.iso-constructor"
@@ -35,16 +96,30 @@ if [ -f "$USERDIR/keep-packages" ]; then
 fi
 
 # Run configuration script
-cp -v "$SHAREDIR/_chroot-configure.sh" "$DISTPATH/root/"
-bash $SHAREDIR/chroot-dir.sh "$DISTPATH/root" "bash /_chroot-configure.sh"
-rm -f "$DISTPATH/root/_chroot-configure.sh"
-echo
+if ! skip_stage configure "$SHAREDIR/_chroot-configure.sh"; then
+    bash $SHAREDIR/chroot-dir.sh "$DISTPATH/root" "bash /_chroot-configure.sh" "$SHAREDIR/_chroot-configure.sh"
+    end_stage configure "$DISTPATH/root"
+    echo
+fi
 
 # Run cleanup script
-cp -v "$SHAREDIR/_chroot-cleanup.sh" "$DISTPATH/root/"
-bash $SHAREDIR/chroot-dir.sh "$DISTPATH/root" "bash /_chroot-cleanup.sh \"$KEEPPACKAGES\""
-rm -f "$DISTPATH/root/_chroot-cleanup.sh"
-echo
+if ! skip_stage cleanup "$SHAREDIR/_chroot-cleanup.sh" "$SHAREDIR/keep-packages" "$USERDIR/keep-packages"; then
+    bash $SHAREDIR/chroot-dir.sh "$DISTPATH/root" "bash /_chroot-cleanup.sh \"$KEEPPACKAGES\"" "$SHAREDIR/_chroot-cleanup.sh"
+    end_stage cleanup "$DISTPATH/root"
+    echo
+fi
+
+# Reproducible build: derive the epoch after the configure and cleanup stages.
+# dpkg rewrites its status file on every run, a package list only when the package is (un)installed.
+if $REPRODUCIBLE; then
+    if [ -z "$SOURCE_DATE_EPOCH" ]; then
+        SOURCE_DATE_EPOCH=$(python3 "$LIBDIR/reproducible.py" epoch "$DISTPATH")
+    fi
+    # Also used by mtools and xorriso
+    export SOURCE_DATE_EPOCH
+    SQUASHFSOPTS="-mkfs-time $SOURCE_DATE_EPOCH -all-time $SOURCE_DATE_EPOCH"
+    echo "> Reproducible build: SOURCE_DATE_EPOCH=$SOURCE_DATE_EPOCH"
+fi
 
 # Global variables
 ARCH=$(file "$DISTPATH/root/bin/ls" | egrep -oh 'x86-64|i386' | head -n 1 | tr - _)
@@ -54,13 +129,18 @@ case $ARCH in
 esac
 DESCRIPTION=$(egrep '^DISTRIB_DESCRIPTION|^PRETTY_NAME' "$DISTPATH/root/etc/"*release | head -n 1 | cut -d'=' -f 2  | sed s'/(.*)//g;s/gnu//I;s/linux//I;s/bit//I;s/[/"\-]//g;s/ \+/ /g')
 CODENAME=$(egrep '^DISTRIB_CODENAME|^VERSION_CODENAME' "$DISTPATH/root/etc/"*release | head -n 1 | cut -d'=' -f 2  | tr -d ' "_\-')
-SHORTDATE=$(date +"%Y%m")
-ISODATE=$(date +"%FT%T")
-MODDATE=$(date +"%Y%m%d%H%M%S00")
-ISOFILENAME=$(echo $DESCRIPTION | tr ' ' '_' | cut -d'-' -f 1 | tr '[:upper:]' '[:lower:]')"_$SHORTDATE"
+DATECMD=(date)
+if $REPRODUCIBLE; then
+    DATECMD=(date -u -d "@$SOURCE_DATE_EPOCH")
+fi
+SHORTDATE=$("${DATECMD[@]}" +"%Y%m")
+ISODATE=$("${DATECMD[@]}" +"%FT%T")
+MODDATE=$("${DATECMD[@]}" +"%Y%m%d%H%M%S00")
+BASEFILENAME=$(echo $DESCRIPTION | tr ' ' '_' | cut -d'-' -f 1 | tr '[:upper:]' '[:lower:]')"_$SHORTDATE"
+ISOFILENAME=$BASEFILENAME
 LOCALIZED=$(grep -oP '(?<=LANG=).*?(?=_)' "$DISTPATH/root/etc/default/locale" | grep -v 'en')
 if [ ! -z "$LOCALIZED" ]; then
-    ISOFILENAME="$ISOFILENAME_$LOCALIZED"
+    ISOFILENAME="${ISOFILENAME}_$LOCALIZED"
 fi
 ISOFILENAME="$ISOFILENAME.iso"
 # deb822-proof debian release command
@@ -155,7 +235,7 @@ mkdir -p "$DISTPATH/boot/live"
 mkdir -p "$DISTPATH/boot/.disk"
 touch "$DISTPATH/boot/.disk/base_installable"
 touch "$DISTPATH/boot/.disk/udeb_include"
-echo "$DESCRIPTION Live $(date +"%Y%m") $DESKTOPENV $ISODATE" > "$DISTPATH/boot/.disk/info"
+echo "$DESCRIPTION Live $SHORTDATE $DESKTOPENV $ISODATE" > "$DISTPATH/boot/.disk/info"
 if [ ! -e "$DISTPATH/boot/.disk/base_components" ]; then
     echo 'main' > "$DISTPATH/boot/.disk/base_components"
 fi
@@ -170,31 +250,178 @@ live-installer
 EOF
 
 # Copy system boot files (initrd, vmlinuz, etc) to live directory 
-rm -r "$DISTPATH/boot/live/"*
+LIVEDIR="$DISTPATH/boot/live"
+
+# Squashfs files on tmpfs are bind mounted into the live directory until the build ends
+TMPFSDIR="$DISTPATH/.tmpfs"
+SCRATCHDIR="$DISTPATH"
+function release_tmpfs() {
+    # Move the squashfs files that are still in the live directory to disk.
+    # When the build ends (release_tmpfs exit) they are only written to disk when the next build
+    # or bootprofile.py needs them: incremental layers, xdelta, the boot order or a resumed build.
+    KEEPSQUASHFS=true
+    if [ "$1" == 'exit' ] && ! $INCREMENTAL && ! $XDELTA && [ ! -f "$DISTPATH/boot-order" ]; then
+        if ! $RESUME || ! python3 "$STATE" interrupted "$DISTPATH"; then
+            KEEPSQUASHFS=false
+        fi
+    fi
+    for F in "$TMPFSDIR/"*.squashfs; do
+        if mountpoint -q "$LIVEDIR/${F##*/}"; then
+            umount "$LIVEDIR/${F##*/}"
+            if $KEEPSQUASHFS; then
+                mv -f "$F" "$LIVEDIR/${F##*/}"
+            else
+                # The size estimates of memplan.py use the compression ratio
+                if [ "${F##*/}" == 'filesystem.squashfs' ]; then
+                    stat -c %s "$F" > "$DISTPATH/.squashfs-size"
+                fi
+                rm -f "$F" "$LIVEDIR/${F##*/}"
+            fi
+        fi
+    done
+    if mountpoint -q "$TMPFSDIR"; then
+        umount "$TMPFSDIR"
+    fi
+    rmdir "$TMPFSDIR" 2>/dev/null
+    SCRATCHDIR="$DISTPATH"
+}
+# Release the tmpfs of an interrupted build
+release_tmpfs
+
+# Size mksquashfs -mem for the concurrent builds and decide on tmpfs staging (see memplan.py)
+MEMARGS=()
+if $TMPFSBUILD; then
+    MEMARGS+=(--tmpfs)
+fi
+read SQUASHFSMEM TMPFSSIZE < <(python3 "$LIBDIR/memplan.py" "${MEMARGS[@]}" "$DISTPATH")
+if [ -n "$SQUASHFSMEM" ]; then
+    SQUASHFSOPTS="$SQUASHFSOPTS -mem $SQUASHFSMEM"
+fi
+if [ "${TMPFSSIZE:-0}" -gt 0 ]; then
+    mkdir -p "$TMPFSDIR"
+    if mount -t tmpfs -o "size=$TMPFSSIZE,mode=0700" tmpfs "$TMPFSDIR"; then
+        SCRATCHDIR="$TMPFSDIR"
+        trap 'release_tmpfs exit' EXIT
+    else
+        rmdir "$TMPFSDIR"
+    fi
+fi
+
+# Create a squashfs in the live directory: make_squashfs SOURCE NAME OPTIONS
+# On tmpfs the squashfs is bind mounted into the live directory, or created on disk when tmpfs is full
+function make_squashfs() {
+    if [ "$SCRATCHDIR" == "$TMPFSDIR" ]; then
+        CMD="mksquashfs \"$1\" \"$TMPFSDIR/$2\" $3"
+        echo $CMD
+        if eval $CMD; then
+            touch "$LIVEDIR/$2"
+            mount --bind "$TMPFSDIR/$2" "$LIVEDIR/$2"
+            return 0
+        fi
+        echo "> Cannot stage $2 on tmpfs - build on disk"
+        rm -f "$TMPFSDIR/$2"
+        release_tmpfs
+    fi
+    CMD="mksquashfs \"$1\" \"$LIVEDIR/$2\" $3"
+    echo $CMD
+    eval $CMD
+}
+
+# Remove a squashfs from the live directory (and from tmpfs)
+function remove_squashfs() {
+    if mountpoint -q "$LIVEDIR/$1"; then
+        umount "$LIVEDIR/$1"
+    fi
+    rm -f "$LIVEDIR/$1" "$TMPFSDIR/$1"
+}
+
+if $INCREMENTAL || python3 "$STATE" done "$DISTPATH" squashfs; then
+    # Keep the squashfs layers (or the squashfs of the interrupted build)
+    find "$LIVEDIR" -mindepth 1 -maxdepth 1 ! -name "*.squashfs" ! -name "filesystem.module" -exec rm -r {} +
+else
+    rm -r "$LIVEDIR/"*
+fi
 cp -vf "$DISTPATH/root/boot/"* "$DISTPATH/boot/live/" 2>/dev/null
 
 # Generate grub.cfg / isolinux.cfg
 cp "$SHAREDIR/_grubgen.sh" "$DISTPATH/boot/"
-cp "$SHAREDIR/_isolinuxgen.sh" "$DISTPATH/boot/"
 cd "$DISTPATH/boot"
 bash _grubgen.sh
-bash _isolinuxgen.sh
 rm *.sh
+python3 "$LIBDIR/bootmenu.py" "$DISTPATH"
+
+# Use half of the cpu cores
+NRCORES=$(egrep '^cpu cores.*([0-9])' /proc/cpuinfo | head -n 1 | cut -d':' -f 2 | tr -d ' ')
+AVCORES=$((NRCORES / 2))
+if [ -z "$AVCORES" ] || [ "$AVCORES" -lt 1 ]; then
+    AVCORES=1
+fi
+
+# Resumed build: keep the squashfs when the root did not change
+SQUASHFSSTAGE=true
+if skip_stage squashfs "$DISTPATH/root" "$SHAREDIR/excludes" "$DISTPATH/boot-order"; then
+    SQUASHFSSTAGE=false
+fi
+
+# Incremental build: compress only the changes since the last full squashfs
+LAYERSDIR="$DISTPATH/layers"
+MANIFEST="$LAYERSDIR/manifest"
+FULLBUILD=$SQUASHFSSTAGE
+if $SQUASHFSSTAGE && $INCREMENTAL && [ -f "$MANIFEST" ] && [ -f "$LIVEDIR/filesystem.squashfs" ]; then
+    NRLAYERS=$(find "$LIVEDIR" -maxdepth 1 -name "layer-*.squashfs" | wc -l)
+    if [ $NRLAYERS -lt $MAXLAYERS ]; then
+        LAYER="layer-$(printf '%02d' $((NRLAYERS + 1))).squashfs"
+        STAGEDIR="${LAYERSDIR:?}/stage"
+        rm -rf "$STAGEDIR"
+        python3 "$LIBDIR/layers.py" delta "$DISTPATH/root" "$MANIFEST" "$STAGEDIR" "$SHAREDIR/excludes"
+        make_squashfs "$STAGEDIR/" "$LAYER" "-comp xz -noappend -processors $AVCORES $SQUASHFSOPTS"
+        rm -rf "$STAGEDIR"
 
-# check for custom mksquashfs (for multi-threading, new features, etc.)
-if [ -z "$MKSQUASHFS" ] || [ "$MKSQUASHFS" == 'mksquashfs' ]; then
-    # Use half of the cpu cores
-    NRCORES=$(egrep '^cpu cores.*([0-9])' /proc/cpuinfo | head -n 1 | cut -d':' -f 2 | tr -d ' ')
-    AVCORES=$((NRCORES / 2))
-    if [ -z "$AVCORES" ] || [ "$AVCORES" -lt 1 ]; then
-        AVCORES=1
+        BASESIZE=$(stat -c %s "$LIVEDIR/filesystem.squashfs")
+        DELTASIZE=$(du -cb "$LIVEDIR/"layer-*.squashfs | tail -n 1 | cut -f 1)
+        if [ $((DELTASIZE * 100)) -le $((BASESIZE * MAXDELTAPERCENT)) ]; then
+            mv -f "$MANIFEST.new" "$MANIFEST"
+            python3 "$LIBDIR/journal.py" reset "$DISTPATH/root" "$MANIFEST"
+            # Tell live-boot to stack the layers on top of the base squashfs
+            echo 'filesystem.squashfs' > "$LIVEDIR/filesystem.module"
+            find "$LIVEDIR" -maxdepth 1 -name "layer-*.squashfs" -printf '%f\n' | sort >> "$LIVEDIR/filesystem.module"
+            echo "> Added squashfs layer: $LAYER"
+            FULLBUILD=false
+        else
+            echo "> Layers exceed $MAXDELTAPERCENT% of the full squashfs - recompact"
+        fi
+    else
+        echo "> Maximum number of layers ($MAXLAYERS) reached - recompact"
     fi
-    # Create squashfs file
-    CMD="mksquashfs \"$DISTPATH/root/\" \"$DISTPATH/boot/live/filesystem.squashfs\" -comp xz -processors $AVCORES -wildcards -ef \"$SHAREDIR/excludes\""
-    echo $CMD
-    eval $CMD
-else
-    eval "$MKSQUASHFS \"$DISTPATH/root\" \"$DISTPATH/boot/live/filesystem.squashfs\""
+fi
+
+if $FULLBUILD; then
+    for F in "$LIVEDIR/"*.squashfs; do
+        remove_squashfs "${F##*/}"
+    done
+    rm -f "$LIVEDIR/filesystem.module" "$MANIFEST" "$MANIFEST.new" "$DISTPATH/root.journal" "$DISTPATH/boot-order.sort"
+    # check for custom mksquashfs (for multi-threading, new features, etc.)
+    if [ -z "$MKSQUASHFS" ] || [ "$MKSQUASHFS" == 'mksquashfs' ]; then
+        # Create squashfs file
+        OPTS="-comp xz -processors $AVCORES -wildcards -ef \"$SHAREDIR/excludes\" $SQUASHFSOPTS"
+        # Store the files that are read during boot first (see bootprofile.py)
+        if [ -f "$DISTPATH/boot-order" ]; then
+            python3 "$LIBDIR/bootprofile.py" sortfile "$DISTPATH" "$DISTPATH/boot-order.sort" && \
+                OPTS="$OPTS -sort \"$DISTPATH/boot-order.sort\""
+        fi
+        make_squashfs "$DISTPATH/root/" filesystem.squashfs "$OPTS"
+    else
+        eval "$MKSQUASHFS \"$DISTPATH/root\" \"$LIVEDIR/filesystem.squashfs\""
+    fi
+    # Save the manifest of the base squashfs
+    if $INCREMENTAL; then
+        python3 "$LIBDIR/layers.py" manifest "$DISTPATH/root" "$MANIFEST" "$SHAREDIR/excludes"
+        # Journal the changes until the next build (see chroot-dir.sh)
+        python3 "$LIBDIR/journal.py" reset "$DISTPATH/root" "$MANIFEST"
+    fi
+fi
+if $SQUASHFSSTAGE; then
+    end_stage squashfs "$LIVEDIR/"*.squashfs "$LIVEDIR/filesystem.module"
 fi
 
 # Update isolinux files
@@ -230,39 +457,195 @@ else
     echo 'Could not find /boot/grub/grub.cfg!'
 fi
 EOF
-    dd if=/dev/zero of=$DISTPATH/boot/boot/grub/efi.img bs=1M count=5
-    mkfs.vfat $DISTPATH/boot/boot/grub/efi.img 
-    mmd -i $DISTPATH/boot/boot/grub/efi.img EFI EFI/boot boot boot/grub
-    mcopy -vi $DISTPATH/boot/boot/grub/efi.img "$DISTPATH/boot/EFI/boot/bootx64.efi" ::EFI/boot/
-    mcopy -vi $DISTPATH/boot/boot/grub/efi.img "$DISTPATH/boot/EFI/boot/grubx64.efi" ::EFI/boot/
-    mcopy -vi $DISTPATH/boot/boot/grub/efi.img "$DISTPATH/grub.cfg" ::boot/grub/
+    EFIIMG="$SCRATCHDIR/efi.img"
+    dd if=/dev/zero of=$EFIIMG bs=1M count=5
+    VFATOPTS=''
+    MCOPYOPTS='-v'
+    if $REPRODUCIBLE; then
+        # Fixed volume id and file dates
+        VFATOPTS="-i $(printf '%08x' $((SOURCE_DATE_EPOCH & 0xffffffff)))"
+        if mkfs.vfat --help 2>&1 | grep -q -- '--invariant'; then
+            VFATOPTS="$VFATOPTS --invariant"
+        fi
+        MCOPYOPTS='-vm'
+        touch -d "@$SOURCE_DATE_EPOCH" "$DISTPATH/boot/EFI/boot/bootx64.efi" "$DISTPATH/boot/EFI/boot/grubx64.efi" "$DISTPATH/grub.cfg"
+    fi
+    mkfs.vfat $VFATOPTS $EFIIMG 
+    mmd -i $EFIIMG EFI EFI/boot boot boot/grub
+    mcopy $MCOPYOPTS -i $EFIIMG "$DISTPATH/boot/EFI/boot/bootx64.efi" ::EFI/boot/
+    mcopy $MCOPYOPTS -i $EFIIMG "$DISTPATH/boot/EFI/boot/grubx64.efi" ::EFI/boot/
+    mcopy $MCOPYOPTS -i $EFIIMG "$DISTPATH/grub.cfg" ::boot/grub/
+    mv -f $EFIIMG $DISTPATH/boot/boot/grub/efi.img
     rm $DISTPATH/grub.cfg
 fi
 
-# remove existing iso
-rm "$DISTPATH/"*.iso* 2>/dev/null
+# Keep the previous ISO and the snapshot of its content for the delta
+# (a resumed build moved it before it was interrupted)
+PREVDIR="$DISTPATH/previous"
+if $XDELTA && [ -z "$MATRIXLOCALES" ]; then
+    PREVISO=$(ls "$DISTPATH/"*.iso 2>/dev/null | head -n 1)
+    if [ -n "$PREVISO" ]; then
+        rm -rf "${PREVDIR:?}"
+        mkdir -p "$PREVDIR"
+        mv -f "$PREVISO" "$PREVDIR/"
+        mv -f "$DISTPATH/.iso-snapshot/"* "$PREVDIR/" 2>/dev/null
+    fi
+elif $XDELTA; then
+    # Locale matrix: a previous ISO and snapshot per locale (artifacts.py --slot)
+    for SLOTDIR in "$DISTPATH/.iso-snapshot/"*/; do
+        LOC=$(basename "$SLOTDIR")
+        PREVISO="$DISTPATH/$(cat "$SLOTDIR/iso" 2>/dev/null)"
+        # Skip the ISOs that a resumed build already made
+        if [ ! -f "$PREVISO" ] || python3 "$STATE" done "$DISTPATH" "iso-$LOC"; then
+            continue
+        fi
+        rm -rf "${PREVDIR:?}/${LOC:?}"
+        mkdir -p "$PREVDIR/$LOC"
+        mv -f "$PREVISO" "$PREVDIR/$LOC/"
+        mv -f "$SLOTDIR"* "$PREVDIR/$LOC/"
+    done
+else
+    rm -rf "${PREVDIR:?}"
+fi
+
+# remove existing iso (except the ISOs of a resumed locale matrix build)
+python3 "$STATE" clean "$DISTPATH"
+
+# Create the ISO (and sha256 file) from the boot directory
+function make_iso() {
+    ISOFILENAME=$1
+
+    XORRISOOPTS=''
+    if $REPRODUCIBLE; then
+        # The GPT disk GUID is derived from the modification date
+        XORRISOOPTS="--set_all_file_dates set_to_mtime --gpt_disk_guid modification-date"
+    fi
+    CMD="xorriso -as mkisofs -R -r -J -joliet-long -l -iso-level 3 -isohybrid-mbr ${ISOHDPFX} -partition_offset 16 -A \"${CODENAME} Live\" -publisher \"${CODENAME} Live project; https://solydxk.com\" -V \"${CODENAME^^}\" --modification-date=${MODDATE} -b isolinux/isolinux.bin -c isolinux/boot.cat -no-emul-boot -boot-load-size 4 -boot-info-table -eltorito-alt-boot -e boot/grub/efi.img -no-emul-boot -isohybrid-gpt-basdat -isohybrid-apm-hfsplus ${XORRISOOPTS} -o \"${ISOFILENAME}\" boot"
+
+    # Save the xorriso command to mkisofs file (before the checksums: it is part of this ISO)
+    echo "$CMD" > "$DISTPATH/boot/.disk/mkisofs"
+
+    cd "$DISTPATH/boot"
 
-# Create an md5sum file for the isolinux/grub integrity check
-cat >'md5sum.txt' <<EOF
+    # Create an md5sum file for the isolinux/grub integrity check
+    MD5FILE="$SCRATCHDIR/md5sum.txt"
+    cat >"$MD5FILE" <<EOF
 ## This file contains the list of md5 checksums of all files on this medium.
 ## You can verify them automatically with the 'verify-checksums' boot parameter
 ## or manually with: 'md5sum -c md5sum.txt'.
 EOF
-for F in $(find . -type f ! -name "md5sum.txt" ! -name "isolinux.bin" ! -name "boot.cat"); do
-    md5sum "$F" >> 'md5sum.txt'
-done
+    for F in $(find . -type f ! -name "md5sum.txt" ! -name "isolinux.bin" ! -name "boot.cat" | LC_ALL=C sort); do
+        md5sum "$F" >> "$MD5FILE"
+    done
+    mv -f "$MD5FILE" 'md5sum.txt'
 
-# build iso
-cd "$DISTPATH"
-CMD="xorriso -as mkisofs -R -r -J -joliet-long -l -iso-level 3 -isohybrid-mbr ${ISOHDPFX} -partition_offset 16 -A \"${CODENAME} Live\" -publisher \"${CODENAME} Live project; https://solydxk.com\" -V \"${CODENAME^^}\" --modification-date=${MODDATE} -b isolinux/isolinux.bin -c isolinux/boot.cat -no-emul-boot -boot-load-size 4 -boot-info-table -eltorito-alt-boot -e boot/grub/efi.img -no-emul-boot -isohybrid-gpt-basdat -isohybrid-apm-hfsplus -o \"${ISOFILENAME}\" boot"
-echo $CMD
-eval $CMD
+    if $REPRODUCIBLE; then
+        # No file is newer than SOURCE_DATE_EPOCH
+        find . -newermt "@$SOURCE_DATE_EPOCH" -print0 | xargs -0r touch -h -d "@$SOURCE_DATE_EPOCH"
+    fi
 
-# Save the xorriso command to mkisofs file
-echo "$CMD" > "./boot/.disk/mkisofs"
+    # build iso
+    cd "$DISTPATH"
+    echo $CMD
+    eval $CMD
+
+    # Create sha256 file
+    sha256sum "$ISOFILENAME" > "$ISOFILENAME.sha256"
+
+    echo
+    echo "Building $ISOFILENAME finished"
+}
+
+# Create the zsync file and the delta from the previous ISO
+# make_artifacts ISO [LOCALE]: the locale of a locale matrix ISO keeps its own previous ISO for the delta
+function make_artifacts() {
+    ARTARGS=()
+    if $ZSYNC; then
+        ARTARGS+=(--zsync)
+        if [ ! -z "$ZSYNCURL" ]; then
+            ARTARGS+=(--url "$ZSYNCURL")
+        fi
+    fi
+    if $XDELTA; then
+        ARTARGS+=(--delta)
+        if [ ! -z "$2" ]; then
+            ARTARGS+=(--slot "$2")
+        fi
+    fi
+    if [ ${#ARTARGS[@]} -gt 0 ]; then
+        python3 "$LIBDIR/artifacts.py" "${ARTARGS[@]}" "$DISTPATH" "$DISTPATH/$1"
+    fi
+}
 
-# Create sha256 file
-sha256sum "$ISOFILENAME" > "$ISOFILENAME.sha256"
+if [ -z "$MATRIXLOCALES" ]; then
+    make_iso "$ISOFILENAME"
+    make_artifacts "$ISOFILENAME"
+    end_stage iso "$DISTPATH/$ISOFILENAME" && python3 "$STATE" finish "$DISTPATH"
+    exit 0
+fi
 
-echo
-echo "Building $ISOFILENAME finished"
+# Locale matrix: the base filesystem.squashfs is shared by all locales.
+# Each locale gets a small delta squashfs (overlay upper directory) which live-boot stacks on top of the base.
+MATRIXDIR="$DISTPATH/matrix"
+MATRIXDONE=true
+MATRIXSTATUS=0
+for LOC in $MATRIXLOCALES; do
+    LAN=${LOC%%_*}
+    # Use the full locale when the language is used more than once (e.g. pt_BR and pt_PT)
+    if [ $(echo "$MATRIXLOCALES" | grep -o "\b${LAN}_" | wc -l) -gt 1 ]; then
+        LAN=${LOC,,}
+    fi
+    # The ISOs of a resumed build that are done
+    if skip_stage "iso-$LOC"; then
+        continue
+    fi
+    if [ "$LOC" == 'en_US' ]; then
+        make_iso "$BASEFILENAME.iso"
+        make_artifacts "$BASEFILENAME.iso" "$LOC"
+        end_stage "iso-$LOC" "$DISTPATH/$BASEFILENAME.iso" || MATRIXDONE=false
+        continue
+    fi
+
+    echo "> Localize $LOC"
+    LOCDIR="${MATRIXDIR:?}/${LOC:?}"
+    UPPER="$LOCDIR/upper"
+    MERGED="$LOCDIR/merged"
+    rm -rf "$LOCDIR"
+    mkdir -p "$UPPER" "$LOCDIR/work" "$MERGED"
+    LOCDONE=false
+    if mount -t overlay overlay -o "lowerdir=$DISTPATH/root,upperdir=$UPPER,workdir=$LOCDIR/work" "$MERGED"; then
+        cp -v "$SHAREDIR/_chroot-locale.sh" "$MERGED/" && \
+            bash $SHAREDIR/chroot-dir.sh "$MERGED" "bash /_chroot-locale.sh $LOC $(cat "$DISTPATH/root/etc/timezone" 2>/dev/null)" && \
+            bash $SHAREDIR/chroot-dir.sh "$MERGED" "apt-get clean" && \
+            LOCDONE=true
+        umount "$MERGED" || umount -l "$MERGED"
+    fi
+    # Do not ship an empty or partial delta
+    if ! $LOCDONE; then
+        echo "> Cannot localize $LOC - skip"
+        rm -rf "${LOCDIR:?}"
+        MATRIXDONE=false
+        MATRIXSTATUS=5
+        continue
+    fi
+
+    # Keep the delta small: no locale script, apt lists or caches
+    rm -rf "$UPPER/_chroot-locale.sh" "$UPPER/var/lib/apt/lists" "$UPPER/var/cache/apt" "$UPPER/tmp" "$UPPER/var/log"
+
+    # Create the delta squashfs and tell live-boot to stack it on the base squashfs
+    make_squashfs "$UPPER/" "$LOC.squashfs" "-comp xz -noappend -wildcards -ef \"$SHAREDIR/excludes\" $SQUASHFSOPTS"
+    printf "filesystem.squashfs\n$LOC.squashfs\n" > "$DISTPATH/boot/live/filesystem.module"
+
+    make_iso "${BASEFILENAME}_${LAN}.iso"
+    make_artifacts "${BASEFILENAME}_${LAN}.iso" "$LOC"
+    end_stage "iso-$LOC" "$DISTPATH/${BASEFILENAME}_${LAN}.iso" || MATRIXDONE=false
+
+    remove_squashfs "$LOC.squashfs"
+    rm -f "$DISTPATH/boot/live/filesystem.module"
+    rm -rf "$LOCDIR"
+done
+rm -rf "${MATRIXDIR:?}"
+if $MATRIXDONE; then
+    python3 "$STATE" finish "$DISTPATH"
+fi
+exit $MATRIXSTATUS
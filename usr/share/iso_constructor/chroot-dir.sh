@@ -2,6 +2,8 @@
 
 TARGET=$1
 COMMANDS=$2
+# Optional script that is copied to the root directory for this session only
+SCRIPT=$3
 
 if [ -z "${TARGET}" ]; then
     echo 'Missing target directory to chroot into - exiting'
@@ -14,11 +16,55 @@ if ! $(ls ${TARGET}{/run,/sys,/proc,/dev} >/dev/null 2>&1); then
 fi
 
 TMP=$(mktemp)
-trap 'rm -f ${TMP}' EXIT
 chmod u+x "${TMP}"
 
+# Journal the changed paths of a work directory's root while the session runs
+# (only when an incremental build started the journal: see journal.py)
+JOURNALPID=
+if [ "$(basename "${TARGET%/}")" == 'root' ]; then
+    # One job at a time in a work directory: wait for background jobs (prefetch)
+    # build.sh, upgrade.sh and prefetch.sh pass their lock on fd 9
+    LOCKFILE="$(dirname "${TARGET%/}")/.iso-constructor.lock"
+    if [ "$(readlink -f /proc/$$/fd/9)" != "$(readlink -f "${LOCKFILE}")" ]; then
+        exec 9>"${LOCKFILE}"
+    fi
+    if ! flock -n 9; then
+        echo "Waiting for the running job in $(dirname "${TARGET%/}")"
+        flock 9
+    fi
+    # Keep dedupe.py out while the session runs and
+    # give files that are hard linked to other work directories their own copy
+    # (before the watcher starts: the copies are identical and not journaled)
+    exec 8>"$(dirname "${TARGET%/}")/.chroot.lock"
+    flock -s 8
+    python3 /usr/lib/iso_constructor/dedupe.py protect "${TARGET%/}"
+    JOURNALPID=$(python3 /usr/lib/iso_constructor/journal.py watch "${TARGET%/}")
+fi
+function cleanup() {
+    rm -f "${TMP}"
+    # Remove the script while the watcher still journals the root
+    if [ ! -z "${SCRIPT}" ]; then
+        rm -f "${TARGET%/}/$(basename "${SCRIPT}")"
+    fi
+    if [ -f "${TARGET}/etc/resolv.conf.bak" ]; then
+        mv -f "${TARGET}/etc/resolv.conf.bak" "${TARGET}/etc/resolv.conf"
+    fi
+    if [ ! -z "${JOURNALPID}" ]; then
+        kill ${JOURNALPID} 2>/dev/null
+        while kill -0 ${JOURNALPID} 2>/dev/null; do sleep 0.1; done
+    fi
+}
+trap cleanup EXIT
+# Restore resolv.conf when the session is stopped (prefetch yields to other jobs)
+trap 'exit 143' TERM HUP
+
 set -e
 
+# The watcher is running: the script does not invalidate the journal
+if [ ! -z "${SCRIPT}" ]; then
+    cp -f "${SCRIPT}" "${TARGET%/}/"
+fi
+
 # Create bash to mount temporary API filesystems
 cat > "${TMP}"  <<END
 #!/bin/bash
@@ -41,8 +87,9 @@ export LC_ALL=C
 END
 
 # Enable networking in chroot environment
+# (an existing resolv.conf.bak is the original of an interrupted session: keep it)
 if [ ! -L "${TARGET}/etc/resolv.conf" ] && [ -e "/etc/resolv.conf" ]; then
-    if [ -f "${TARGET}/etc/resolv.conf" ]; then
+    if [ -f "${TARGET}/etc/resolv.conf" ] && [ ! -e "${TARGET}/etc/resolv.conf.bak" ]; then
         mv -f "${TARGET}/etc/resolv.conf" "${TARGET}/etc/resolv.conf.bak"
     fi
     cat "/etc/resolv.conf" > "${TARGET}/etc/resolv.conf"
@@ -61,8 +108,5 @@ else
 fi
 
 # Run program in new namespaces
+# (cleanup restores resolv.conf)
 unshare -m -- "${TMP}"
-
-if [ -f "${TARGET}/etc/resolv.conf.bak" ]; then
-    mv -f "${TARGET}/etc/resolv.conf.bak" "${TARGET}/etc/resolv.conf"
-fi
@@ -0,0 +1,56 @@
+#!/bin/bash
+# Download pending upgrades in the background
+# The actual upgrade (upgrade.sh) will then only need to install the packages
+
+DISTPATH=$1
+
+# Need to find current path
+# Because current directory is user home directory
+SCRIPTPATH="$( cd -- "$(dirname "$0")" >/dev/null 2>&1 ; pwd -P )"
+
+# Check before continue
+if [ -z "$DISTPATH" ] || [ ! -d "$DISTPATH/root" ]; then
+    echo 'Current path must contain the root directory - exiting'
+    exit 1
+fi
+
+# Run with the lowest cpu and io priority
+renice -n 19 -p $$ >/dev/null
+ionice -c 3 -p $$
+
+# Skip if another job (upgrade, build, prefetch) is running in this work directory
+exec 9>"$DISTPATH/.iso-constructor.lock"
+if ! flock -n 9; then
+    echo "$DISTPATH is busy - skip prefetch"
+    exit 0
+fi
+
+# Nothing is written to the root directory outside the chroot session:
+# that would invalidate the change journal (see journal.py)
+SCRIPTDIR=$(mktemp -d)
+trap 'rm -rf "$SCRIPTDIR"' EXIT
+trap 'exit 143' TERM HUP
+
+# Create a prefetch script (chroot-dir.sh copies it to the root directory)
+# The status is printed as the last line of the output
+cat > "$SCRIPTDIR/prefetch.sh" << EOF
+export DEBIAN_FRONTEND=noninteractive
+apt-get -q update
+apt-get -q -y --download-only dist-upgrade
+echo "PACKAGES=\$(apt-get -s dist-upgrade | grep -c '^Inst ')"
+EOF
+
+# Execute the script
+"${SCRIPTPATH}"/chroot-dir.sh "$DISTPATH/root" "bash /prefetch.sh" "$SCRIPTDIR/prefetch.sh" | tee "$SCRIPTDIR/prefetch.log"
+
+# Save the prefetch status in the work directory
+STATUS=$(grep '^PACKAGES=' "$SCRIPTDIR/prefetch.log" | tail -n 1)
+if [ ! -z "$STATUS" ]; then
+    BYTES=$(find "$DISTPATH/root/var/cache/apt/archives" -maxdepth 1 -name "*.deb" -printf '%s\n' | awk '{s+=$1} END {print s+0}')
+    echo "$STATUS" > "$DISTPATH/.prefetch"
+    echo "BYTES=$BYTES" >> "$DISTPATH/.prefetch"
+    echo "PREFETCHED=$(date +%s)" >> "$DISTPATH/.prefetch"
+fi
+
+echo
+echo "Prefetch finished: $DISTPATH"
@@ -4,8 +4,18 @@
 # Because current directory is user home directory
 SCRIPTPATH="$( cd -- "$(dirname "$0")" >/dev/null 2>&1 ; pwd -P )"
 
-# Create an upgrade script in the root directory
-cat > "$1/root/upgrade.sh" << EOF
+# Wait for background jobs (prefetch) in this work directory
+exec 9>"$1/.iso-constructor.lock"
+flock 9
+
+# Packages were downloaded by prefetch.sh: only install them
+PREFETCHED=false
+[ -f "$1/.prefetch" ] && PREFETCHED=true
+
+# Create an upgrade script (chroot-dir.sh copies it to the root directory)
+SCRIPTDIR=$(mktemp -d)
+trap 'rm -rf "$SCRIPTDIR"' EXIT
+cat > "$SCRIPTDIR/upgrade.sh" << EOF
 
 # Make this script unattended
 # https://debian-handbook.info/browse/stable/sect.automatic-upgrades.html
@@ -27,9 +37,13 @@ function start_stop_services () {
     [ -f '/etc/mysql/debian.cnf' ] && eval service mysql \$1
 }
 
-apt-get update
 start_stop_services start
-eval \$APT dist-upgrade
+if $PREFETCHED && eval \$APT --no-download dist-upgrade; then
+    echo 'Installed prefetched packages'
+else
+    apt-get update
+    eval \$APT dist-upgrade
+fi
 eval \$APT autopurge
 eval \$APT clean
 start_stop_services stop
@@ -38,6 +52,6 @@ echo
 echo 'Upgrade finished'
 EOF
 
-# Execute and remove the script when done
-"${SCRIPTPATH}"/chroot-dir.sh "$1/root" "bash /upgrade.sh"
-rm -f "$1/root/upgrade.sh" 
+# Execute the script
+"${SCRIPTPATH}"/chroot-dir.sh "$1/root" "bash /upgrade.sh" "$SCRIPTDIR/upgrade.sh"
+rm -f "$1/.prefetch"
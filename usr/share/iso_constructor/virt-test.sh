@@ -9,6 +9,9 @@ if [ $EUID -eq 0 ]; then
 fi
 
 DISTPATH=$1
+# With "base" the ISO is booted on the base image itself, e.g. to pre-install a system:
+# all other test runs start from that state
+BASEMODE=$2
 if [ ! -z "$DISTPATH" ]; then
     ISO=$(ls "$DISTPATH"/*.iso | head -n 1)
 fi
@@ -19,7 +22,9 @@ fi
 
 NAME="${ISO##*/}"
 NAME="${NAME%.*}"
-HDQCOW="$HOME/.iso-constructor/iso-constructor.qcow2"
+# Each test run gets its own throwaway overlay on the pristine base image
+BASEQCOW="$HOME/.iso-constructor/iso-constructor.qcow2"
+OVERLAYDIR="$HOME/.iso-constructor/overlays"
 
 if [ $UID -eq 0 ]; then
   notify-send -u critical -a "ISO Constructor" -i iso-constructor "Run this script as $(logname), not as root - exiting"
@@ -55,22 +60,69 @@ fi
 ((${UCPU}>=8)) && CPU=4
 ((${UCPU}>=16)) && CPU=8
 
-# Create image
-if [ ! -e "${HDQCOW}" ]; then
-    # Check if 25G space available for 20G hd image
-    AVAIL=$(df -k --output=avail "/tmp" | tail -n 1)
-    if [ ${AVAIL} -gt 26214400 ]; then
-        HDQCOW="--disk ${HDQCOW},size=20,format=qcow2"
+QEMUIMG=$(which qemu-img)
+if [ -z "$QEMUIMG" ]; then
+    notify-send -u critical -a "ISO Constructor" -i iso-constructor "qemu-img not installed - exiting"
+    exit 6
+fi
+
+# Create the base image (thin: it only grows when a system is installed in base mode)
+mkdir -p "$OVERLAYDIR"
+if [ ! -e "$BASEQCOW" ]; then
+    $QEMUIMG create -q -f qcow2 "$BASEQCOW" 20G
+fi
+
+# Remove the overlays (and guests) of test runs that were killed (the EXIT trap did not run):
+# the overlay name ends with the pid of its virt-test.sh
+for STALE in "$OVERLAYDIR"/*.qcow2; do
+    [ -e "$STALE" ] || continue
+    STALENAME=$(basename "$STALE" .qcow2)
+    if ! ps -p "${STALENAME##*-}" -o args= 2>/dev/null | grep -q 'virt-test.sh'; then
+        virsh undefine --nvram "$STALENAME" >/dev/null 2>&1
+        rm -f "$STALE"
+    fi
+done
+
+# Unique domain name: several ISOs, or one ISO several times, can be tested at once
+VMNAME="${NAME}-$$"
+if [ "$BASEMODE" == 'base' ]; then
+    # Overlays depend on the unchanged base image
+    if [ -n "$(find "$OVERLAYDIR" -name '*.qcow2' -print -quit)" ]; then
+        notify-send -u critical -a "ISO Constructor" -i iso-constructor "Test runs are using ${BASEQCOW} - exiting"
+        exit 7
+    fi
+    HDQCOW="--disk ${BASEQCOW},format=qcow2"
+else
+    # Check if there is space for the overlay to grow (5G)
+    AVAIL=$(df -k --output=avail "$OVERLAYDIR" | tail -n 1)
+    if [ ${AVAIL} -gt 5242880 ]; then
+        OVERLAY="$OVERLAYDIR/${VMNAME}.qcow2"
+        # Fails when the base image is locked, e.g. by a test run in base mode
+        if $QEMUIMG create -q -f qcow2 -b "$BASEQCOW" -F qcow2 "$OVERLAY"; then
+            HDQCOW="--disk ${OVERLAY},format=qcow2"
+        else
+            notify-send -u critical -a "ISO Constructor" -i iso-constructor "Missing hard drive" "Cannot create an overlay of ${BASEQCOW}.\n${ISO} will boot, but cannot be installed."
+            rm -f "$OVERLAY"
+            OVERLAY=""
+            HDQCOW=""
+        fi
     else
-        notify-send -u critical -a "ISO Constructor" -i iso-constructor "Missing hard drive" "${HDQCOW} cannot be created.\n${ISO} will boot, but cannot be installed."
+        notify-send -u critical -a "ISO Constructor" -i iso-constructor "Missing hard drive" "Not enough space in ${OVERLAYDIR}.\n${ISO} will boot, but cannot be installed."
         HDQCOW=""
     fi
-else
-    HDQCOW="--disk ${HDQCOW}"
 fi
 
+# Delete the guest and its overlay when the test ends: this is only for testing ISOs
+function cleanup() {
+    virsh undefine --nvram ${VMNAME} >/dev/null 2>&1
+    if [ -n "$OVERLAY" ]; then
+        rm -f "$OVERLAY"
+    fi
+}
+trap cleanup EXIT
+
 ARGS=(
- --name ${NAME}
+ --name ${VMNAME}
  --memory ${MEM}
  --memorybacking source.type=memfd,access.mode=shared
  --vcpus ${CPU}
@@ -97,7 +149,4 @@ echo "$VINST ${ARGS[@]}"
 echo
 eval "$VINST ${ARGS[@]}"
 
-# Delete the guest: this is only for testing ISOs
-virsh undefine --nvram ${NAME}
-
 exit 0